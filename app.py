@@ -11,14 +11,16 @@ The layout of this file is:
 '''
 import os
 import datetime as dt
+import functools
 import numpy as np
 import pandas as pd
-from matplotlib.cm import get_cmap as mpl_cmap
-from statsmodels.nonparametric.smoothers_lowess import lowess
+import flask
+import markupsafe
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 from plotly import subplots
 from plotly import graph_objects as go
@@ -36,18 +38,31 @@ if ENV == "local":
     import os
     os.chdir("C:/Users/adiad/Anaconda3/envs/SleepApp/sleep_app/")
 
-# this local module must be imported after navigating to the project root dir
-import update_garmin_sleep as garmin_get
+# these local modules must be imported after navigating to the project root dir
+import data_cache, figure_cache, figure_encoding, fit_cache, lod, metrics, palette, seasonal, sleep_filters, sleep_schema, smoother, sync_jobs, user_store
+
+
+# each request reads and syncs the data of its own user, see user_store
+def data_path():
+    return user_store.request_path(proj_path)
 
 # set graphic elements & color palette
 sleep_logo = "static/moon-white.png"
-sun_rgba = list(mpl_cmap("viridis")(0.999)[:3]) + [1] # appending opacity
-sun_fill_color = "rgba" + str(tuple(sun_rgba))
-woke_up_color = "rgb" + str(mpl_cmap("viridis")(0.5)[:3])
-woke_up_dark_color = "rgb" + str(mpl_cmap("viridis")(0.2)[:3])
-fell_asleep_color = "rgb" + str(mpl_cmap("viridis")(0.8)[:3])
-fell_asleep_dark_color = "rgb" + str(mpl_cmap("viridis")(0.7)[:3])
+# viridis colors (see palette), precomputed rather than looked up at startup
+sun_fill_color = "rgba(0.993248, 0.906157, 0.143936, 1)" # viridis at 0.999, opaque
+woke_up_color = "rgb(0.127568, 0.566949, 0.550556)" # viridis at 0.5
+woke_up_dark_color = "rgb(0.253935, 0.265254, 0.529983)" # viridis at 0.2
+fell_asleep_color = "rgb(0.477504, 0.821444, 0.318195)" # viridis at 0.8
+fell_asleep_dark_color = "rgb(0.266941, 0.748751, 0.440573)" # viridis at 0.7
 invis = "rgba(0,0,0,0)"
+dummy_year = seasonal.dummy_year # leap year onto which the annual tab maps every date
+sun_time_format = "%B %d, %I:%M:%S %p" # hovertemplate format of sunrise/sunset times
+fit_time_format = "%B %d, %Y %I:%M:%S %p" # hovertemplate format of the overview's smoothed times
+
+# if True, the day filter toggles are applied in the browser and only the
+# smoothed lines are requested from the server (see assets/clientside_filters.js)
+client_side_filtering = False
+
 
 external_stylesheets = [dbc.themes.LITERA]
 
@@ -55,6 +70,10 @@ external_stylesheets = [dbc.themes.LITERA]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets, assets_folder='assets')
 server = app.server
 
+# users are signed in with the signed Flask session (see user_store), which
+# needs a secret key, without one every request is the owner's
+server.secret_key = os.environ.get("SECRET_KEY")
+
 # code layout
 # web page layout is constructed in pieces to keep nested function levels within sane limits
 # smallest pieces of layout are defined first, later pieces wrap the earlier pieces
@@ -287,6 +306,8 @@ app.layout = html.Div([
             dbc.Collapse(
                 dbc.Nav([
                     dbc.NavItem(dbc.NavLink("My Portfolio", href="https://buckeye17.github.io/")),
+                    # a plain link, since the sign in page is served by flask rather than dash
+                    dbc.NavItem(html.A("Sign In", href="/login", className="nav-link")),
                     dropdown_menu_items
                 ], className="ml-auto", navbar=True),
                 id="navbar-collapse", navbar=True,
@@ -298,9 +319,11 @@ app.layout = html.Div([
 
     # define modal which will print progress while syncing with Garmin
     dbc.Modal([
-        # these hidden divs enable chaining of callbacks while providing modal updates at each stage
+        # these hidden divs hold the sync job being followed and its last polled state
         html.Div(id="sync-started", style={"display": "none"}),
         html.Div(False, id="sync-finished", style={"display": "none"}),
+        html.Div(id="sync-job-state", style={"display": "none"}),
+        html.Div(id="sync-job-revision", style={"display": "none"}),
         dbc.ModalHeader("Sync Progress"),
         dbc.ModalBody([
             html.Div([dbc.Progress(value=3, max=5, id="sync-progress-bar"), #, style={"height": "3px"}
@@ -326,8 +349,10 @@ app.layout = html.Div([
         dbc.Tab([
             overview_filter_wrap,
             dbc.Row(dbc.Col(html.Div([dcc.Loading(dcc.Graph(id="overview-scatter-plot"), type="cube")]))),
+            dcc.Store(id="overview-base-store"),
+            dcc.Store(id="overview-fit-store"),
             dbc.Row(dbc.Col(html.Div([dcc.Markdown('''
-                Sunrise and sunset data was obtained from: [https://sunrise-sunset.org/api](https://sunrise-sunset.org/api)
+                Sunrise and sunset times are computed with the NOAA solar calculator's equations: [https://gml.noaa.gov/grad/solcalc/](https://gml.noaa.gov/grad/solcalc/calcdetails.html)
             ''', style={"fontSize": "small", "textAlign": "center"})])))
         ], label="Overview"),
 
@@ -350,9 +375,11 @@ app.layout = html.Div([
                 ), width=2),
             ], justify="center"),
             dbc.Row(dbc.Col(html.Div([dcc.Loading(dcc.Graph(id="annual-scatter-plot"), type="cube")]))),
+            dcc.Store(id="annual-base-store"),
+            dcc.Store(id="annual-fit-store"),
             dbc.Row(dbc.Col(html.Div([dcc.Markdown('''
                 This plot shows the average sunrise or sunset time per date, spanning all dates in sleep dataset  
-                Sunrise and sunset data was obtained from: [https://sunrise-sunset.org/api](https://sunrise-sunset.org/api)
+                Sunrise and sunset times are computed with the NOAA solar calculator's equations: [https://gml.noaa.gov/grad/solcalc/](https://gml.noaa.gov/grad/solcalc/calcdetails.html)
             ''', style={"fontSize": "small", "textAlign": "center", "margin-top": 10})]))),
         ], label="Annual View")
     ])
@@ -421,6 +448,7 @@ def toggle_modal(sync_over_clicks, sync_annual_clicks, modal_close_clicks,
 
 
 # this call back responds to all buttons related to data syncing
+# by starting a sync job in the background (see sync_jobs.py)
 @app.callback(
     [Output("sync-step-0", "children"),
      Output("sync-started", "children")],
@@ -434,146 +462,113 @@ def sync_data(sync_overview_clicks, sync_annual_clicks, \
     if (sync_overview_clicks is None) & (sync_annual_clicks is None):
         # no buttons have been clicked yet
         step0_msg = None
-        sync_started = False
-    else:
-        sync_started = True
-        if sync_finished:
-            # don't attempt any more syncs
-            step0_msg = None
-        else:
-            step0_msg = html.B("Completed steps:")
-    return [step0_msg, sync_started]
-
-
-# step 0 of data sync process
-nights_df = pd.DataFrame() # data to be used in subsequent sync functions
-new_req_dates_ls = [] # data to be used in subsequent sync functions
-@app.callback(
-    [Output("sync-step-1", "children")],
-    [Input("sync-step-0", "children")],
-    [State("sync-finished", "children"),
-     State("sync-step-1", "children")]
-)
-def do_sync_step0(msg, sync_already_finished: bool, out_msg):
-    global nights_df, new_req_dates_ls
-    if sync_already_finished == True:
-        msg = out_msg
+        sync_job_id = None
+    elif sync_finished:
+        # don't attempt any more syncs
+        raise PreventUpdate
     else:
-        if msg is not None:
-            [msg, nights_df, new_req_dates_ls] = garmin_get.step0()
-    return [msg]
+        step0_msg = html.B("Completed steps:")
 
+        # follow the running sync if there is one, rather than starting another
+        sync_job_id = sync_jobs.start_sync(data_path())["job_id"]
+    return [step0_msg, sync_job_id]
 
-# step 1 of data sync process
-request = {} # data to be used in subsequent sync functions
-@app.callback(
-    [Output("sync-step-2", "children")],
-    [Input("sync-step-1", "children")],
-    [State("sync-finished", "children"),
-     State("sync-step-2", "children")]
-)
-def do_sync_step1(msg, sync_already_finished: bool, out_msg):
-    global request
-    if sync_already_finished == True:
-        msg = out_msg
-    else:
-        if (msg is not None):
-            if sync_already_finished:
-                msg = None
-            else:
-                [msg, request] = garmin_get.step1()
-    return [msg]
 
+# report a sync job's HTTP-readable status, e.g. for monitoring
+@server.route("/sync/status")
+def sync_status():
+    job = sync_jobs.read_job(data_path())
+    if job is None:
+        job = {"state": None}
+    return flask.jsonify(job)
 
-# step 2 of data sync process
-data_json = {} # data to be used in subsequent sync functions
-@app.callback(
-    [Output("sync-step-3", "children")],
-    [Input("sync-step-2", "children")],
-    [State("sync-finished", "children"),
-     State("sync-step-3", "children")]
-)
-def do_sync_step2(msg, sync_already_finished: bool, out_msg):
-    global data_json
-    if sync_already_finished == True:
-        msg = out_msg
-    else:
-        if msg is not None:
-            [msg, data_json] = garmin_get.step2(request, new_req_dates_ls)
-            msg = "Downloaded new data from Garmin" 
-    return [msg]
 
+# sign a user in to their own data (see user_store), from a form posting user_id and password
+# a minimal page of its own, so signing in doesn't depend on the dash layout
+login_page = """<!DOCTYPE html>
+<html><head><title>Sleep Dashboard Sign In</title><link rel="stylesheet" href="{stylesheet}"></head>
+<body class="container" style="max-width: 24rem; margin-top: 3rem;">
+<h4>Sleep Dashboard</h4>{body}<p><a href="/">Back to the dashboard</a></p></body></html>"""
+login_form = """<p class="text-danger">{error}</p>
+<form method="post" action="/login">
+<input class="form-control mb-2" name="user_id" placeholder="User id" required>
+<input class="form-control mb-2" name="password" type="password" placeholder="Password" required>
+<button class="btn btn-primary" type="submit">Sign in</button></form>"""
+logout_form = """<p>Signed in as {user_id}.</p>
+<form method="post" action="/logout"><button class="btn btn-secondary" type="submit">Sign out</button></form>"""
 
-# step 3 of data sync process
-complete_dates_ls = [] # data to be used in subsequent sync functions
-@app.callback(
-    [Output("sync-step-4", "children")],
-    [Input("sync-step-3", "children")],
-    [State("sync-finished", "children"),
-     State("sync-step-4", "children")]
-)
-def do_sync_step3(msg, sync_already_finished: bool, out_msg):
-    global complete_dates_ls
 
-    if sync_already_finished == True:
-        msg = out_msg
-    else:
-        if msg is not None:
-            # since plotting data is mutable (subject to adding new data)
-            # this data is read from disk, ensuring all callbacks are accessing the same data
-            sleep_descr_df = pd.read_pickle(proj_path + "data/all_sleep_descr_df.pkl")
-
-            # dataframe files on disk will be overwritten in step3()
-            # function with new dataframes
-            [msg, new_sleep_descr_df, new_sleep_event_df, complete_dates_ls] = \
-                garmin_get.step3(nights_df, data_json, new_req_dates_ls)
-            new_nights = len(new_sleep_descr_df) - len(sleep_descr_df)
-            msg = str(new_nights) + " night(s) were added to the sleep dataset"
-        
-    return [msg]
-
-
-# step 4 of data sync process
+def render_login_page(body, status=200):
+    return flask.Response(login_page.format(stylesheet=external_stylesheets[0], body=body), status=status)
+
+
+@server.route("/login", methods=["GET", "POST"])
+def login():
+    if server.secret_key is None:
+        # sessions can't be signed, so nobody can sign in
+        return render_login_page("<p>Signing in isn't enabled on this server.</p>", 503)
+    if flask.request.method == "GET":
+        user_id = user_store.request_user(proj_path)
+        if user_id is not None:
+            return render_login_page(logout_form.format(user_id=markupsafe.escape(user_id)))
+        return render_login_page(login_form.format(error=""))
+
+    if not user_store.sign_in(flask.request.form.get("user_id"), flask.request.form.get("password", ""),
+                              proj_path):
+        return render_login_page(login_form.format(error="Wrong user id or password."), 401)
+    return flask.redirect("/")
+
+
+@server.route("/logout", methods=["POST"])
+def logout():
+    user_store.sign_out()
+    return flask.redirect("/")
+
+
+# report the latency metrics of all workers and sync jobs to Prometheus (see metrics)
+@server.route("/metrics")
+def metrics_route():
+    return flask.Response(metrics.render(proj_path),
+                          content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# this callback polls the status of the sync job and shows the progress of its steps
 @app.callback(
-    [Output("sync-step-5", "children")],
-    [Input("sync-step-4", "children")],
-    [State("sync-finished", "children"),
-     State("sync-step-5", "children")]
+    [Output("sync-step-1", "children"),
+     Output("sync-step-2", "children"),
+     Output("sync-step-3", "children"),
+     Output("sync-step-4", "children"),
+     Output("sync-step-5", "children"),
+     Output("sync-progress-bar", "value"),
+     Output("sync-job-state", "children"),
+     Output("sync-job-revision", "children")],
+    [Input("progress-poll", "n_intervals")],
+    [State("sync-started", "children"),
+     State("sync-job-revision", "children")]
 )
-def do_sync_step4(msg, sync_already_finished: bool, out_msg):
-    if sync_already_finished == True:
-        msg = out_msg
+def update_progress_bar(n_int, sync_job_id, last_revision):
+    job = sync_jobs.read_job(data_path())
+    if (sync_job_id is None) or (job is None) or (job["job_id"] != sync_job_id) or \
+       (job["revision"] == last_revision):
+        # nothing new to show
+        raise PreventUpdate
+
+    msg_ls = job["steps"]
+    if job["state"] == "finished":
+        prog_val = len(msg_ls) # 100%
     else:
-        if msg is not None:
-            # dataframe file on disk will be overwritten in step4()
-            # function with new dataframe
-            [msg, new_sun_df] = garmin_get.step4(complete_dates_ls)
-            msg = "Updated sunrise/sunset dataset"
-    return [msg]
+        prog_vals_ls = [1 for msg in msg_ls if msg is not None]
+        prog_val = len(prog_vals_ls)
+    return msg_ls + [prog_val, job["state"], job["revision"]]
 
 
-# propagate data sync updates back to app main elements
-@app.callback(
-    [Output("sync-step-6", "children"),
-     Output("sync-finished", "children"),
-     Output("sync-data-modal-close", "disabled"),
-     Output("date-range-slider", "min"),
-     Output("date-range-slider", "max"),
-     Output("date-range-slider", "value"),
-     Output("date-range-slider", "marks")],
-    [Input("sync-step-5", "children")],
-    [State("sync-finished", "children"),
-     State("sync-started", "children"),
-     State("sync-step-1", "children"),
-     State("date-range-slider", "value"),
-     State("sync-step-6", "children")]
-)
-def do_sync_step4(msg, sync_already_finished: bool, sync_started: bool, step1_msg, \
-                  overview_slider_vals, out_msg):
-    
+# the overview's date range slider properties for the current data, where the
+# right slider always moves to the last date
+def overview_slider(overview_slider_vals):
+
     # since plotting data is mutable (subject to adding new data)
-    # this data is read from disk, ensuring all callbacks are accessing the same data
-    sleep_descr_df = pd.read_pickle(proj_path + "data/all_sleep_descr_df.pkl")
+    # the shared frames are reloaded whenever a sync bumps the data generation
+    sleep_descr_df = data_cache.get_datasets(data_path())[0]
 
     # slider range
     overview_slider_min = 0
@@ -604,10 +599,45 @@ def do_sync_step4(msg, sync_already_finished: bool, sync_started: bool, step1_ms
     else:
         overview_slider_vals = [overview_slider_vals[0], overview_slider_max]
 
+    return [overview_slider_min, overview_slider_max, overview_slider_vals, overview_slider_marks]
+
+
+# propagate data sync updates back to app main elements
+@app.callback(
+    [Output("sync-step-6", "children"),
+     Output("sync-finished", "children"),
+     Output("sync-data-modal-close", "disabled"),
+     Output("date-range-slider", "min"),
+     Output("date-range-slider", "max"),
+     Output("date-range-slider", "value"),
+     Output("date-range-slider", "marks")],
+    [Input("sync-job-state", "children")],
+    [State("sync-finished", "children"),
+     State("sync-started", "children"),
+     State("date-range-slider", "value"),
+     State("sync-step-6", "children")]
+)
+def finish_sync(sync_state, sync_already_finished: bool, sync_job_id, \
+                overview_slider_vals, out_msg):
+    if sync_state in ["starting", "running"]:
+        # wait for the sync job to end
+        raise PreventUpdate
+
+    if data_cache.has_data(data_path()):
+        [overview_slider_min, overview_slider_max, overview_slider_vals, overview_slider_marks] = \
+            overview_slider(overview_slider_vals)
+    else:
+        # a new user has no data to show until their first sync has finished
+        [overview_slider_min, overview_slider_max, overview_slider_vals, overview_slider_marks] = \
+            [dash.no_update]*4
+
     # prevent subsequent syncs if sync has already been successful
-    if (sync_already_finished != True) & (msg is not None):
+    if (sync_already_finished != True) & (sync_state == "finished"):
         msg = "Finished syncing"
         finished_bool = True
+    elif sync_state == "failed":
+        msg = "Sync failed: " + str(sync_jobs.read_job(data_path())["error"])
+        finished_bool = sync_already_finished
     else:
         msg = out_msg
         finished_bool = sync_already_finished
@@ -615,38 +645,26 @@ def do_sync_step4(msg, sync_already_finished: bool, sync_started: bool, step1_ms
     # enable close button once first sync is complete, and for all subsequent
     # sync attempts
     close_btn_disabled = False     
-    if (sync_started != True) & (~ finished_bool):
+    if (sync_job_id is None) & (not finished_bool):
         close_btn_disabled = True
 
     return [msg, finished_bool, close_btn_disabled, overview_slider_min, \
             overview_slider_max, overview_slider_vals, overview_slider_marks]
 
 
-# this callback polls the status of the sync steps and updates the progress bar
-@app.callback(
-    [Output("sync-progress-bar", "value")],
-    [Input("progress-poll", "n_intervals")],
-    [State("sync-step-1", "children"),
-     State("sync-step-2", "children"),
-     State("sync-step-3", "children"),
-     State("sync-step-4", "children"),
-     State("sync-step-5", "children"),
-     State("sync-finished", "children")]
-)
-def update_progress_bar(n_int, step1_msg, step2_msg, step3_msg, step4_msg, \
-                        step5_msg, sync_already_finished: bool):
-    msg_ls = [step1_msg, step2_msg, step3_msg, step4_msg, step5_msg]
-    if (sync_already_finished == True) | \
-       (step1_msg == "Archived data is up to date, no new data is available."):
-        prog_val = len(msg_ls) # 100%
-    else:
-        prog_vals_ls = [1 for msg in msg_ls if msg is not None]
-        prog_val = len(prog_vals_ls)
-    return [prog_val]
-
-
 # define functions used in all graph update callbacks
 
+# a new user has no graphs to show until their first sync has finished,
+# the graph callbacks are timed once they have (see metrics)
+def requires_data(callback):
+    timed_callback = metrics.callback(callback)
+    @functools.wraps(callback)
+    def wrapped(*args):
+        if not data_cache.has_data(data_path()):
+            raise PreventUpdate
+        return timed_callback(*args)
+    return wrapped
+
 # this function interprets the number of clicks on a button
 # as odd or even, then provides the corresponding boolean
 # and button color values, where color_opts are the colors
@@ -688,58 +706,165 @@ def react_dow_clicks(mon_clicks, tue_clicks, wed_clicks, thu_clicks,
 
 
 
+# outputs and filter button inputs shared by the server-side and client-side graph callbacks
+overview_outputs = [
+    Output('overview-scatter-plot', 'figure'),
+    Output('mon-filter', 'color'),
+    Output('tue-filter', 'color'),
+    Output('wed-filter', 'color'),
+    Output('thu-filter', 'color'),
+    Output('fri-filter', 'color'),
+    Output('sat-filter', 'color'),
+    Output('sun-filter', 'color'),
+    Output('work-nights-filter', 'color'),
+    Output('off-nights-filter', 'color')]
+overview_filter_inputs = [
+    Input('mon-filter', 'n_clicks'),
+    Input('tue-filter', 'n_clicks'),
+    Input('wed-filter', 'n_clicks'),
+    Input('thu-filter', 'n_clicks'),
+    Input('fri-filter', 'n_clicks'),
+    Input('sat-filter', 'n_clicks'),
+    Input('sun-filter', 'n_clicks'),
+    Input('work-nights-filter', 'n_clicks'),
+    Input('off-nights-filter', 'n_clicks')]
+annual_outputs = [
+    Output('annual-scatter-plot', 'figure'),
+    Output('mon-filter-annual', 'color'),
+    Output('tue-filter-annual', 'color'),
+    Output('wed-filter-annual', 'color'),
+    Output('thu-filter-annual', 'color'),
+    Output('fri-filter-annual', 'color'),
+    Output('sat-filter-annual', 'color'),
+    Output('sun-filter-annual', 'color'),
+    Output('work-nights-filter-annual', 'color'),
+    Output('off-nights-filter-annual', 'color')]
+annual_filter_inputs = [
+    Input('mon-filter-annual', 'n_clicks'),
+    Input('tue-filter-annual', 'n_clicks'),
+    Input('wed-filter-annual', 'n_clicks'),
+    Input('thu-filter-annual', 'n_clicks'),
+    Input('fri-filter-annual', 'n_clicks'),
+    Input('sat-filter-annual', 'n_clicks'),
+    Input('sun-filter-annual', 'n_clicks'),
+    Input('work-nights-filter-annual', 'n_clicks'),
+    Input('off-nights-filter-annual', 'n_clicks')]
+
+
 # define all of the overview filters functionality and corresponding graph
-@app.callback(
-    [Output('overview-scatter-plot', 'figure'),
-     Output('mon-filter', 'color'),
-     Output('tue-filter', 'color'),
-     Output('wed-filter', 'color'),
-     Output('thu-filter', 'color'),
-     Output('fri-filter', 'color'),
-     Output('sat-filter', 'color'),
-     Output('sun-filter', 'color'),
-     Output('work-nights-filter', 'color'),
-     Output('off-nights-filter', 'color')],
-    [Input('date-range-slider', 'value'),
-     Input('mon-filter', 'n_clicks'),
-     Input('tue-filter', 'n_clicks'),
-     Input('wed-filter', 'n_clicks'),
-     Input('thu-filter', 'n_clicks'),
-     Input('fri-filter', 'n_clicks'),
-     Input('sat-filter', 'n_clicks'),
-     Input('sun-filter', 'n_clicks'),
-     Input('work-nights-filter', 'n_clicks'),
-     Input('off-nights-filter', 'n_clicks')],
-    [State("date-range-slider", "max")]
-)
+# (registered below, unless the filters are applied client-side)
 def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
                  thu_clicks, fri_clicks, sat_clicks, sun_clicks,
-                 wn_clicks, offn_clicks, max_date):
-    
-    # since plotting data is mutable (subject to adding new data)
-    # this data is read from disk, ensuring all callbacks are accessing the same data
-    sleep_descr_df = pd.read_pickle(proj_path + "data/all_sleep_descr_df.pkl")
-    sleep_event_df = pd.read_pickle(proj_path + "data/all_sleep_event_df.pkl")
-    sun_df = pd.read_pickle(proj_path + "data/sun_df.pkl")
+                 wn_clicks, offn_clicks, relayout_data, max_date):
 
     # interpret click values for updating UI & data filters
     [wn_color, offn_color, tod_filter] = react_tod_clicks(wn_clicks, offn_clicks)
     [mon_color, tue_color, wed_color, thu_color, fri_color, sat_color, sun_color, dow_filter] = \
         react_dow_clicks(mon_clicks, tue_clicks, wed_clicks, thu_clicks, fri_clicks, sat_clicks, sun_clicks)
+    view_range = overview_view_range(relayout_data)
+
+    # identical filter states reuse the figure built by any worker for the current data
+    fig = figure_cache.get_figure("overview", [date_range, dow_filter, tod_filter, view_range],
+                                  build_overview_figure, data_path())
+
+    return [fig, mon_color, tue_color, wed_color, thu_color, \
+            fri_color, sat_color, sun_color, wn_color, offn_color]
+
+
+# the zoomed date range of the overview's event plot, when its zoom triggered the callback
+def overview_view_range(relayout_data):
+    if not flask.has_request_context():
+        # called directly rather than as a callback
+        return None
+    triggered = [trigger["prop_id"] for trigger in dash.callback_context.triggered]
+    if "overview-scatter-plot.relayoutData" not in triggered:
+        # new filters or data show the whole date range again
+        return None
+
+    relayout_data = relayout_data or {}
+    if relayout_data.get("xaxis.autorange"):
+        return None
+    if "xaxis.range[0]" in relayout_data:
+        return [relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]]
+    if "xaxis.range" in relayout_data:
+        return list(relayout_data["xaxis.range"])
+
+    # e.g. autosizing or zooming the other subplots, which doesn't change the background
+    raise PreventUpdate
+
+
+# clip the sunrise/sunset background to the visible dates and limit its number of points
+def sun_background(sun_df, x_range):
+    start, stop = lod.visible_rows(sun_df["Date"].values, np.array(x_range, dtype="datetime64[ns]"))
+    view_df = sun_df.iloc[start:stop]
+    rows = lod.minmax_rows([view_df["Sunset_ToD"].values, view_df["Sunrise_ToD"].values])
+    return view_df.iloc[rows]
+
+
+# compute the overview's smoothed lines, keyed by the meta tag of their traces
+def overview_fit_lines(mask_df, fits):
+    fit_dur = fits["dur"]
+    fit_asleep = fits["asleep"]
+    fit_wake = fits["wake"]
+
+    start_day = np.nanmin(mask_df.Prev_Day)
+    fit_asleep_dt = start_day + pd.to_timedelta(fit_asleep[:,0], unit="days") + \
+                    pd.to_timedelta(fit_asleep[:,1], unit="hours")
+    fit_wake_dt = start_day + pd.to_timedelta(fit_wake[:,0], unit="days") + \
+                  pd.to_timedelta(fit_wake[:,1], unit="hours")
+
+    return {
+        "dur-fit": dict(
+            x=start_day + pd.to_timedelta(fit_dur[:,0], unit="D"),
+            y=fit_dur[:,1],
+            hovertemplate="%{x|%B %d, %Y}<br>Duration: %{y:.2f} hours"),
+        "asleep-fit": dict(
+            x=start_day + pd.to_timedelta(fit_asleep[:,0], unit="D"),
+            y=fit_asleep[:,1],
+            text=sleep_schema.hover_times(pd.Series(fit_asleep_dt)),
+            hovertemplate="%{text|" + fit_time_format + "}"),
+        "wake-fit": dict(
+            x=start_day + pd.to_timedelta(fit_wake[:,0], unit="D"),
+            y=fit_wake[:,1],
+            text=sleep_schema.hover_times(pd.Series(fit_wake_dt)),
+            hovertemplate="%{text|" + fit_time_format + "}")
+    }
 
-    # filter date range using the row index
-    if date_range is None:
-        # date range slider hasn't initialized yet, so ignore it
-        mask_df = sleep_descr_df
+
+# build the overview figure for the given slider range and filters, with the
+# event plot zoomed in on view_range (a pair of dates) if given
+def build_overview_figure(date_range, dow_filter, tod_filter, view_range=None):
+
+    # since plotting data is mutable (subject to adding new data)
+    # the shared frames are reloaded whenever a sync bumps the data generation
+    with metrics.stage("data_load"):
+        sun_df = data_cache.get_datasets(data_path())[2]
+        sleep_descr_df, sleep_event_df, filter_index = data_cache.get_filter_index(data_path())
+
+    # filter date range and types of day
+    with metrics.stage("filter"):
+        mask_df, events_df = sleep_filters.filter_events(
+            sleep_descr_df, sleep_event_df, filter_index, date_range, dow_filter, tod_filter)
+
+    # smoothed lines are precomputed at sync time or cached after the first request
+    with metrics.stage("smoothing"):
+        fit_key = sleep_filters.filter_key(date_range, dow_filter, tod_filter, len(sleep_descr_df))
+        fits = fit_cache.get_overview_fits(mask_df, events_df, fit_key, data_path())
+        fit_lines = overview_fit_lines(mask_df, fits)
+
+    with metrics.stage("figure_build"):
+        return overview_figure(mask_df, events_df, sun_df, fit_lines, view_range)
+
+
+# lay out the overview figure of the filtered frames and their smoothed lines
+def overview_figure(mask_df, events_df, sun_df, fit_lines, view_range):
+
+    # in client-side filtering mode each point carries its filter flags,
+    # events are aligned with their sessions so they share the same flags
+    if client_side_filtering:
+        flags = sleep_filters.session_flags(mask_df)
     else:
-        mask_df = sleep_descr_df.iloc[date_range[0]:date_range[1],:]
-    
-    # filter types of day by getting sleep session IDs which meet filter criteria
-    mask_df = mask_df[(mask_df["Day"].isin(dow_filter)) & 
-                        (mask_df["Is_Workday"].isin(tod_filter))]
-    
-    # generate filtered dataframe
-    data_df = sleep_event_df[sleep_event_df["Sleep_Session_ID"].isin(mask_df["Sleep_Session_ID"])]
+        flags = None
 
     # manual y-axes limits
     y_dur_range = [3, 12]
@@ -750,12 +875,13 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
                                  vertical_spacing=0.03)
 
     # add sleep duration scatter plot
-    fig.add_trace(go.Scatter(
+    fig.add_trace(figure_encoding.scatter_trace(
         name="Sleep<br>Duration",
+        meta="dur-scatter",
         x=mask_df.Prev_Day,
         y=mask_df.Total_Dur.dt.seconds/(60.*60),
-        text=mask_df.Prev_Day.dt.strftime('%B %d, %Y'),
-        hovertemplate="%{text}<br>Duration: %{y:.2f} hours",
+        customdata=flags,
+        hovertemplate="%{x|%B %d, %Y}<br>Duration: %{y:.2f} hours",
         marker_color="gray",
         marker_line_width=0, 
         marker_size=6,
@@ -770,15 +896,10 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
                              showlegend=True, name='Sleep Duration'), row=2, col=1)
 
     # add smooth signal line for duration
-    mask_days = mask_df.Prev_Day - np.nanmin(mask_df.Prev_Day)
-    fit_dur = lowess(mask_df.Total_Dur.dt.seconds/(60.*60), mask_days.dt.days,
-                     is_sorted=True, frac=0.04, it=0)
-    fig.add_trace(go.Scatter(
+    fig.add_trace(figure_encoding.scatter_trace(
         name="Smoothed<br>Duration",
-        x=min(mask_df.Prev_Day) + pd.to_timedelta(fit_dur[:,0], unit="D"),
-        y=fit_dur[:,1],
-        text=mask_df.Prev_Day.dt.strftime('%B %d, %Y'),
-        hovertemplate="%{text}<br>Duration: %{y:.2f} hours",
+        meta="dur-fit",
+        **fit_lines["dur-fit"],
         mode="lines",
         line=dict(
             color="gray",
@@ -792,6 +913,7 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
     fig.add_trace(go.Histogram(
         name="Duration<br>Histogram",
         y=mask_df.Total_Dur.dt.seconds/(60.*60),
+        customdata=flags,
         nbinsy=round((y_dur_range[1] - y_dur_range[0])*8),
         histnorm="percent",
         marker=dict(
@@ -801,7 +923,10 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
     ), row=2, col=2)
 
     # add sleep events scatter plot
-    # first add sunrise/sunset background
+    # first add sunrise/sunset background, for the visible dates only
+    x_range = [min(mask_df["Prev_Day"]), max(mask_df["Prev_Day"])]
+    tod_x_range = x_range if view_range is None else view_range
+    sun_df = sun_background(sun_df, [pd.Timestamp(x) for x in tod_x_range])
     fig.add_trace(go.Scatter(
         name="Below Sunset",
         x=sun_df["Date"],
@@ -822,8 +947,8 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
         name="Sunset",
         x=sun_df["Date"],
         y=sun_df["Sunset_ToD"],
-        text=sun_df.Sunset.dt.strftime("%B %d, %r"),
-        hovertemplate="%{text}",
+        text=sleep_schema.hover_times(sun_df.Sunset),
+        hovertemplate="%{text|" + sun_time_format + "}",
         fillcolor=sun_fill_color,
         fill="tonextx",
         mode="lines",
@@ -840,8 +965,8 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
         name="Sunrise",
         x=sun_df["Date"],
         y=sun_df["Sunrise_ToD"],
-        text=sun_df.Sunrise.dt.strftime("%B %d, %r"),
-        hovertemplate="%{text}",
+        text=sleep_schema.hover_times(sun_df.Sunrise),
+        hovertemplate="%{text|" + sun_time_format + "}",
         fillcolor=invis,
         fill="tozeroy",
         mode="lines",
@@ -875,13 +1000,13 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
                              showlegend=True, name='Sun is Up'), row=1, col=1)
 
     # plot sleep event data
-    fig.add_trace(go.Scatter(
+    fig.add_trace(figure_encoding.scatter_trace(
         name="Fell Asleep",
-        x=data_df.query('Event == "Fell Asleep"').Prev_Day,
-        y=data_df.query('Event == "Fell Asleep"').ToD,
-        text=data_df.query('Event == "Fell Asleep"').DateTimeStr,
-        hovertemplate =
-        "%{text}",
+        x=mask_df.Prev_Day,
+        y=events_df.Asleep_ToD,
+        text=sleep_schema.hover_times(events_df.Asleep_Time),
+        customdata=flags,
+        hovertemplate="%{text|" + sleep_schema.event_time_format + "}",
         marker_color=fell_asleep_color,
         marker_line_width=0, 
         marker_size=6,
@@ -896,18 +1021,10 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
                              showlegend=True, name='Fell Asleep'), row=1, col=1)
 
     # add smooth signal line for falling asleep
-    asleep_start_day = np.nanmin(data_df.query('Event == "Fell Asleep"').Prev_Day)
-    asleep_days = data_df.query('Event == "Fell Asleep"').Prev_Day - asleep_start_day
-    asleep_hours = data_df.query('Event == "Fell Asleep"').ToD
-    fit_asleep = lowess(asleep_hours, asleep_days.dt.days, is_sorted=True, frac=0.04, it=0)
-    fit_asleep_dt = asleep_start_day + pd.to_timedelta(fit_asleep[:,0], unit="days") + \
-                    pd.to_timedelta(fit_asleep[:,1], unit="hours")
-    fig.add_trace(go.Scatter(
+    fig.add_trace(figure_encoding.scatter_trace(
         name="Smoothed<br>Asleep",
-        x=min(data_df.Prev_Day) + pd.to_timedelta(fit_asleep[:,0], unit="D"),
-        y=fit_asleep[:,1],
-        text=fit_asleep_dt.strftime('%B %d, %Y %r'),
-        hovertemplate="%{text}",
+        meta="asleep-fit",
+        **fit_lines["asleep-fit"],
         mode="lines",
         line=dict(
             color=fell_asleep_color,
@@ -917,12 +1034,13 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
         showlegend=False
     ), row=1, col=1)
 
-    fig.add_trace(go.Scatter(
+    fig.add_trace(figure_encoding.scatter_trace(
         name="Woke Up",
-        x=data_df.query('Event == "Woke Up"').Prev_Day,
-        y=data_df.query('Event == "Woke Up"').ToD,
-        text=data_df.query('Event == "Woke Up"').DateTimeStr,
-        hovertemplate="%{text}",
+        x=mask_df.Prev_Day,
+        y=events_df.Wake_ToD,
+        text=sleep_schema.hover_times(events_df.Wake_Time),
+        customdata=flags,
+        hovertemplate="%{text|" + sleep_schema.event_time_format + "}",
         marker_color=woke_up_color,
         marker_line_width=0, 
         marker_size=6,
@@ -937,18 +1055,10 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
                              showlegend=True, name='Woke Up'), row=1, col=1)
 
     # add smooth signal line for waking up
-    wake_start_day = np.nanmin(data_df.query('Event == "Woke Up"').Prev_Day)
-    wake_days = data_df.query('Event == "Woke Up"').Prev_Day - asleep_start_day
-    wake_hours = data_df.query('Event == "Woke Up"').ToD
-    fit_wake = lowess(wake_hours, wake_days.dt.days, is_sorted=True, frac=0.04, it=0)
-    fit_wake_dt = wake_start_day + pd.to_timedelta(fit_wake[:,0], unit="days") + \
-                  pd.to_timedelta(fit_wake[:,1], unit="hours")
-    fig.add_trace(go.Scatter(
+    fig.add_trace(figure_encoding.scatter_trace(
         name="Smoothed<br>Woke Up",
-        x=min(data_df.Prev_Day) + pd.to_timedelta(fit_wake[:,0], unit="D"),
-        y=fit_wake[:,1],
-        text=mask_df.Prev_Day.dt.strftime('%B %d, %Y'),
-        hovertemplate=fit_wake_dt.strftime('%B %d, %Y %r'),
+        meta="wake-fit",
+        **fit_lines["wake-fit"],
         mode="lines",
         line=dict(
             color=woke_up_dark_color,
@@ -961,7 +1071,8 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
     # add histograms along y-axis (time of day)
     fig.add_trace(go.Histogram(
         name="Woke Up<br>Histogram",
-        y=data_df.query('Event == "Woke Up"').ToD,
+        y=events_df.Wake_ToD,
+        customdata=flags,
         histnorm="percent",
         marker=dict(
             color=woke_up_dark_color
@@ -971,7 +1082,8 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
 
     fig.add_trace(go.Histogram(
         name="Fell Asleep<br>Histogram",
-        y=data_df.query('Event == "Fell Asleep"').ToD,
+        y=events_df.Asleep_ToD,
+        customdata=flags,
         histnorm="percent",
         marker=dict(
             color=fell_asleep_color
@@ -982,14 +1094,14 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
     # define all 4 x-axes
     fig.update_xaxes(row=1, col=1, zeroline=True, #dtick="M12", 
         linecolor="gray", linewidth=0.5, gridcolor="gray", gridwidth=0.5, mirror=True,
-        range=[min(mask_df["Prev_Day"]), max(mask_df["Prev_Day"])], showticklabels=False)
+        range=tod_x_range, showticklabels=False)
     
     fig.update_xaxes(row=1, col=2, zeroline=False, linecolor=invis, gridcolor=invis, 
         ticktext=[], tickvals=[], mirror=False)
     
     fig.update_xaxes(row=2, col=1, zeroline=True, #dtick="M12", 
         linecolor="gray", linewidth=0.5, gridcolor="gray", gridwidth=0.5, mirror=True,
-        range=[min(mask_df["Prev_Day"]), max(mask_df["Prev_Day"])])
+        range=x_range)
     
     fig.update_xaxes(row=2, col=2, zeroline=False, linecolor=invis, gridcolor=invis, 
         ticktext=[], tickvals=[], mirror=False)
@@ -1031,99 +1143,136 @@ def update_graph(date_range, mon_clicks, tue_clicks, wed_clicks,
             borderwidth=0.5),
         legend_orientation="h")
 
-    return [fig, mon_color, tue_color, wed_color, thu_color, \
-            fri_color, sat_color, sun_color, wn_color, offn_color]
+    return fig
 
 
 
 # define all of the annual filters functionality and corresponding graph
-@app.callback(
-    [Output('annual-scatter-plot', 'figure'),
-     Output('mon-filter-annual', 'color'),
-     Output('tue-filter-annual', 'color'),
-     Output('wed-filter-annual', 'color'),
-     Output('thu-filter-annual', 'color'),
-     Output('fri-filter-annual', 'color'),
-     Output('sat-filter-annual', 'color'),
-     Output('sun-filter-annual', 'color'),
-     Output('work-nights-filter-annual', 'color'),
-     Output('off-nights-filter-annual', 'color')],
-    [Input('annual-plot-picker', 'value'),
-     Input('mon-filter-annual', 'n_clicks'),
-     Input('tue-filter-annual', 'n_clicks'),
-     Input('wed-filter-annual', 'n_clicks'),
-     Input('thu-filter-annual', 'n_clicks'),
-     Input('fri-filter-annual', 'n_clicks'),
-     Input('sat-filter-annual', 'n_clicks'),
-     Input('sun-filter-annual', 'n_clicks'),
-     Input('work-nights-filter-annual', 'n_clicks'),
-     Input('off-nights-filter-annual', 'n_clicks')]
-)
+# (registered below, unless the filters are applied client-side)
 def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
                         thu_clicks, fri_clicks, sat_clicks, sun_clicks,
                         wn_clicks, offn_clicks):
-    
+
+    # interpret click values for updating UI & data filters
+    [wn_color, offn_color, tod_filter] = react_tod_clicks(wn_clicks, offn_clicks)
+    [mon_color, tue_color, wed_color, thu_color, fri_color, sat_color, sun_color, dow_filter] = \
+        react_dow_clicks(mon_clicks, tue_clicks, wed_clicks, thu_clicks, fri_clicks, sat_clicks, sun_clicks)
+
+    # identical filter states reuse the figure built by any worker for the current data
+    fig = figure_cache.get_figure("annual", [plot_picker, dow_filter, tod_filter],
+                                  build_annual_figure, data_path())
+
+    return [fig, mon_color, tue_color, wed_color, thu_color, \
+            fri_color, sat_color, sun_color, wn_color, offn_color]
+
+
+# filter the annual tab's data and select the plotted variable
+def annual_plot_data(plot_picker, dow_filter, tod_filter):
+
     # since plotting data is mutable (subject to adding new data)
-    # this data is read from disk, ensuring all callbacks are accessing the same data
-    sleep_descr_df = pd.read_pickle(proj_path + "data/all_sleep_descr_df.pkl")
-    sleep_event_df = pd.read_pickle(proj_path + "data/all_sleep_event_df.pkl")
-    sun_df = pd.read_pickle(proj_path + "data/sun_df.pkl")
+    # the shared frames are reloaded whenever a sync bumps the data generation
+    with metrics.stage("data_load"):
+        sleep_descr_df, sleep_event_df, filter_index = data_cache.get_filter_index(data_path())
     
     # filter out data with less than 100 days of data in a year
     years_cnt = sleep_descr_df["Year"].value_counts()
     years_ls = years_cnt[years_cnt > 100].index.to_list()
 
+    # filter data by getting the rows of sleep sessions which meet filter criteria
+    with metrics.stage("filter"):
+        mask_df, events_df = sleep_filters.filter_events(
+            sleep_descr_df, sleep_event_df, filter_index, None, dow_filter, tod_filter)
+
+    # set variable dependent on the selected plot picker option, where the
+    # year-agnostic Mon_Day dates were added to the data at ingest
+    data_df = pd.DataFrame({"x": mask_df.Mon_Day.values})
+    if plot_picker == "fell asleep":
+        data_df["y"] = events_df.Asleep_ToD.values
+    elif plot_picker == "woke up":
+        data_df["y"] = events_df.Wake_ToD.values
+    elif plot_picker == "dur":
+        data_df["y"] = mask_df.Total_Dur.dt.seconds.values/(60.*60)
+    data_df["year"] = mask_df.Year.values
+    data_df["flags"] = sleep_filters.session_flags(mask_df)
+
+    return data_df, years_ls
+
+
+# split the annual tab's data into the rows of each year in years_ls, in a single pass
+def annual_year_frames(data_df, years_ls):
+    year_frames = dict(iter(data_df.groupby("year", sort=False)))
+    return [year_frames.get(year, data_df.iloc[:0]) for year in years_ls]
+
+
+# compute the smoothed line of one year's data
+def annual_year_fit(data_year_df, plot_picker):
+    # add smooth signal line for waking up
+    x_numeric = data_year_df.x - dt.datetime(dummy_year, 1, 1)
+    y_numeric = data_year_df.y
+    fit_series = smoother.smooth(y_numeric, x_numeric.dt.days, 0.2)
+
+    # define hoverinfo depending on variable being plotted
+    if plot_picker == "dur":
+        fit_series_dt = dt.datetime(dummy_year, 1, 1) + \
+                       pd.to_timedelta(fit_series[:,0], unit="days")
+        hover_tmp = "%{text|%B %d}<br>%{y:.2f} hours"
+    else:
+        fit_series_dt = dt.datetime(dummy_year, 1, 1) + \
+                       pd.to_timedelta(fit_series[:,0], unit="days") + \
+                       pd.to_timedelta(fit_series[:,1], unit="hours")
+        hover_tmp = "%{text|" + sun_time_format + "}"
+    hover_info = sleep_schema.hover_times(pd.Series(fit_series_dt))
+
+    return dict(
+        x=dt.datetime(dummy_year, 1, 1) + pd.to_timedelta(fit_series[:,0] - 1, unit="D"),
+        y=fit_series[:,1],
+        text=hover_info,
+        hovertemplate=hover_tmp)
+
+
+# compute the annual tab's smoothed line for each year, keyed by the meta tag of their traces
+def annual_fit_lines(year_frames, years_ls, plot_picker):
+    return {"fit-" + str(year): annual_year_fit(data_year_df, plot_picker)
+            for year, data_year_df in zip(years_ls, year_frames)}
+
+
+# build the annual figure for the given plotted variable and filters
+def build_annual_figure(plot_picker, dow_filter, tod_filter):
+
+    # filter the data, then fit a smoothed line to each year
+    data_df, years_ls = annual_plot_data(plot_picker, dow_filter, tod_filter)
+    with metrics.stage("smoothing"):
+        year_frames = annual_year_frames(data_df, years_ls)
+        fit_lines = annual_fit_lines(year_frames, years_ls, plot_picker)
+    with metrics.stage("data_load"):
+        # the seasonal sunrise/sunset aggregate drawn below the years
+        sun_agg_df = data_cache.get_sun_agg(data_path())
+
+    with metrics.stage("figure_build"):
+        return annual_figure(plot_picker, years_ls, year_frames, fit_lines, sun_agg_df)
+
+
+# lay out the annual figure of each year's data and smoothed line
+def annual_figure(plot_picker, years_ls, year_frames, fit_lines, sun_agg_df):
+
     # make viridis color levels for each year
     cmap_start = 0.1
     cmap_stop = 1
     cmap_ls = [cmap_start + x*(cmap_stop - cmap_start)/len(years_ls) for x in range(len(years_ls))]
-    year_colors = ["rgb" + str(mpl_cmap("viridis")(x)[:3]) for x in cmap_ls]
-
-    # create year-agnostic date column for plotting all years against one another
-    def dt_replace_year(dt_series, set_year):
-        df = pd.DataFrame()
-        df["year"] = [set_year]*len(dt_series)
-        df["month"] = dt_series.dt.month
-        df["day"] = dt_series.dt.day
-        return pd.to_datetime(df)
-
-    dummy_year = 2000
-    sleep_descr_df["Prev_Mon_Day"] = dt_replace_year(sleep_descr_df["Prev_Day"], dummy_year)
-    sleep_event_df["Prev_Mon_Day"] = dt_replace_year(sleep_event_df["Prev_Day"], dummy_year)
-    
-    # interpret click values for updating UI & data filters
-    [wn_color, offn_color, tod_filter] = react_tod_clicks(wn_clicks, offn_clicks)
-    [mon_color, tue_color, wed_color, thu_color, fri_color, sat_color, sun_color, dow_filter] = \
-        react_dow_clicks(mon_clicks, tue_clicks, wed_clicks, thu_clicks, fri_clicks, sat_clicks, sun_clicks)
-
-    # filter data by getting sleep session IDs which meet filter criteria
-    sleep_descr_df = sleep_descr_df[(sleep_descr_df["Day"].isin(dow_filter)) & 
-                        (sleep_descr_df["Is_Workday"].isin(tod_filter))]
-    sleep_event_df = sleep_event_df[sleep_event_df["Sleep_Session_ID"]. \
-                isin(sleep_descr_df["Sleep_Session_ID"])]
+    year_colors = ["rgb" + str(palette.viridis(x)) for x in cmap_ls]
 
-    # set variable dependent on the selected plot picker option
-    data_df = pd.DataFrame()
+    # set axis properties dependent on the selected plot picker option
     if plot_picker == "fell asleep":
-        data_df["x"] = sleep_event_df.query('Event == "Fell Asleep"').Prev_Mon_Day
-        data_df["y"] = sleep_event_df.query('Event == "Fell Asleep"').ToD
-        data_df["year"] = sleep_event_df.query('Event == "Fell Asleep"').Prev_Day.dt.year
         y_title_plot = "Fell Asleep Time"
         y_range_plot = [0, 4]
         y_tick_labels = ["1 AM", "3 AM"]
         y_tick_vals = [1, 3]
     elif plot_picker == "woke up":
-        data_df["x"] = sleep_event_df.query('Event == "Woke Up"').Prev_Mon_Day
-        data_df["y"] = sleep_event_df.query('Event == "Woke Up"').ToD
-        data_df["year"] = sleep_event_df.query('Event == "Woke Up"').Prev_Day.dt.year
         y_title_plot = "Woke Up Time"
         y_range_plot = [7, 11]
         y_tick_labels = ["8 AM", "10 AM"]
         y_tick_vals = [8, 10]
     elif plot_picker == "dur":
-        data_df["x"] = sleep_descr_df.Prev_Mon_Day
-        data_df["y"] = sleep_descr_df.Total_Dur.dt.seconds/(60.*60)
-        data_df["year"] = sleep_descr_df.Year
         y_title_plot = "Duration (hours)"
         y_range_plot = [5, 10]
         y_tick_labels = None
@@ -1134,14 +1283,12 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
                                  column_widths=[1], vertical_spacing=0.06)
 
     # scatter plot for each year
-    for i, year in enumerate(years_ls):
-        # isolate data for [year]
-        data_year_df = data_df[data_df["year"] == year]
-
-        fig.add_trace(go.Scatter(
+    for i, (year, data_year_df) in enumerate(zip(years_ls, year_frames)):
+        fig.add_trace(figure_encoding.scatter_trace(
             name=str(year),
             x=data_year_df.x,
             y=data_year_df.y,
+            customdata=data_year_df["flags"] if client_side_filtering else None,
             hoverinfo="skip",
             marker_color=year_colors[i],
             marker_line_width=0, 
@@ -1153,33 +1300,10 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
     
     # plot a fitted-curve to each year
     for i, year in enumerate(years_ls):
-        # isolate data for [year]
-        data_year_df = data_df[data_df["year"] == year]
-
-        # add smooth signal line for waking up
-        x_numeric = data_year_df.x - dt.datetime(dummy_year, 1, 1)
-        y_numeric = data_year_df.y
-        fit_series = lowess(y_numeric, x_numeric.dt.days, is_sorted=True, frac=0.2, it=0)
-
-        # define hoverinfo depending on variable being plotted
-        if plot_picker == "dur":
-            fit_series_dt = dt.datetime(dummy_year, 1, 1) + \
-                           pd.to_timedelta(fit_series[:,0], unit="days")
-            hover_info = fit_series_dt.strftime("%B %d")
-            hover_tmp = "%{text}<br>%{y:.2f} hours"
-        else:
-            fit_series_dt = dt.datetime(dummy_year, 1, 1) + \
-                           pd.to_timedelta(fit_series[:,0], unit="days") + \
-                           pd.to_timedelta(fit_series[:,1], unit="hours")
-            hover_info = fit_series_dt.strftime("%B %d, %r")
-            hover_tmp = "%{text}"
-        
-        fig.add_trace(go.Scatter(
+        fig.add_trace(figure_encoding.scatter_trace(
             name=str(year),
-            x=dt.datetime(dummy_year, 1, 1) + pd.to_timedelta(fit_series[:,0] - 1, unit="D"),
-            y=fit_series[:,1],
-            text=hover_info,
-            hovertemplate=hover_tmp,
+            meta="fit-" + str(year),
+            **fit_lines["fit-" + str(year)],
             mode="lines",
             line=dict(
                 color=year_colors[i],
@@ -1194,19 +1318,8 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
                             marker=dict(size=8, color=year_colors[i]),
                             showlegend=True, name=str(year)))
     
-    # provide bottom reference plot to sunset
-    # first, sunset and sunrise will be averaged for each day of year
-    sun_df["Mon_Day"] = dt_replace_year(sun_df["Date"], dummy_year)
-    sun_agg_df = pd.DataFrame()
-    sun_agg_df["Date"] = pd.to_datetime(sun_df["Mon_Day"].unique()).sort_values()
-    sun_agg_fields = ["Sunrise_ToD", "Sunset_ToD"]
-    for sun_agg_field in sun_agg_fields:
-        sun_agg = sun_df.groupby("Mon_Day")[sun_agg_field].mean()
-        sun_agg_df = sun_agg_df.merge(sun_agg, left_on="Date", right_on="Mon_Day")
-    sun_agg_df["Sunrise"] = pd.to_datetime(sun_agg_df.Date) + \
-                          pd.to_timedelta(sun_agg_df["Sunrise_ToD"], unit="hour")
-    sun_agg_df["Sunset"] = pd.to_datetime(sun_agg_df.Date) + \
-                          pd.to_timedelta(sun_agg_df["Sunset_ToD"] + 24, unit="hour")
+    # provide bottom reference plot to sunset, with sunset and sunrise
+    # averaged for each day of year whenever the sunrise/sunset data changes
 
     # now set y axis properties and make bottom reference plot
     if plot_picker == "woke up":
@@ -1219,8 +1332,8 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
             name="Sunrise",
             x=sun_agg_df["Date"],
             y=sun_agg_df["Sunrise_ToD"],
-            text=sun_agg_df.Sunrise.dt.strftime("%B %d, %r"),
-            hovertemplate="%{text}",
+            text=sleep_schema.hover_times(sun_agg_df.Sunrise),
+            hovertemplate="%{text|" + sun_time_format + "}",
             fillcolor=invis,
             fill="tozeroy",
             mode="lines",
@@ -1236,8 +1349,7 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
             name="Above Sunrise",
             x=sun_agg_df["Date"],
             y=[16]*len(sun_agg_df),
-            text=sun_agg_df.Sunrise.dt.strftime("%B %d, %r"),
-            hovertemplate="%{text}",
+            hovertemplate=None,
             fill="tonextx",
             fillcolor=sun_fill_color,
             mode="lines",
@@ -1259,8 +1371,7 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
             name="Below Sunset",
             x=sun_agg_df["Date"],
             y=[-17]*len(sun_agg_df),
-            text=sun_agg_df.Sunset.dt.strftime("%B %d, %r"),
-            hovertemplate="%{text}",
+            hovertemplate=None,
             fillcolor=invis,
             fill="tonextx",
             mode="lines",
@@ -1276,8 +1387,8 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
             name="Sunset",
             x=sun_agg_df["Date"],
             y=sun_agg_df["Sunset_ToD"],
-            text=sun_agg_df.Sunset.dt.strftime("%B %d, %r"),
-            hovertemplate="%{text}",
+            text=sleep_schema.hover_times(sun_agg_df.Sunset),
+            hovertemplate="%{text|" + sun_time_format + "}",
             fillcolor=sun_fill_color,
             fill="tonextx",
             mode="lines",
@@ -1338,8 +1449,88 @@ def annual_update_graph(plot_picker, mon_clicks, tue_clicks, wed_clicks,
             borderwidth=0.5),
         legend_orientation="h")
     
-    return [fig, mon_color, tue_color, wed_color, thu_color, \
-            fri_color, sat_color, sun_color, wn_color, offn_color]
+    return fig
+
+# in client-side filtering mode the server provides each tab's figure with all
+# days included plus the smoothed lines for the current filters, and the
+# browser applies the day filters (see assets/clientside_filters.js)
+def overview_base_figure(date_range, relayout_data):
+    view_range = overview_view_range(relayout_data)
+    fig = figure_cache.get_figure("overview-base",
+                                  [date_range, sleep_filters.dow_vals, sleep_filters.tod_vals, view_range],
+                                  build_overview_figure, data_path())
+
+    # a zoomed event plot keeps its range when the filters change
+    range_axes = ["xaxis", "xaxis3"] if view_range is None else ["xaxis3"]
+    return {"figure": fig, "range_meta": "dur-scatter", "range_axes": range_axes}
+
+
+def overview_smoothed_lines(date_range, mon_clicks, tue_clicks, wed_clicks,
+                            thu_clicks, fri_clicks, sat_clicks, sun_clicks,
+                            wn_clicks, offn_clicks):
+    [wn_color, offn_color, tod_filter] = react_tod_clicks(wn_clicks, offn_clicks)
+    dow_filter = react_dow_clicks(mon_clicks, tue_clicks, wed_clicks, thu_clicks,
+                                  fri_clicks, sat_clicks, sun_clicks)[-1]
+    with metrics.stage("data_load"):
+        sleep_descr_df, sleep_event_df, filter_index = data_cache.get_filter_index(data_path())
+    with metrics.stage("filter"):
+        mask_df, events_df = sleep_filters.filter_events(
+            sleep_descr_df, sleep_event_df, filter_index, date_range, dow_filter, tod_filter)
+    if len(mask_df) == 0:
+        return {}
+    with metrics.stage("smoothing"):
+        fit_key = sleep_filters.filter_key(date_range, dow_filter, tod_filter, len(sleep_descr_df))
+        fits = fit_cache.get_overview_fits(mask_df, events_df, fit_key, data_path())
+        return overview_fit_lines(mask_df, fits)
+
+
+def annual_base_figure(plot_picker):
+    fig = figure_cache.get_figure("annual-base",
+                                  [plot_picker, sleep_filters.dow_vals, sleep_filters.tod_vals],
+                                  build_annual_figure, data_path())
+    return {"figure": fig}
+
+
+def annual_smoothed_lines(plot_picker, mon_clicks, tue_clicks, wed_clicks,
+                          thu_clicks, fri_clicks, sat_clicks, sun_clicks,
+                          wn_clicks, offn_clicks):
+    [wn_color, offn_color, tod_filter] = react_tod_clicks(wn_clicks, offn_clicks)
+    dow_filter = react_dow_clicks(mon_clicks, tue_clicks, wed_clicks, thu_clicks,
+                                  fri_clicks, sat_clicks, sun_clicks)[-1]
+    data_df, years_ls = annual_plot_data(plot_picker, dow_filter, tod_filter)
+    year_frames = annual_year_frames(data_df, years_ls)
+    years_ls = [year for year, data_year_df in zip(years_ls, year_frames) if len(data_year_df) > 0]
+    year_frames = [data_year_df for data_year_df in year_frames if len(data_year_df) > 0]
+    with metrics.stage("smoothing"):
+        return annual_fit_lines(year_frames, years_ls, plot_picker)
+
+
+if client_side_filtering:
+    app.callback(Output("overview-base-store", "data"),
+                 [Input("date-range-slider", "value"),
+                  Input("overview-scatter-plot", "relayoutData")])(requires_data(overview_base_figure))
+    app.callback(Output("overview-fit-store", "data"),
+                 [Input("date-range-slider", "value")] + overview_filter_inputs)(requires_data(overview_smoothed_lines))
+    app.clientside_callback(
+        ClientsideFunction(namespace="filters", function_name="apply"),
+        overview_outputs,
+        [Input("overview-base-store", "data"), Input("overview-fit-store", "data")] + overview_filter_inputs)
+
+    app.callback(Output("annual-base-store", "data"),
+                 [Input("annual-plot-picker", "value")])(requires_data(annual_base_figure))
+    app.callback(Output("annual-fit-store", "data"),
+                 [Input("annual-plot-picker", "value")] + annual_filter_inputs)(requires_data(annual_smoothed_lines))
+    app.clientside_callback(
+        ClientsideFunction(namespace="filters", function_name="apply"),
+        annual_outputs,
+        [Input("annual-base-store", "data"), Input("annual-fit-store", "data")] + annual_filter_inputs)
+else:
+    app.callback(overview_outputs,
+                 [Input('date-range-slider', 'value')] + overview_filter_inputs +
+                 [Input('overview-scatter-plot', 'relayoutData')],
+                 [State("date-range-slider", "max")])(requires_data(update_graph))
+    app.callback(annual_outputs,
+                 [Input('annual-plot-picker', 'value')] + annual_filter_inputs)(requires_data(annual_update_graph))
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,75 @@
+// Client-side filtering of the overview and annual graphs.
+//
+// The server stores each tab's figure with every day included, where every
+// per-point trace carries the filter flag bits of its sleep session as
+// customdata (bits 0-6 are the days of the week with Monday = 0, bit 7 marks
+// work nights and bit 8 marks off nights; see sleep_filters.session_flags).
+// Toggling a filter button only drops points here in the browser, while the
+// smoothed lines for the new filter state are requested from the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    filters: {
+        apply: function(base, fits) {
+            var clicks = Array.prototype.slice.call(arguments, 2);
+            var colors = clicks.map(function(n) {
+                return (n || 0) % 2 === 1 ? 'light' : 'primary';
+            });
+
+            // the bits a point needs to share with both the day and night toggles
+            var dow_bits = 0;
+            for (var i = 0; i < 7; i++) {
+                if (colors[i] === 'primary') { dow_bits |= 1 << i; }
+            }
+            var tod_bits = (colors[7] === 'primary' ? 1 << 7 : 0) |
+                           (colors[8] === 'primary' ? 1 << 8 : 0);
+
+            if (!base || !base.figure) {
+                return [{data: [], layout: {}}].concat(colors);
+            }
+            var fig = JSON.parse(JSON.stringify(base.figure));
+            var lines = fits || {};
+            var point_keys = ['x', 'y', 'text', 'customdata', 'hovertemplate'];
+
+            fig.data = fig.data.map(function(trace) {
+                if (trace.meta && trace.meta in lines) {
+                    return Object.assign(trace, lines[trace.meta]);
+                }
+                if (!Array.isArray(trace.customdata)) {
+                    return trace;
+                }
+                var keep = trace.customdata.map(function(flags) {
+                    return ((flags & dow_bits) !== 0) && ((flags & tod_bits) !== 0);
+                });
+                point_keys.forEach(function(key) {
+                    if (Array.isArray(trace[key])) {
+                        trace[key] = trace[key].filter(function(val, j) { return keep[j]; });
+                    }
+                });
+                return trace;
+            });
+
+            // smoothed lines missing from the server's response have no points left
+            fig.data.forEach(function(trace) {
+                if (trace.meta && !(trace.meta in lines) && trace.mode === 'lines' &&
+                    !Array.isArray(trace.customdata) && /fit/.test(trace.meta)) {
+                    trace.x = [];
+                    trace.y = [];
+                }
+            });
+
+            // fit the x axes to the points which are left, like the server-side figure
+            if (base.range_meta) {
+                var range_trace = fig.data.filter(function(trace) {
+                    return trace.meta === base.range_meta;
+                })[0];
+                if (range_trace && range_trace.x.length > 0) {
+                    var sorted_x = range_trace.x.slice().sort();
+                    var x_range = [sorted_x[0], sorted_x[sorted_x.length - 1]];
+                    base.range_axes.forEach(function(axis) {
+                        fig.layout[axis] = Object.assign({}, fig.layout[axis], {range: x_range});
+                    });
+                }
+            }
+            return [fig].concat(colors);
+        }
+    }
+});
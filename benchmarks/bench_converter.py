@@ -0,0 +1,98 @@
+"""
+Benchmark of update_garmin_sleep.converter() on a multi-year Garmin json.
+
+The nights in data/new_garmin_sleep.json are repeated (shifted by the span
+they cover) until the json covers the requested number of years.  The
+columnar converter() is timed against the previous row-by-row
+implementation, which is kept below as the reference, and both results are
+checked to hold the same values.
+
+Usage (from the project dir): python benchmarks/bench_converter.py [years]
+"""
+# import base packages
+import datetime, json, os, sys, time
+
+# import installed packages
+import pytz
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import update_garmin_sleep
+
+day_ms = 24*60*60*1000
+
+
+def multi_year_json(years, json_fn="data/new_garmin_sleep.json"):
+    with open(json_fn, "r") as fp:
+        base = json.load(fp)
+    span_days = len(base)
+    data = []
+    for rep in range(int(365*years/span_days) + 1):
+        shift_days = rep*span_days
+        for night in base:
+            night = dict(night)
+            cal_date = datetime.date.fromisoformat(night["calendarDate"]) + \
+                       datetime.timedelta(days=shift_days)
+            night["calendarDate"] = cal_date.isoformat()
+            for key in ["sleepStartTimestampGMT", "sleepEndTimestampGMT"]:
+                if night[key] is not None:
+                    night[key] += shift_days*day_ms
+            data.append(night)
+    return data
+
+
+def rowwise_converter(data):
+    # the row-by-row implementation which converter() replaced
+    def sleep_timestamp(val):
+        if val is None:
+            return None
+        else:
+            return datetime.datetime.fromtimestamp(val / 1000, pytz.utc)
+
+    def sleep_timedelta(val):
+        if val is None:
+            return None
+        else:
+            return datetime.timedelta(seconds=val)
+
+    nights = pd.DataFrame(columns=["Prev_Day", "Bed_Time", "Wake_Time",
+                                   "Awake_Dur", "Light_Dur", "Deep_Dur",
+                                   "Total_Dur", "Nap_Dur", "Window_Conf"])
+    for i, d in enumerate(data):
+        previous_day = datetime.date(*[int(datepart) for datepart in d['calendarDate'].split('-')]) - datetime.timedelta(days=1)
+        nights.loc[i] = [previous_day, sleep_timestamp(d['sleepStartTimestampGMT']),
+                         sleep_timestamp(d['sleepEndTimestampGMT']),
+                         sleep_timedelta(d['awakeSleepSeconds']),
+                         sleep_timedelta(d['lightSleepSeconds']),
+                         sleep_timedelta(d['deepSleepSeconds']),
+                         sleep_timedelta(d['sleepTimeSeconds']),
+                         sleep_timedelta(d['napTimeSeconds']),
+                         d['sleepWindowConfirmed']]
+    return nights
+
+
+def check_equal(new_df, ref_df):
+    new_df["Prev_Day"] = new_df["Prev_Day"].dt.date
+    for col in ["Bed_Time", "Wake_Time"]:
+        ref_df[col] = pd.to_datetime(ref_df[col], utc=True)
+    for col in ["Awake_Dur", "Light_Dur", "Deep_Dur", "Total_Dur", "Nap_Dur"]:
+        ref_df[col] = pd.to_timedelta(ref_df[col])
+    pd.testing.assert_frame_equal(new_df, ref_df, check_dtype=False)
+
+
+def timed(fn, data):
+    start = time.perf_counter()
+    result = fn(data)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    data = multi_year_json(years)
+    new_df, new_secs = timed(update_garmin_sleep.converter, data)
+    ref_df, ref_secs = timed(rowwise_converter, data)
+    check_equal(new_df, ref_df)
+    print("nights: %d" % len(data))
+    print("row-by-row converter: %.3f s" % ref_secs)
+    print("columnar converter:   %.3f s" % new_secs)
+    print("speedup: %.0fx" % (ref_secs/new_secs))
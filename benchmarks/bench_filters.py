@@ -0,0 +1,69 @@
+"""
+Benchmark of the graph callbacks' session filtering.
+
+sleep_filters.filter_events (bitmask test plus positional event lookup
+through a FilterIndex) is compared with sleep_filters.filter_data, the isin
+based filtering the callbacks used to run, for every toggle combination over
+a few slider ranges.  The index is also checked against an event frame in
+shuffled order, which takes its non-positional path.
+
+Usage (from the project dir): python benchmarks/bench_filters.py
+"""
+# import base packages
+import os, sys, time
+
+# import installed packages
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import data_cache, sleep_filters
+
+
+def check_equal(sleep_descr_df, sleep_event_df, filter_index, date_ranges):
+    for date_range in date_ranges:
+        for dow_filter, tod_filter in sleep_filters.all_toggle_filters():
+            expected = sleep_filters.filter_data(sleep_descr_df, sleep_event_df,
+                                                 date_range, dow_filter, tod_filter)
+            result = sleep_filters.filter_events(sleep_descr_df, sleep_event_df, filter_index,
+                                                 date_range, dow_filter, tod_filter)
+            for expected_df, result_df in zip(expected, result):
+                pd.testing.assert_frame_equal(expected_df, result_df)
+
+
+def time_per_call(fn, date_ranges, n_repeats=3):
+    filters = list(sleep_filters.all_toggle_filters())
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        for date_range in date_ranges:
+            for dow_filter, tod_filter in filters:
+                fn(date_range, dow_filter, tod_filter)
+    return (time.perf_counter() - start)/(n_repeats*len(date_ranges)*len(filters))
+
+
+if __name__ == "__main__":
+    sleep_descr_df, sleep_event_df, _ = data_cache.get_datasets()
+    n_rows = len(sleep_descr_df)
+    date_ranges = [None, [0, n_rows - 1], [n_rows//4, n_rows//2]]
+
+    start = time.perf_counter()
+    filter_index = sleep_filters.FilterIndex(sleep_descr_df, sleep_event_df)
+    print("index built in %.2f ms (aligned events: %s)" %
+          (1000*(time.perf_counter() - start), filter_index.aligned))
+
+    check_equal(sleep_descr_df, sleep_event_df, filter_index, date_ranges)
+    shuffled_event_df = sleep_event_df.sample(frac=1, random_state=0)
+    check_equal(sleep_descr_df, shuffled_event_df,
+                sleep_filters.FilterIndex(sleep_descr_df, shuffled_event_df), date_ranges[:1])
+    print("filter_events matches filter_data for all %d toggle combinations" %
+          len(list(sleep_filters.all_toggle_filters())))
+
+    query_time = time_per_call(lambda *args: sleep_filters.filter_data(
+        sleep_descr_df, sleep_event_df, *args), date_ranges)
+    select_time = time_per_call(filter_index.select, date_ranges)
+    frames_time = time_per_call(lambda *args: sleep_filters.filter_events(
+        sleep_descr_df, sleep_event_df, filter_index, *args), date_ranges)
+    print("filter_data:        %8.1f us per filter state" % (1e6*query_time))
+    print("FilterIndex.select: %8.1f us per filter state" % (1e6*select_time))
+    print("filter_events:      %8.1f us per filter state" % (1e6*frames_time))
+    print("speedup of filter_events: %.0fx" % (query_time/frames_time))
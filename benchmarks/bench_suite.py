@@ -0,0 +1,214 @@
+"""
+Benchmark suite of the dashboard callbacks and the data sync pipeline.
+
+For each requested scale (years of history), a synthetic data dir is written
+with benchmarks/synthetic_data.py (and reused by later runs), then timed:
+
+- the overview and annual callbacks (update_graph, annual_update_graph) for
+  fixed filter scenarios, cold (figure and on-demand fit caches cleared) and
+  warm (the figure is served from the in-process cache),
+- a cold load of the shared frames (data_cache),
+- update_garmin_sleep.converter() on the whole Garmin json,
+- the sync steps on a copy of the data dir: step0, step3 adding the held out
+  nights incrementally, step4 for their dates, and step3 rebuilding every
+  derived frame.
+
+Each timing is the best of n_repeats runs.  The results are appended to
+results_fn together with the commit they were measured at, and compared with
+the most recent results of another commit at the same scale, so that
+regressions show up between commits.
+
+Usage (from the project dir): python benchmarks/bench_suite.py [years ...]
+"""
+# import base packages
+import datetime, json, os, shutil, subprocess, sys, tempfile, time, warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app, data_cache, figure_cache, fit_cache, update_garmin_sleep
+import synthetic_data
+
+default_years = [5, 20, 50] # scales run when none are given
+n_repeats = 3 # number of runs per timing, the fastest of which is kept
+synthetic_dir = "benchmarks/synthetic/" # dir holding one generated data dir per scale
+results_fn = "benchmarks/results/history.jsonl" # one json record per run and scale
+regression_ratio = 1.25 # timings this much slower than the previous commit's are flagged
+
+# click counts of the (mon, tue, wed, thu, fri, sat, sun, work nights, off nights)
+# toggles, where an odd count switches a toggle off
+all_clicks = [None]*9
+work_night_clicks = [None]*8 + [1]
+mon_fri_clicks = [None, 1, 1, 1, None, 1, 1, None, None]
+fri_sat_clicks = [1, 1, 1, 1, None, None, 1, None, None]
+
+overview_scenarios = [
+    ("all days", "all", all_clicks),
+    ("work nights", "all", work_night_clicks),
+    ("mon/fri, last quarter", "last quarter", mon_fri_clicks)
+]
+annual_scenarios = [
+    ("fell asleep, all days", "fell asleep", all_clicks),
+    ("woke up, work nights", "woke up", work_night_clicks),
+    ("dur, fri/sat", "dur", fri_sat_clicks)
+]
+
+
+def data_dir(years):
+    # the synthetic data dir of years, generated unless it exists already
+    proj_path = synthetic_dir + "%gy/" % years
+    try:
+        with open(proj_path + synthetic_data.info_fn, "r") as fp:
+            info = json.load(fp)
+        if info["years"] == years:
+            return proj_path, info
+    except (OSError, ValueError, KeyError):
+        pass
+    print("generating %g years of synthetic data in %s" % (years, proj_path))
+    return proj_path, synthetic_data.write_data_dir(proj_path, years)
+
+
+def best_time(fn, setup=None):
+    # fastest of n_repeats runs of fn(setup()), where setup isn't timed
+    times = []
+    for _ in range(n_repeats):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def clear_caches(proj_path):
+    # drop the figures and on-demand fits, but keep the fits precomputed at sync time
+    with figure_cache._lock:
+        figure_cache._lru.clear()
+    with fit_cache._lock:
+        fit_cache._lru.clear()
+    shutil.rmtree(proj_path + figure_cache.cache_dir, ignore_errors=True)
+
+
+def callback_timings(proj_path):
+    app.proj_path = proj_path
+    n_rows = len(data_cache.get_datasets(proj_path)[0])
+    max_date = n_rows - 1
+    date_ranges = {"all": [0, max_date], "last quarter": [3*n_rows//4, max_date]}
+    timings = {}
+
+    def reload_frames(_):
+        data_cache._cache.pop(proj_path, None)
+        data_cache.get_filter_index(proj_path)
+    timings["data_cache load"] = best_time(reload_frames)
+
+    for name, range_name, clicks in overview_scenarios:
+        run = lambda _: app.update_graph(date_ranges[range_name], *clicks, None, max_date)
+        timings["update_graph cold: " + name] = best_time(run, lambda: clear_caches(proj_path))
+        timings["update_graph warm: " + name] = best_time(run)
+
+    for name, plot_picker, clicks in annual_scenarios:
+        run = lambda _: app.annual_update_graph(plot_picker, *clicks)
+        timings["annual_update_graph cold: " + name] = best_time(run, lambda: clear_caches(proj_path))
+        timings["annual_update_graph warm: " + name] = best_time(run)
+    return timings
+
+
+def sync_timings(proj_path, info):
+    timings = {}
+    data = synthetic_data.garmin_nights(
+        synthetic_data.garmin_start - datetime.timedelta(days=1), info["n_nights"], info["seed"])
+    timings["converter"] = best_time(lambda _: update_garmin_sleep.converter(data))
+
+    with open(proj_path + update_garmin_sleep.garmin_results_json_fn, "r") as fp:
+        new_data = json.load(fp)
+    update_garmin_sleep.start_date = info["first_day"]
+    update_garmin_sleep.end_date = info["last_day"]
+
+    def copy_data_dir(rebuild=False):
+        # the sync steps write to the data dir, so each run works on its own copy
+        tmp_dir = tempfile.mkdtemp(prefix="bench_suite_")
+        shutil.copytree(proj_path + "data", tmp_dir + "/data")
+        update_garmin_sleep.proj_path = tmp_dir + "/"
+        if rebuild:
+            os.remove(tmp_dir + "/" + update_garmin_sleep.step3_state_fn)
+        return tmp_dir
+
+    step_times = {"step0": [], "step3 incremental": [], "step4": [], "step3 rebuild": []}
+    for _ in range(n_repeats):
+        for rebuild in [False, True]:
+            tmp_dir = copy_data_dir(rebuild)
+            try:
+                start = time.perf_counter()
+                _, nights_archive, new_req_dates_ls = update_garmin_sleep.step0()
+                step0_end = time.perf_counter()
+                complete_dates_ls = update_garmin_sleep.step3(
+                    nights_archive, new_data, new_req_dates_ls)[3]
+                step3_end = time.perf_counter()
+                if rebuild:
+                    step_times["step3 rebuild"].append(step3_end - step0_end)
+                    continue
+                update_garmin_sleep.step4(complete_dates_ls)
+                step_times["step0"].append(step0_end - start)
+                step_times["step3 incremental"].append(step3_end - step0_end)
+                step_times["step4"].append(time.perf_counter() - step3_end)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    timings.update({name: min(times) for name, times in step_times.items()})
+    return timings
+
+
+def git_commit():
+    # the current commit, and whether tracked files have uncommitted changes
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).decode().strip()
+        dirty = len(subprocess.check_output(["git", "status", "--porcelain", "-uno"]).strip()) > 0
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def previous_record(record):
+    # the most recent record of another commit at the same scale
+    try:
+        with open(results_fn, "r") as fp:
+            records = [json.loads(line) for line in fp if line.strip()]
+    except OSError:
+        return None
+    for prev in reversed(records):
+        if (prev["years"] == record["years"]) and \
+                ((prev["commit"], prev["dirty"]) != (record["commit"], record["dirty"])):
+            return prev
+    return None
+
+
+def print_report(record, prev):
+    print("\n%g years (%d nights), commit %s%s" % (record["years"], record["n_nights"],
+                                                   record["commit"], " (dirty)" if record["dirty"] else ""))
+    if prev is not None:
+        print("compared with commit %s%s of %s" % (prev["commit"], " (dirty)" if prev["dirty"] else "",
+                                                   prev["time"]))
+    for name, secs in record["timings"].items():
+        line = "  %-48s %10.2f ms" % (name, 1000*secs)
+        prev_secs = prev["timings"].get(name) if prev is not None else None
+        if prev_secs:
+            ratio = secs/prev_secs
+            line += "   %10.2f ms  %5.2fx" % (1000*prev_secs, ratio)
+            if ratio > regression_ratio:
+                line += "  REGRESSION"
+        print(line)
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore", FutureWarning)
+    # NaT durations and filter selections without any known values
+    warnings.simplefilter("ignore", RuntimeWarning)
+    years_ls = [float(arg) for arg in sys.argv[1:]] or default_years
+    commit, dirty = git_commit()
+    os.makedirs(os.path.dirname(results_fn), exist_ok=True)
+
+    for years in years_ls:
+        proj_path, info = data_dir(years)
+        timings = callback_timings(proj_path)
+        timings.update(sync_timings(proj_path, info))
+        record = {"commit": commit, "dirty": dirty, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                  "years": years, "n_nights": info["n_nights"], "timings": timings}
+        print_report(record, previous_record(record))
+        with open(results_fn, "a") as fp:
+            fp.write(json.dumps(record) + "\n")
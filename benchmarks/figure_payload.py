@@ -0,0 +1,68 @@
+"""
+Payload size and encode time of the dashboard figures in both serialization modes.
+
+Every figure is built with figure_encoding.compact off (plotly's encoder and
+SVG traces) and on (see figure_encoding), then timed through the two encodes
+a request pays for: figure_encoding.encode() when the figure is cached, and
+Dash's own encode of the callback response.  The response size is printed
+as sent and gzipped (Dash compresses responses with Flask-Compress).
+
+Usage (from the project dir): python benchmarks/figure_payload.py
+"""
+# import base packages
+import gzip, json, os, sys, time
+
+# import installed packages
+import plotly
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app, figure_encoding, sleep_filters
+
+
+def best_time(fn, n_repeats=5):
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def figure_report(build_fn):
+    fig = build_fn()
+    encode_time, fig_json = best_time(lambda: figure_encoding.encode(fig))
+    fig_dict = figure_encoding.decode(fig_json)
+    response = {"response": {"props": {"figure": fig_dict}}}
+    dash_time, response_json = best_time(
+        lambda: json.dumps(response, cls=plotly.utils.PlotlyJSONEncoder))
+    return {
+        "encode ms": 1000*encode_time,
+        "dash encode ms": 1000*dash_time,
+        "payload KB": len(response_json)/1024.,
+        "gzip KB": len(gzip.compress(response_json.encode("utf-8")))/1024.
+    }
+
+
+if __name__ == "__main__":
+    all_days = [sleep_filters.dow_vals, sleep_filters.tod_vals]
+    figures = [
+        ("overview", lambda: app.build_overview_figure(None, *all_days)),
+        ("overview mon/fri work", lambda: app.build_overview_figure(
+            None, ["Monday", "Friday"], [True])),
+        ("annual fell asleep", lambda: app.build_annual_figure("fell asleep", *all_days)),
+        ("annual woke up", lambda: app.build_annual_figure("woke up", *all_days)),
+        ("annual dur", lambda: app.build_annual_figure("dur", *all_days))
+    ]
+
+    cols = ["encode ms", "dash encode ms", "payload KB", "gzip KB"]
+    print("%-22s %-8s" % ("figure", "mode") + "".join(["%16s" % col for col in cols]))
+    for name, build_fn in figures:
+        reports = []
+        for compact in [False, True]:
+            figure_encoding.compact = compact
+            report = figure_report(build_fn)
+            reports.append(report)
+            print("%-22s %-8s" % (name, "compact" if compact else "plotly") +
+                  "".join(["%16.1f" % report[col] for col in cols]))
+        print("%-22s %-8s" % ("", "ratio") +
+              "".join(["%16.2f" % (reports[1][col]/reports[0][col]) for col in cols]))
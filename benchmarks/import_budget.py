@@ -0,0 +1,75 @@
+"""
+Import time budget of the modules a worker or sync job starts with.
+
+Each module of checks is imported in a fresh interpreter with
+python -X importtime, n_runs times, and the fastest run is compared with the
+module's budget.  The check also fails if the module imports any of the
+packages which must only be imported on first use (e.g. the browser stack,
+which only step1 of a sync needs), and prints the slowest direct imports
+either way.
+
+Exits with status 1 if any check fails, so it can gate a deploy or CI run.
+
+Usage (from the project dir): python benchmarks/import_budget.py [budget scale]
+"""
+# import base packages
+import re, subprocess, sys
+
+n_runs = 3 # imports per module, the fastest of which is kept
+n_slowest = 8 # number of the slowest direct imports printed per module
+
+# (module, import time budget in seconds, packages it must not import)
+checks = [
+    ("app", 2.0, ["matplotlib", "statsmodels", "update_garmin_sleep",
+                  "seleniumwire", "selenium", "chardet"]),
+    ("update_garmin_sleep", 0.75, ["matplotlib", "statsmodels", "seleniumwire", "selenium",
+                                   "chardet", "brotli", "requests"]),
+]
+
+_line_re = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(module):
+    """
+    Return the -X importtime records of importing module in a new interpreter,
+    as (depth, package, cumulative seconds) tuples in the order they finished.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError("importing %s failed:\n%s" % (module, proc.stderr))
+    records = []
+    for line in proc.stderr.splitlines():
+        match = _line_re.match(line)
+        if match is not None:
+            depth = (len(match.group(3)) - 1)//2
+            records.append((depth, match.group(4), int(match.group(2))/1e6))
+    return records
+
+
+def check(module, budget, lazy_packages):
+    # returns whether module is within its budget and imports no lazy package
+    runs = [import_times(module) for _ in range(n_runs)]
+    records = min(runs, key=lambda run: [secs for depth, name, secs in run if name == module][0])
+    total = [secs for depth, name, secs in records if name == module][0]
+
+    # the imports made directly by the module, and the imports it shouldn't make
+    module_depth = [depth for depth, name, secs in records if name == module][0]
+    direct = sorted([(secs, name) for depth, name, secs in records if depth == module_depth + 1],
+                    reverse=True)
+    imported = {name for depth, name, secs in records}
+    eager = [package for package in lazy_packages if package in imported]
+
+    ok = (total <= budget) and (len(eager) == 0)
+    print("%s: %.3f s of a %.3f s budget%s" % (module, total, budget, "" if ok else "  FAILED"))
+    for secs, name in direct[:n_slowest]:
+        print("  %-40s %8.3f s" % (name, secs))
+    if len(eager) > 0:
+        print("  imports packages which should load on first use: " + ", ".join(eager))
+    return ok
+
+
+if __name__ == "__main__":
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.
+    results = [check(module, scale*budget, lazy_packages) for module, budget, lazy_packages in checks]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,114 @@
+"""
+Memory report of the sleep frames in the long layout and the compact schema.
+
+The archived sleep description and event pickles are loaded as they were
+written, converted with sleep_schema.compact_descr and compact_events, and
+the bytes held by each column are printed before and after.  Pickles which
+were already written in the compact schema report no change.
+
+It then checks that the column files of the archived frames (see
+column_store) stay shared: every column of a frame read from them must
+still be a view of its memory-mapped file, also after indexing the frame,
+rather than a private copy made by pandas consolidating the columns.  On
+Linux the resident bytes of those mappings are read from /proc/self/smaps,
+where file-backed pages are shared with every other process mapping the same
+files and anonymous pages would be private.  Exits with status 1 if any
+column was copied.
+
+Usage (from the project dir): python benchmarks/memory_report.py
+"""
+# import base packages
+import os, sys
+
+# import installed packages
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import column_store, data_cache, sleep_schema
+
+
+def print_report(name, before_df, after_df):
+    report_df = sleep_schema.memory_report(before_df, after_df)
+    print(name)
+    print(report_df.fillna(0).astype(int).to_string())
+    total = report_df.loc["total"]
+    print("%.1f%% of the original size\n" % (100.*total["after"]/total["before"]))
+
+
+def copied_columns(df):
+    # the columns of a frame read by column_store which aren't mapped views
+    return [col for col in df.columns if (df[col].dtype != object) and
+            not column_store.is_mapped(column_store.column_values(df[col]))]
+
+
+def mapped_bytes(paths):
+    # (resident, anonymous) bytes of this process' mappings of files in paths, None off Linux
+    try:
+        with open("/proc/self/smaps", "r") as fp:
+            lines = fp.readlines()
+    except OSError:
+        return None
+    resident = anonymous = 0
+    in_paths = False
+    for line in lines:
+        fields = line.split()
+        if "-" in fields[0]:
+            # the header line of a mapping, which ends with its file path if any
+            in_paths = (len(fields) > 5) and any(fields[5].startswith(path) for path in paths)
+        elif in_paths and (fields[0] == "Rss:"):
+            resident += int(fields[1])*1024
+        elif in_paths and (fields[0] == "Anonymous:"):
+            anonymous += int(fields[1])*1024
+    return resident, anonymous
+
+
+def check_shared(pkl_fns):
+    # returns whether every column of the archived frames is shared
+    ok = True
+    frames = []
+    for fn in pkl_fns:
+        df = column_store.read_frame(fn)
+        if df is None:
+            print("%s: no up-to-date column files, skipped" % fn)
+            continue
+        copied = copied_columns(df)
+        # indexing must not consolidate (and so copy) the columns of the frame itself
+        df.iloc[::2]
+        df.take(np.arange(len(df)))
+        copied_after = copied_columns(df)
+        print("%s: %d of %d columns mapped, %d after indexing" %
+              (fn, len(df.columns) - len(copied), len(df.columns), len(df.columns) - len(copied_after)))
+        if len(copied_after) > 0:
+            print("  copied into private memory: " + ", ".join(map(str, copied_after)))
+            ok = False
+        frames.append(df)
+
+    # fault in every mapped page, then see where the resident pages are
+    for df in frames:
+        for col in df.columns:
+            if df[col].dtype != object:
+                np.asarray(column_store.column_values(df[col])).view("u1").sum()
+    dirs = [os.path.abspath(column_store.artifact_dir(fn)) for fn in pkl_fns]
+    usage = mapped_bytes(dirs)
+    if usage is not None:
+        print("resident bytes of the mapped column files: %d shared, %d private" %
+              (usage[0] - usage[1], usage[1]))
+        ok = ok & (usage[1] == 0)
+    return ok
+
+
+if __name__ == "__main__":
+    sleep_descr_df = pd.read_pickle(data_cache.descr_fn)
+    sleep_event_df = pd.read_pickle(data_cache.event_fn)
+    compact_descr_df = sleep_schema.compact_descr(sleep_descr_df)
+    compact_event_df = sleep_schema.compact_events(compact_descr_df, sleep_event_df)
+
+    print_report(data_cache.descr_fn, sleep_descr_df, compact_descr_df)
+    print_report(data_cache.event_fn, sleep_event_df, compact_event_df)
+    for fn in [data_cache.descr_fn, data_cache.event_fn]:
+        print("%s on disk: %d bytes" % (fn, os.path.getsize(fn)))
+
+    print()
+    if not check_shared([data_cache.descr_fn, data_cache.event_fn, data_cache.sun_fn]):
+        sys.exit(1)
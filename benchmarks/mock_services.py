@@ -0,0 +1,199 @@
+"""
+Local stand-ins for the Garmin Connect and sunrise-sunset.org JSON APIs.
+
+The sync steps which download data (step2's Garmin windows and step4's
+sunrise/sunset lookups when update_garmin_sleep.sun_source is "api") can
+otherwise only be run against the live services.  MockServer answers both
+APIs from one local HTTP server:
+
+- garmin_path, Garmin's dailySleepsByDate: the nights of a synthetic dataset
+  (see synthetic_data.garmin_nights) whose calendarDate lies between the
+  startDate and endDate parameters.  Like Garmin, spans of more than
+  max_window_days days are rejected with a 400 error payload, and a share of
+  the responses are brotli compressed without a Content-Encoding header,
+  which update_garmin_sleep.download_to_json() detects on its own.
+- sun_path, sunrise-sunset.org's json API: the UTC sunrise and sunset of the
+  date parameter at lat/lng, formatted like the API's formatted=1 output.
+
+Every response is delayed by the configured latency, and a share of the
+requests fail with a server error (500 or 429 for Garmin, 500 for
+sunrise-sunset.org) carrying the error payload of the real API.  stats counts
+the requests, errors and bytes served per API.
+
+Usage (from the project dir): python benchmarks/mock_services.py [port] [years]
+"""
+# import base packages
+import datetime, json, os, random, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# import installed packages
+import brotli
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import solar
+import synthetic_data
+
+garmin_path = "/modern/proxy/wellness-service/wellness/dailySleepsByDate" # path of Garmin's sleep API
+sun_path = "/json" # path of the sunrise-sunset.org API
+max_window_days = 32 # Garmin rejects requests spanning more dates than this
+
+# default settings of a MockServer, each of which can be overridden
+default_config = {
+    "latency": 0.05, # seconds each response is delayed by
+    "latency_jitter": 0.02, # up to this many seconds are added at random to latency
+    "error_rate": 0., # share of requests answered with a server error
+    "brotli_rate": 0.2, # share of Garmin responses which are brotli compressed
+    "seed": 0 # seed of the latency, error and compression draws
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep connections alive, like the real APIs
+
+    def log_message(self, format, *args):
+        # don't print a line per request
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+        if url.path == garmin_path:
+            api, respond = "garmin", self.server.garmin_response
+        elif url.path == sun_path:
+            api, respond = "sun", self.server.sun_response
+        else:
+            self.send_body(404, json.dumps({"message": "Not Found"}).encode("ascii"))
+            return
+
+        time.sleep(self.server.draw_latency())
+        status, body = self.server.draw_error(api)
+        if status is None:
+            status, body = respond(params)
+        self.server.count(api, status, len(body))
+        self.send_body(status, body)
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    HTTP server of both mock APIs, serving the Garmin json data (a list of
+    dicts, one per night) and the settings of default_config, overridden by
+    any keyword arguments.
+    """
+    daemon_threads = True
+
+    def __init__(self, data, host="127.0.0.1", port=0, **config):
+        super().__init__((host, port), MockHandler)
+        self.config = dict(default_config, **config)
+        self.nights = {night["calendarDate"]: night for night in data}
+        self.url = "http://%s:%d" % self.server_address[:2]
+        self._rng = random.Random(self.config["seed"])
+        self._lock = threading.Lock()
+        self._sun_times = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {api: {"requests": 0, "errors": 0, "rejected": 0, "brotli": 0, "bytes": 0}
+                          for api in ["garmin", "sun"]}
+
+    def count(self, api, status, n_bytes, key=None):
+        with self._lock:
+            if key is not None:
+                self.stats[api][key] += 1
+                return
+            self.stats[api]["requests"] += 1
+            self.stats[api]["errors"] += status >= 500
+            self.stats[api]["bytes"] += n_bytes
+
+    def draw_latency(self):
+        with self._lock:
+            return self.config["latency"] + self._rng.uniform(0, self.config["latency_jitter"])
+
+    def draw_error(self, api):
+        # the status and body of an injected server error, or (None, None)
+        with self._lock:
+            if self._rng.random() >= self.config["error_rate"]:
+                return None, None
+            status = self._rng.choice([500, 429]) if api == "garmin" else 500
+        if api == "sun":
+            payload = {"results": "", "status": "UNKNOWN_ERROR"}
+        elif status == 429:
+            payload = {"message": "Too Many Requests"}
+        else:
+            payload = {"message": "Internal Server Error"}
+        return status, json.dumps(payload).encode("ascii")
+
+    def garmin_response(self, params):
+        try:
+            start = datetime.date.fromisoformat(params["startDate"])
+            end = datetime.date.fromisoformat(params["endDate"])
+        except (KeyError, ValueError):
+            return 400, json.dumps({"message": "Invalid date range"}).encode("ascii")
+        if (end - start).days + 1 > max_window_days:
+            self.count("garmin", 400, 0, "rejected")
+            return 400, json.dumps({"message": "Date range exceeds %d days" % max_window_days}).encode("ascii")
+
+        data = [self.nights[str(start + datetime.timedelta(days=i))]
+                for i in range((end - start).days + 1)
+                if str(start + datetime.timedelta(days=i)) in self.nights]
+        body = json.dumps(data).encode("ascii")
+        with self._lock:
+            compress = self._rng.random() < self.config["brotli_rate"]
+        if compress:
+            self.count("garmin", 200, 0, "brotli")
+            body = brotli.compress(body)
+        return 200, body
+
+    def sun_response(self, params):
+        try:
+            date = datetime.date.fromisoformat(params["date"])
+            lat, lon = float(params["lat"]), float(params["lng"])
+        except (KeyError, ValueError):
+            return 400, json.dumps({"results": "", "status": "INVALID_REQUEST"}).encode("ascii")
+
+        key = (date, lat, lon)
+        if key not in self._sun_times:
+            sun_df = solar.sun_times([date], lat, lon, "UTC")
+            # formatted=1 times of day, such as "7:27:02 AM"
+            self._sun_times[key] = [sun_df[col].iloc[0].strftime("%I:%M:%S %p").lstrip("0")
+                                    for col in ["Sunrise", "Sunset"]]
+        sunrise, sunset = self._sun_times[key]
+        payload = {"results": {"sunrise": sunrise, "sunset": sunset}, "status": "OK"}
+        return 200, json.dumps(payload).encode("ascii")
+
+
+def start_server(data, **config):
+    """
+    Start a MockServer of the Garmin json data on its own thread, on a free
+    port unless one is given.  Call shutdown() and server_close() to stop it.
+    """
+    server = MockServer(data, **config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def synthetic_nights(years, seed=0):
+    # the Garmin json of years of synthetic nights, starting like the production data
+    return synthetic_data.garmin_nights(synthetic_data.garmin_start - datetime.timedelta(days=1),
+                                        int(round(365.25*years)), seed)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8060
+    years = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    server = MockServer(synthetic_nights(years), port=port)
+    print("serving %g years of nights at %s%s and %s%s" % (years, server.url, garmin_path,
+                                                           server.url, sun_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
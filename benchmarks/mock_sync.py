@@ -0,0 +1,135 @@
+"""
+End to end run of the sync pipeline against the local mock services.
+
+A MockServer (see benchmarks/mock_services.py) serves a synthetic dataset,
+and update_garmin_sleep is pointed at it: its Garmin and sunrise-sunset.org
+URLs, and a temporary project dir holding only the Microsoft csv files, as
+in a first sync.  step0 to step4 are then run in order, like sync_jobs does,
+and the wall time of each stage is printed with the requests the mock
+services answered during it.
+
+step1 logs in to Garmin with a Selenium driven browser, which has no local
+stand-in, so it is replaced by a stub returning the request headers step2
+reads (a cookie, the session id and so on).
+
+Usage (from the project dir): python benchmarks/mock_sync.py [options], see --help
+"""
+# import base packages
+import argparse, datetime, os, shutil, sys, tempfile, time, warnings
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import update_garmin_sleep
+import mock_services
+
+# headers of the request step1 captures after logging in, which step2 copies
+stub_headers = {
+    "Cookie": "SESSIONID=mock; GARMIN-SSO=1; $ses_id:1580000000000",
+    "Accept-Encoding": "gzip, deflate, br",
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) mock_sync",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Host": "connect.garmin.com",
+    "Upgrade-Insecure-Requests": "1"
+}
+
+
+def stub_step1():
+    # what step1 returns after a successful login, without a browser
+    request = SimpleNamespace(headers=stub_headers, response=SimpleNamespace(status_code=200))
+    return ["Logged in to the mock Garmin service", request]
+
+
+def configure(server, proj_path, args):
+    # point update_garmin_sleep at the mock services and a fresh project dir
+    update_garmin_sleep.proj_path = proj_path
+    update_garmin_sleep.sleep_url_json_req = server.url + mock_services.garmin_path
+    update_garmin_sleep.sun_url_json_req = server.url + mock_services.sun_path
+    update_garmin_sleep.sun_source = args.sun_source
+    update_garmin_sleep.download_workers = args.workers
+    update_garmin_sleep.download_rate_limit = args.rate_limit
+    update_garmin_sleep.download_retries = args.retries
+    update_garmin_sleep.download_backoff = args.backoff
+    # a new session, sized for the number of workers
+    update_garmin_sleep._session = None
+    update_garmin_sleep._next_request_time.clear()
+
+    dates = sorted(server.nights)
+    update_garmin_sleep.start_date = str(datetime.date.fromisoformat(dates[0]) - datetime.timedelta(days=1))
+    update_garmin_sleep.end_date = str(datetime.date.fromisoformat(dates[-1]) - datetime.timedelta(days=1))
+
+    os.makedirs(proj_path + "data")
+    for fn in update_garmin_sleep.ms_activity_fns:
+        shutil.copyfile(fn, proj_path + fn)
+
+
+def run_stages(server):
+    # run step0 to step4, returning (stage, seconds, mock stats of the stage) tuples
+    stages = []
+
+    def timed(name, fn, *fn_args):
+        server.reset_stats()
+        start = time.perf_counter()
+        result = fn(*fn_args)
+        stages.append((name, time.perf_counter() - start, server.stats))
+        print("%s: %s" % (name, result[0]))
+        return result
+
+    _, nights_archive, new_req_dates_ls = timed("step0", update_garmin_sleep.step0)
+    _, request = timed("step1 (stub)", stub_step1)
+    _, data_json = timed("step2", update_garmin_sleep.step2, request, new_req_dates_ls)
+    complete_dates_ls = timed("step3", update_garmin_sleep.step3, nights_archive, data_json,
+                              new_req_dates_ls)[3]
+    timed("step4", update_garmin_sleep.step4, complete_dates_ls)
+    return stages
+
+
+def print_report(stages):
+    cols = ["requests", "errors", "rejected", "brotli", "bytes"]
+    print("\n%-14s %10s" % ("stage", "wall s") + "".join(["%10s" % col for col in cols]))
+    for name, secs, stats in stages:
+        totals = {col: sum(api_stats[col] for api_stats in stats.values()) for col in cols}
+        print("%-14s %10.2f" % (name, secs) + "".join(["%10d" % totals[col] for col in cols]))
+    print("%-14s %10.2f" % ("total", sum(secs for _, secs, _ in stages)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the sync steps against local mock services.")
+    parser.add_argument("--years", type=float, default=1, help="years of nights served by the mock Garmin API")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic nights and the mock services")
+    parser.add_argument("--latency", type=float, default=mock_services.default_config["latency"],
+                        help="seconds each response is delayed by")
+    parser.add_argument("--error-rate", type=float, default=0.02,
+                        help="share of requests answered with a server error")
+    parser.add_argument("--brotli-rate", type=float, default=mock_services.default_config["brotli_rate"],
+                        help="share of Garmin responses which are brotli compressed")
+    parser.add_argument("--sun-source", default="api", choices=["api", "noaa"],
+                        help="where step4 gets sunrise/sunset times from")
+    parser.add_argument("--workers", type=int, default=update_garmin_sleep.download_workers,
+                        help="Garmin windows downloaded at once")
+    parser.add_argument("--rate-limit", type=float, default=50.,
+                        help="requests started per second (the production setting is %g)"
+                             % update_garmin_sleep.download_rate_limit)
+    parser.add_argument("--retries", type=int, default=update_garmin_sleep.download_retries,
+                        help="retries of a failed request")
+    parser.add_argument("--backoff", type=float, default=0.1, help="seconds before the first retry")
+    parser.add_argument("--keep", action="store_true", help="keep the project dir written by the sync")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", FutureWarning)
+    # NaT durations of the nights without Garmin data
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    server = mock_services.start_server(
+        mock_services.synthetic_nights(args.years, args.seed), latency=args.latency,
+        error_rate=args.error_rate, brotli_rate=args.brotli_rate, seed=args.seed)
+    proj_path = os.path.join(tempfile.mkdtemp(prefix="mock_sync_"), "")
+    try:
+        configure(server, proj_path, args)
+        print("syncing %d nights from %s into %s" % (len(server.nights), server.url, proj_path))
+        print_report(run_stages(server))
+    finally:
+        server.shutdown()
+        server.server_close()
+        if args.keep:
+            print("project dir kept at %s" % proj_path)
+        else:
+            shutil.rmtree(proj_path, ignore_errors=True)
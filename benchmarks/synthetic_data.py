@@ -0,0 +1,135 @@
+"""
+Generator of a synthetic project data dir spanning many years.
+
+The repo's data covers about five years, which hides how the callbacks and
+sync steps scale.  This writes a data dir of any length: Garmin sleep json
+for years of nights from garmin_start on, with bed and wake times which vary
+by weekday, season and night, durations split into awake/light/deep sleep,
+DST-correct GMT timestamps and a few nights Garmin has no data for.
+
+Everything else is derived by the sync pipeline itself.  The nights are run
+through update_garmin_sleep.step3 (with the repo's Microsoft csv files, as
+in production) and step4, which write the Garmin archive, the sleep
+description and event frames, the precomputed fits, the sunrise/sunset
+archive and its seasonal aggregate.  The last holdout_days nights are left
+out of the archive and written to data/new_garmin_sleep.json instead, so a
+benchmark can sync them as new nights.
+
+Usage (from the project dir): python benchmarks/synthetic_data.py <out_dir> [years] [seed]
+"""
+# import base packages
+import datetime, json, os, shutil, sys
+
+# import installed packages
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import date_archive, update_garmin_sleep
+
+garmin_start = datetime.date(2017, 3, 1) # first synthetic Garmin night, like update_garmin_sleep.start_date
+holdout_days = 7 # most recent nights which are left out of the archive
+missing_rate = 0.03 # share of nights without any Garmin sleep data
+info_fn = "data/synthetic.json" # describes how a data dir was generated
+
+
+def garmin_nights(first_day, n_days, seed=0):
+    """
+    Return the Garmin json (a list of dicts, one per calendar date) of n_days
+    nights, the first of which follows first_day.
+    """
+    rng = np.random.RandomState(seed)
+    prev_days = pd.date_range(first_day, periods=n_days, freq="D")
+    weekday = prev_days.weekday.values
+    off_night = (weekday == 4) | (weekday == 5) # Friday and Saturday nights
+    summer = np.cos(2*np.pi*(prev_days.dayofyear.values - 172)/365.25)
+
+    # local hours after the midnight ending each night, slowly drifting over the years
+    drift = 0.3*np.sin(2*np.pi*np.arange(n_days)/(4*365.25))
+    bed_hours = 0.6 + 0.9*off_night + 0.3*summer + drift + rng.normal(0, 0.6, n_days)
+    sleep_hours = np.clip(7.3 + 0.7*off_night - 0.2*summer + rng.normal(0, 0.8, n_days), 3, 12)
+    awake_secs = np.round(rng.uniform(0, 0.06, n_days)*sleep_hours*3600)
+    deep_secs = np.round(rng.uniform(0.15, 0.35, n_days)*sleep_hours*3600)
+    sleep_secs = np.round(sleep_hours*3600/60)*60
+    light_secs = sleep_secs - deep_secs
+
+    bed_local = prev_days + pd.to_timedelta(24 + bed_hours, unit="h")
+    bed_gmt = bed_local.tz_localize(update_garmin_sleep.local_tz, ambiguous="NaT",
+                                    nonexistent="shift_forward").tz_convert("UTC")
+    bed_ms = (bed_gmt.asi8//(60*10**9))*60000 # whole minutes in ms
+    wake_ms = bed_ms + ((sleep_secs + awake_secs)*1000).astype(np.int64)
+    offset_ms = ((bed_local - bed_gmt.tz_localize(None)).values.astype("timedelta64[ms]")).astype(np.int64)
+    has_data = (rng.rand(n_days) >= missing_rate) & ~pd.isnull(bed_gmt)
+
+    data = []
+    for i, prev_day in enumerate(prev_days):
+        cal_date = (prev_day + datetime.timedelta(days=1)).date().isoformat()
+        if not has_data[i]:
+            data.append({"id": None, "calendarDate": cal_date, "sleepTimeSeconds": None,
+                         "napTimeSeconds": None, "sleepWindowConfirmed": False,
+                         "sleepStartTimestampGMT": None, "sleepEndTimestampGMT": None,
+                         "sleepStartTimestampLocal": None, "sleepEndTimestampLocal": None,
+                         "deepSleepSeconds": None, "lightSleepSeconds": None,
+                         "remSleepSeconds": None, "awakeSleepSeconds": None})
+            continue
+        data.append({
+            "id": int(bed_ms[i]),
+            "calendarDate": cal_date,
+            "sleepTimeSeconds": int(sleep_secs[i]),
+            "napTimeSeconds": 0,
+            "sleepWindowConfirmed": True,
+            "sleepStartTimestampGMT": int(bed_ms[i]),
+            "sleepEndTimestampGMT": int(wake_ms[i]),
+            "sleepStartTimestampLocal": int(bed_ms[i] + offset_ms[i]),
+            "sleepEndTimestampLocal": int(wake_ms[i] + offset_ms[i]),
+            "deepSleepSeconds": int(deep_secs[i]),
+            "lightSleepSeconds": int(light_secs[i]),
+            "remSleepSeconds": 0,
+            "awakeSleepSeconds": int(awake_secs[i])
+        })
+    return data
+
+
+def nights_dates(data):
+    # the Prev_Day of each night of the Garmin json data
+    return [datetime.date.fromisoformat(night["calendarDate"]) - datetime.timedelta(days=1)
+            for night in data]
+
+
+def write_data_dir(out_dir, years, seed=0, src_dir=""):
+    """
+    Write a synthetic data dir of the given number of years into out_dir,
+    which is then used as proj_path.  The Microsoft csv files are copied from
+    the project dir src_dir.
+    """
+    proj_path = os.path.join(out_dir, "")
+    shutil.rmtree(proj_path + "data", ignore_errors=True)
+    os.makedirs(proj_path + "data")
+    for fn in update_garmin_sleep.ms_activity_fns:
+        shutil.copyfile(src_dir + fn, proj_path + fn)
+
+    data = garmin_nights(garmin_start - datetime.timedelta(days=1), int(round(365.25*years)), seed)
+    archived_data, new_data = data[:-holdout_days], data[-holdout_days:]
+    with open(proj_path + update_garmin_sleep.garmin_results_json_fn, "w") as fp:
+        json.dump(new_data, fp)
+
+    # build every artifact with the sync pipeline, as if the archived nights were just downloaded
+    update_garmin_sleep.proj_path = proj_path
+    nights_archive = date_archive.DateArchive(update_garmin_sleep.garmin_results_pkl_fn,
+                                              "Prev_Day", proj_path)
+    complete_dates_ls = update_garmin_sleep.step3(nights_archive, archived_data,
+                                                  nights_dates(archived_data))[3]
+    update_garmin_sleep.step4(complete_dates_ls)
+
+    info = {"years": years, "seed": seed, "n_nights": len(data),
+            "first_day": str(nights_dates(data)[0]), "last_day": str(nights_dates(data)[-1])}
+    with open(proj_path + info_fn, "w") as fp:
+        json.dump(info, fp)
+    return info
+
+
+if __name__ == "__main__":
+    out_dir = sys.argv[1]
+    years = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    print(write_data_dir(out_dir, years, seed))
@@ -0,0 +1,91 @@
+"""
+Memory of gunicorn-like worker processes holding the dashboard datasets.
+
+Starts n_workers fresh processes (spawned, like workers of a server without
+preload), each of which loads the shared frames, the filter index and the
+precomputed overview fits, and then reports its memory from
+/proc/self/smaps_rollup while all of them are alive.  This is run with
+shared_segment enabled and disabled.  With segments, the private memory of
+each worker should stay flat as the data grows, and the total proportional
+set size (Pss, shared pages split between the processes mapping them)
+should grow by little more than the interpreter itself per added worker.
+
+Linux only.  Usage (from the project dir):
+python benchmarks/worker_memory.py [proj_path] [n_workers ...]
+"""
+# import base packages
+import multiprocessing, os, sys, warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+default_workers = [1, 2, 4, 8] # numbers of workers run when none are given
+
+
+def smaps_rollup():
+    # memory of the calling process, in MB
+    mem = {}
+    with open("/proc/self/smaps_rollup", "r") as fp:
+        for line in fp:
+            parts = line.split()
+            if (len(parts) == 3) and (parts[2] == "kB"):
+                mem[parts[0].rstrip(":")] = int(parts[1])/1024.
+    return {"rss": mem["Rss"], "pss": mem["Pss"],
+            "private": mem["Private_Clean"] + mem["Private_Dirty"]}
+
+
+def worker(proj_path, shared, baseline, barrier, results):
+    warnings.simplefilter("ignore")
+    import data_cache, fit_cache, shared_segment, sleep_filters
+    shared_segment.enabled = shared
+    if baseline:
+        # the interpreter and libraries alone
+        barrier.wait()
+        results.put(smaps_rollup())
+        barrier.wait()
+        return
+
+    sleep_descr_df, sleep_event_df, filter_index = data_cache.get_filter_index(proj_path)
+    data_cache.get_datasets(proj_path)
+    data_cache.get_sun_agg(proj_path)
+    full_range = [0, len(sleep_descr_df) - 1]
+    fit_key = sleep_filters.filter_key(full_range, sleep_filters.dow_vals, sleep_filters.tod_vals,
+                                       len(sleep_descr_df))
+    fit_cache.get_overview_fits(None, None, fit_key, proj_path)
+
+    # touch every fit, as serving all toggle combinations would
+    for fits in fit_cache._precomputed[proj_path]["fits"].values():
+        if fits is not None:
+            for values in fits.values():
+                values.sum()
+    barrier.wait()
+    results.put(smaps_rollup())
+    barrier.wait()
+
+
+def run(proj_path, n_workers, shared, baseline=False):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(n_workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(proj_path, shared, baseline, barrier, results))
+             for _ in range(n_workers)]
+    for proc in procs:
+        proc.start()
+    mems = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return {key: sum(mem[key] for mem in mems) for key in mems[0]}
+
+
+if __name__ == "__main__":
+    proj_path = sys.argv[1] if len(sys.argv) > 1 else ""
+    n_workers_ls = [int(arg) for arg in sys.argv[2:]] or default_workers
+
+    print("%-8s %-10s %14s %14s %18s" % ("workers", "segments", "total Pss MB", "total Rss MB",
+                                         "private/worker MB"))
+    for n_workers in n_workers_ls:
+        base = run(proj_path, n_workers, False, baseline=True)
+        for shared in [False, True]:
+            mem = run(proj_path, n_workers, shared)
+            print("%-8d %-10s %14.1f %14.1f %18.1f" % (
+                n_workers, "on" if shared else "off", mem["pss"], mem["rss"],
+                (mem["private"] - base["private"])/n_workers))
@@ -0,0 +1,215 @@
+"""
+Columnar, memory-mappable storage for the derived data artifacts.
+
+Every artifact which is archived as a pickle file (e.g. data/sun_df.pkl) can
+also be written as one raw NumPy file per column plus a small JSON manifest
+describing how to rebuild each column, stored under data/columns/<artifact>/.
+
+Reading an artifact back memory-maps the column files rather than
+deserializing them, so numeric, datetime, timedelta and boolean columns are
+views onto the operating system's page cache.  Every gunicorn worker which
+opens the same artifact shares those pages instead of holding a private copy,
+and a cold read costs little more than parsing the manifest.
+
+pandas normally consolidates the columns of a dtype into one 2D block, which
+copies them out of the mapped files into private memory (pandas 0.25, which
+the app runs on, does so when a frame is built from a dict, and later on
+operations such as take()).  So read_columns() builds its frames with one
+block per column and marks them as consolidated already, which keeps the
+mapped columns shared.  This relies on the BlockManager internals of pandas
+0.25 to 1.x, and benchmarks/memory_report.py checks that it still holds.
+
+The pickle files remain the archive of record.  The manifest remembers the
+size and modification time of the pickle it was written alongside, and
+load() falls back to the pickle whenever the two disagree.
+"""
+# import base packages
+import json, os, uuid
+
+# import installed packages
+import numpy as np
+import pandas as pd
+from pandas.core.internals import BlockManager, make_block
+
+columns_dir = "data/columns/" # dir holding one sub-dir of column files per artifact
+manifest_fn = "manifest.json" # name of the schema manifest within each artifact dir
+
+
+def artifact_dir(pkl_fn, proj_path=""):
+    # "data/sun_df.pkl" -> "data/columns/sun_df/"
+    name = os.path.splitext(os.path.basename(pkl_fn))[0]
+    return proj_path + columns_dir + name + "/"
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _encode_column(series):
+    # returns the manifest entry for a column and the array to be written to disk
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        entry = {"kind": "category", "categories": dtype.categories.to_list(),
+                 "ordered": bool(dtype.ordered)}
+        return entry, np.asarray(series.cat.codes)
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        # tz-aware datetimes are stored as UTC nanoseconds
+        values = series.dt.tz_convert("UTC").dt.tz_localize(None).values
+        return {"kind": "datetimetz", "tz": str(dtype.tz)}, values.view("i8")
+    if dtype.kind in "biufmM":
+        return {"kind": "numpy", "dtype": dtype.str}, series.values.view(dtype.str)
+
+    # mixed object columns are the exception in these artifacts, so they are
+    # stored as pickled object arrays which can't be memory-mapped
+    return {"kind": "object"}, np.asarray(series.values, dtype=object)
+
+
+def _decode_column(entry, values):
+    if entry["kind"] == "category":
+        dtype = pd.CategoricalDtype(entry["categories"], ordered=entry["ordered"])
+        return pd.Categorical.from_codes(values, dtype=dtype)
+    if entry["kind"] == "datetimetz":
+        tz_dtype = pd.DatetimeTZDtype(tz=entry["tz"])
+        return pd.arrays.DatetimeArray(values.view("M8[ns]"), dtype=tz_dtype, copy=False)
+    if entry["kind"] == "numpy":
+        return values.view(np.dtype(entry["dtype"]))
+    return values
+
+
+def write_columns(df, out_dir, token):
+    """
+    Write each column (and any index) of df as a NumPy file in out_dir, whose
+    names carry token, and return the manifest describing them.
+    """
+    columns = []
+    if not isinstance(df.index, pd.RangeIndex):
+        index_series = pd.Series(df.index, index=df.index)
+        columns.append(("__index__", index_series))
+    columns += [(col, df[col]) for col in df.columns]
+
+    manifest = {
+        "n_rows": len(df),
+        "index": None if isinstance(df.index, pd.RangeIndex) else "__index__",
+        "columns": []
+    }
+    for i, (col, series) in enumerate(columns):
+        entry, values = _encode_column(series)
+        entry["name"] = col
+        entry["file"] = "%02d-%s.npy" % (i, token)
+        np.save(out_dir + entry["file"], np.ascontiguousarray(values),
+                allow_pickle=(entry["kind"] == "object"))
+        manifest["columns"].append(entry)
+    return manifest
+
+
+def read_columns(manifest, in_dir, mmap=True):
+    # rebuild the frame of a manifest written by write_columns()
+    data = {}
+    for entry in manifest["columns"]:
+        is_object = entry["kind"] == "object"
+        values = np.load(in_dir + entry["file"], allow_pickle=is_object,
+                         mmap_mode=None if (is_object | (not mmap)) else "r")
+        data[entry["name"]] = _decode_column(entry, values)
+
+    if manifest["index"] is None:
+        index = pd.RangeIndex(manifest["n_rows"])
+    else:
+        index = pd.Index(data.pop(manifest["index"]))
+
+    names = [entry["name"] for entry in manifest["columns"] if entry["name"] != manifest["index"]]
+    return _unconsolidated_frame(data, index, names)
+
+
+def _unconsolidated_frame(data, index, names):
+    # a frame of one block per column, which pandas won't consolidate, so the
+    # blocks stay views of the (mapped) arrays in data.  Blocks of object
+    # arrays are also kept as they are, rather than inferring a new dtype
+    blocks = []
+    for i, name in enumerate(names):
+        values = data[name]
+        if isinstance(values, np.ndarray):
+            values = values.reshape(1, -1)
+        blocks.append(make_block(values, placement=[i]))
+    manager = BlockManager(blocks, [pd.Index(names), index])
+    manager._known_consolidated = True
+    manager._is_consolidated = True
+    return pd.DataFrame(manager)
+
+
+def is_mapped(values):
+    # whether the array values is a view of a memory-mapped file
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = getattr(values, "base", None)
+    return False
+
+
+def column_values(series):
+    # the array holding a column's data in a frame of read_columns(), for is_mapped()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.values
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.array.asi8
+    return series.values
+
+
+def write_frame(df, pkl_fn, proj_path=""):
+    """
+    Write df as column files next to the pickle archive pkl_fn, which must
+    already have been written.
+    """
+    out_dir = artifact_dir(pkl_fn, proj_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # column files get a per-write token so a new manifest never points at
+    # files which readers of the previous manifest still have mapped
+    token = uuid.uuid4().hex[:12]
+    manifest = {
+        "source": os.path.basename(pkl_fn),
+        "source_stamp": source_stamp(proj_path + pkl_fn)
+    }
+    manifest.update(write_columns(df, out_dir, token))
+
+    # swap in the new manifest atomically, then clean up unreferenced files
+    tmp_fn = out_dir + manifest_fn + ".tmp%d" % os.getpid()
+    with open(tmp_fn, "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp_fn, out_dir + manifest_fn)
+
+    keep_ls = [entry["file"] for entry in manifest["columns"]] + [manifest_fn]
+    for fn in os.listdir(out_dir):
+        if (fn not in keep_ls) & fn.endswith(".npy"):
+            try:
+                os.remove(out_dir + fn)
+            except OSError:
+                # Windows refuses to delete files which are still mapped
+                pass
+
+
+def read_frame(pkl_fn, proj_path="", mmap=True):
+    # returns None if no up-to-date column files exist for this artifact
+    in_dir = artifact_dir(pkl_fn, proj_path)
+    try:
+        with open(in_dir + manifest_fn, "r") as fp:
+            manifest = json.load(fp)
+        if manifest["source_stamp"] != source_stamp(proj_path + pkl_fn):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return read_columns(manifest, in_dir, mmap)
+
+
+def save(df, pkl_fn, proj_path=""):
+    # write the pickle archive, then its memory-mappable column files
+    df.to_pickle(proj_path + pkl_fn)
+    write_frame(df, pkl_fn, proj_path)
+
+
+def load(pkl_fn, proj_path=""):
+    # prefer the memory-mapped column files, fall back to the pickle archive
+    df = read_frame(pkl_fn, proj_path)
+    if df is None:
+        df = pd.read_pickle(proj_path + pkl_fn)
+    return df
@@ -0,0 +1,147 @@
+"""
+Process-wide cache of the dashboard datasets.
+
+The graph callbacks used to read the sleep description, sleep event and
+sunrise/sunset pickle files from disk on every click.  Instead, the frames
+are loaded once per process and shared by all callbacks until the data
+actually changes.
+
+Changes are tracked with a data generation number which is stored in a small
+file next to the data artifacts.  The sync steps which write new artifacts
+(update_garmin_sleep.step3 and step4) bump the generation, and every worker
+process reloads its frames the next time it sees a different generation.
+
+Frames are opened through column_store, so when memory-mapped column files
+exist the numeric columns are read-only views shared with the other workers.
+The frames handed out by get_datasets() are shared between callbacks, so they
+must be treated as read-only.  Callers which need to add columns should work
+on a copy.  The sunrise/sunset frame is a date archive, so its deltas are
+applied on load (see date_archive), and sleep data written in an older layout
+is converted to the compact schema (see sleep_schema).  The annual tab's
+seasonal sunrise/sunset aggregate is loaded along with them (see seasonal).
+
+The loaded frames, the filter index and the seasonal aggregate of each data
+generation are published once as a shared_segment, which every worker
+attaches to, so they aren't copied into each worker's memory either.
+
+Each user's data lives in a project dir of its own (see user_store), so the
+frames of up to project_slots project dirs are kept, the ones loaded longest
+ago being dropped first.
+"""
+# import base packages
+import hashlib, json, os, threading
+from collections import OrderedDict
+
+# import local modules
+import column_store, date_archive, metrics, seasonal, shared_segment, sleep_filters, sleep_schema
+
+generation_fn = "data/data_generation.json" # name of file holding the current data generation number
+descr_fn = "data/all_sleep_descr_df.pkl" # sleep session description data
+event_fn = "data/all_sleep_event_df.pkl" # sleep event data
+sun_fn = "data/sun_df.pkl" # sunrise/sunset data
+
+project_slots = 8 # max number of project dirs whose frames are kept per process
+
+_lock = threading.Lock()
+_cache = OrderedDict() # proj_path: (key, frames, filter index, sun aggregate), replaced as one tuple
+
+
+def read_generation(proj_path=""):
+    # a missing or unreadable generation file means no sync has bumped it yet
+    try:
+        with open(proj_path + generation_fn, "r") as fp:
+            return int(json.load(fp)["generation"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+
+
+def bump_generation(proj_path=""):
+    # write to a temporary file and then swap it in, so that other processes
+    # never read a partially written generation file
+    generation = read_generation(proj_path) + 1
+    tmp_fn = proj_path + generation_fn + ".tmp%d" % os.getpid()
+    with open(tmp_fn, "w") as fp:
+        json.dump({"generation": generation}, fp)
+    os.replace(tmp_fn, proj_path + generation_fn)
+    return generation
+
+
+def has_data(proj_path=""):
+    # a new user's project dir has no sleep data until their first sync
+    return os.path.isfile(proj_path + descr_fn)
+
+
+def _read_frames(proj_path):
+    # the frames of the current data, with the filter index and sun aggregate
+    # built from them, in the form of a shared_segment
+    sleep_descr_df = sleep_schema.compact_descr(column_store.load(descr_fn, proj_path))
+    sleep_event_df = sleep_schema.compact_events(sleep_descr_df, column_store.load(event_fn, proj_path))
+    sun_df = date_archive.load_frame(sun_fn, "Date", proj_path)
+    filter_index = sleep_filters.FilterIndex(sleep_descr_df, sleep_event_df)
+    frames = {"descr": sleep_descr_df, "event": sleep_event_df, "sun": sun_df,
+              "sun_agg": seasonal.load_sun_agg(sun_df, proj_path)}
+    arrays = {"flags": filter_index.flags, "event_pos": filter_index.event_pos}
+    return frames, arrays, None
+
+
+def _segment_version(proj_path, generation):
+    # the generation alone would hide artifacts written without bumping it,
+    # since segments outlive the worker processes
+    paths = [descr_fn, event_fn, sun_fn, sun_fn + date_archive.delta_suffix, seasonal.sun_agg_fn]
+    stamps = [column_store.source_stamp(proj_path + path) if os.path.exists(proj_path + path) else None
+              for path in paths]
+    return "g%d-%s" % (generation, hashlib.sha1(json.dumps(stamps).encode("utf-8")).hexdigest()[:12])
+
+
+def _load(proj_path):
+    # returns the frames with the filter index and sun aggregate built from them
+    generation = read_generation(proj_path)
+    key = (proj_path, generation)
+    loaded = _cache.get(proj_path)
+    if (loaded is not None) and (loaded[0] == key):
+        metrics.cache_result("data", "hit")
+        return loaded[1:]
+
+    with _lock:
+        # another thread may have reloaded while this one waited for the lock
+        loaded = _cache.get(proj_path)
+        if (loaded is not None) and (loaded[0] == key):
+            metrics.cache_result("data", "hit")
+        else:
+            metrics.cache_result("data", "miss")
+            # every worker attaches to the one copy of a generation (see shared_segment)
+            segment = shared_segment.attach_or_publish(
+                "frames", proj_path, _segment_version(proj_path, generation),
+                lambda: _read_frames(proj_path))
+            frames, arrays = segment["frames"], segment["arrays"]
+            loaded = (key, (frames["descr"], frames["event"], frames["sun"]),
+                      sleep_filters.FilterIndex.from_arrays(arrays["flags"], arrays["event_pos"]),
+                      frames["sun_agg"])
+            _cache[proj_path] = loaded
+        _cache.move_to_end(proj_path)
+        while len(_cache) > project_slots:
+            _cache.popitem(last=False)
+        return loaded[1:]
+
+
+def get_datasets(proj_path=""):
+    """
+    Return the shared (sleep_descr_df, sleep_event_df, sun_df) frames,
+    reloading them from disk only when the data generation has changed.
+    """
+    return _load(proj_path)[0]
+
+
+def get_filter_index(proj_path=""):
+    """
+    Return the shared (sleep_descr_df, sleep_event_df, filter_index) of the
+    current data, where filter_index is the sleep_filters.FilterIndex built
+    from those two frames.
+    """
+    (sleep_descr_df, sleep_event_df, _), filter_index, _ = _load(proj_path)
+    return sleep_descr_df, sleep_event_df, filter_index
+
+
+def get_sun_agg(proj_path=""):
+    # the shared seasonal sunrise/sunset aggregate of the current data
+    return _load(proj_path)[2]
@@ -0,0 +1,177 @@
+"""
+Date-keyed archives of the Garmin nights and the sunrise/sunset times.
+
+data/garmin_sleep_df.pkl holds one row per night (keyed by Prev_Day) and
+data/sun_df.pkl one row per date (keyed by Date).  Each sync used to find the
+dates it still needed by comparing every requested date against the whole
+archive, and then rewrote the whole archive to add a few days.
+
+A DateArchive keeps its frame sorted by date next to a sorted array of date
+keys, so membership tests are binary searches and a batch of new rows is
+merged in a single pass.  Rows are upserted: a new row replaces any archived
+row of the same date.
+
+Saving is append-only.  The rows upserted since the archive was opened are
+written as a small delta pickle under data/<artifact>.delta/, and readers
+apply the deltas on top of the base archive (see load_frame()).  Once
+max_deltas files have piled up, the next save compacts them into a rewritten
+base archive.  Applying a delta is idempotent, so a reader which sees a
+freshly compacted base alongside deltas which are about to be removed still
+gets the right rows.
+"""
+# import base packages
+import os, uuid
+from os.path import isfile
+
+# import installed packages
+import numpy as np
+import pandas as pd
+
+# import local modules
+import column_store
+
+delta_suffix = ".delta/" # the dir of an archive's deltas is its pickle file name plus this suffix
+max_deltas = 8 # number of delta files which triggers a compaction on the next save
+
+
+def date_keys(dates):
+    # datetime64[ns] midnight of each date, from dates, datetimes or strings
+    return pd.to_datetime(pd.Series(list(dates), dtype=object)).dt.normalize().values
+
+
+def _delta_dir(pkl_fn, proj_path=""):
+    return proj_path + pkl_fn + delta_suffix
+
+
+def _delta_fns(pkl_fn, proj_path=""):
+    # delta files sorted in the order they were written
+    try:
+        fns = os.listdir(_delta_dir(pkl_fn, proj_path))
+    except OSError:
+        return []
+    return sorted([fn for fn in fns if fn.endswith(".pkl")])
+
+
+def _sort_frame(df, keys):
+    # stable sort by date key, so rows keep their relative order
+    if (len(keys) < 2) or (np.diff(keys) >= np.timedelta64(0)).all():
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            df = df.reset_index(drop=True)
+        return df, keys
+    order = np.argsort(keys, kind="mergesort")
+    return df.iloc[order].reset_index(drop=True), keys[order]
+
+
+def _upsert(df, keys, new_df, date_col):
+    # merge new_df into df, which is sorted by its date keys
+    new_df = new_df.drop_duplicates(date_col, keep="last")
+    new_df, new_keys = _sort_frame(new_df, date_keys(new_df[date_col]))
+    if len(new_df) == 0:
+        return df, keys
+    if (len(df) == 0) or (new_keys[0] > keys[-1]):
+        # the common case of adding the most recent dates
+        merged_df = pd.concat([df, new_df], ignore_index=True, sort=False)
+        return merged_df, np.concatenate([keys, new_keys])
+
+    # drop the archived rows being replaced, then merge both sorted runs
+    pos = np.searchsorted(new_keys, keys)
+    replaced = new_keys[np.minimum(pos, len(new_keys) - 1)] == keys
+    merged_df = pd.concat([df[~replaced], new_df], ignore_index=True, sort=False)
+    return _sort_frame(merged_df, np.concatenate([keys[~replaced], new_keys]))
+
+
+def load_frame(pkl_fn, date_col, proj_path="", columns=None):
+    """
+    Return the archive's frame sorted by date_col, with its deltas applied.
+    An archive which hasn't been written yet is an empty frame of columns.
+    """
+    if isfile(proj_path + pkl_fn):
+        df = column_store.load(pkl_fn, proj_path)
+    else:
+        df = pd.DataFrame(columns=columns)
+    df, keys = _sort_frame(df, date_keys(df[date_col]) if len(df) > 0 else
+                           np.array([], dtype="datetime64[ns]"))
+    for fn in _delta_fns(pkl_fn, proj_path):
+        try:
+            delta_df = pd.read_pickle(_delta_dir(pkl_fn, proj_path) + fn)
+        except OSError:
+            # compacted away since it was listed, so the base already has its rows
+            continue
+        df, keys = _upsert(df, keys, delta_df, date_col)
+    return df
+
+
+def save_frame(df, pkl_fn, proj_path=""):
+    # rewrite the base archive and drop the deltas it makes redundant
+    column_store.save(df, pkl_fn, proj_path)
+    for fn in _delta_fns(pkl_fn, proj_path):
+        try:
+            os.remove(_delta_dir(pkl_fn, proj_path) + fn)
+        except OSError:
+            pass
+
+
+class DateArchive:
+    """
+    An archive frame kept sorted by its date column, see the module docstring.
+    The frame is available as the df attribute and must be treated as read-only.
+    """
+
+    def __init__(self, pkl_fn, date_col, proj_path="", columns=None):
+        self.pkl_fn = pkl_fn
+        self.date_col = date_col
+        self.proj_path = proj_path
+        self.df = load_frame(pkl_fn, date_col, proj_path, columns)
+        self.keys = date_keys(self.df[date_col]) if len(self.df) > 0 else \
+            np.array([], dtype="datetime64[ns]")
+        self._unsaved = [] # frames upserted since the last save
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, date):
+        return bool(self.contains([date])[0])
+
+    def contains(self, dates):
+        # boolean array of whether each date is archived
+        dates_keys = date_keys(dates)
+        if len(self.keys) == 0:
+            return np.zeros(len(dates_keys), dtype=bool)
+        pos = np.searchsorted(self.keys, dates_keys)
+        return self.keys[np.minimum(pos, len(self.keys) - 1)] == dates_keys
+
+    def missing(self, dates):
+        # the dates which aren't archived, in their given order
+        found = self.contains(dates)
+        return [date for date, is_found in zip(dates, found) if not is_found]
+
+    def last_date(self):
+        return pd.Timestamp(self.keys[-1]) if len(self.keys) > 0 else None
+
+    def upsert(self, new_df):
+        # add the rows of new_df, replacing archived rows of the same date
+        if len(new_df) == 0:
+            return
+        self.df, self.keys = _upsert(self.df, self.keys, new_df, self.date_col)
+        self._unsaved.append(new_df)
+
+    def save(self):
+        # append the unsaved rows as a delta, or compact once enough deltas exist
+        if len(self._unsaved) == 0:
+            return
+        if (not isfile(self.proj_path + self.pkl_fn)) or \
+                (len(_delta_fns(self.pkl_fn, self.proj_path)) >= max_deltas):
+            save_frame(self.df, self.pkl_fn, self.proj_path)
+        else:
+            delta_df = pd.concat(self._unsaved, ignore_index=True, sort=False)
+            delta_dir = _delta_dir(self.pkl_fn, self.proj_path)
+            os.makedirs(delta_dir, exist_ok=True)
+
+            # names sort in write order, and the file is only visible once complete
+            delta_fns = _delta_fns(self.pkl_fn, self.proj_path)
+            seq = int(delta_fns[-1].split("-")[0]) + 1 if len(delta_fns) > 0 else 0
+            fn = "%06d-%s.pkl" % (seq, uuid.uuid4().hex[:8])
+            tmp_fn = delta_dir + fn + ".tmp%d" % os.getpid()
+            delta_df.to_pickle(tmp_fn)
+            os.replace(tmp_fn, delta_dir + fn)
+        self._unsaved = []
@@ -0,0 +1,139 @@
+"""
+Two-tier cache of the figures built by the graph callbacks.
+
+A figure only depends on the callback which built it, that callback's
+(normalized) inputs, the data generation (see data_cache) and the smoothing
+engine which fitted its lines (see smoother), so all four are hashed into
+the cache key.
+
+The first tier is an in-process LRU of figure dicts, keyed by project dir and
+cache key since it's shared by all users (see user_store).  The second tier
+is a directory of JSON files in each project dir, shared by every gunicorn
+worker, so a figure built by one worker is served by the others without
+rebuilding it.  The shared tier is bounded by size: whenever it grows past
+disk_budget_bytes, the least recently used files are deleted until it's
+back to disk_low_water of the budget, so the next few writes fit.  Rather than
+scanning the directory on every write, each process keeps a running total of
+its size, from its last scan plus the files it wrote since, and only scans
+when that total passes the budget or after scan_interval writes, which
+catches up with the files written by the other workers.  Entries from
+older data generations are never requested again and simply age out.
+Figures are written and read with figure_encoding.  Lookups are counted per
+tier in metrics.
+"""
+# import base packages
+import hashlib, json, os, threading
+from collections import OrderedDict
+
+# import local modules
+import data_cache, figure_encoding, metrics, smoother
+
+cache_dir = "data/figure_cache/" # dir holding the figure files shared by all workers
+memory_size = 64 # max number of figures kept per process
+disk_budget_bytes = 200*1024*1024 # max total size of the shared figure files
+disk_low_water = 0.8 # share of disk_budget_bytes the shared tier is evicted down to
+scan_interval = 100 # max number of writes of a process between scans of the shared tier
+
+_lock = threading.Lock()
+_lru = OrderedDict()
+_disk_bytes = {} # proj_path: [estimated size of the shared tier, writes since the last scan]
+
+
+def figure_key(name, inputs, generation):
+    # inputs must be JSON serializable, e.g. lists of filter values, and
+    # figures of either serialization mode or smoothing engine are kept apart
+    raw = json.dumps([name, inputs, generation, figure_encoding.compact, smoother.engine],
+                     sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _read_disk(path):
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            fig_json = fp.read()
+        os.utime(path) # mark as recently used for eviction
+        return fig_json
+    except OSError:
+        return None
+
+
+def _write_disk(path, fig_json, proj_path):
+    # write to a temporary file and then swap it in, so readers never see a partial file
+    os.makedirs(proj_path + cache_dir, exist_ok=True)
+    tmp_fn = path + ".tmp%d" % os.getpid()
+    with open(tmp_fn, "w", encoding="utf-8") as fp:
+        fp.write(fig_json)
+    size = os.path.getsize(tmp_fn)
+    os.replace(tmp_fn, path)
+    with _lock:
+        estimate = _disk_bytes.setdefault(proj_path, [None, 0])
+        if estimate[0] is not None:
+            estimate[0] += size
+        estimate[1] += 1
+        scan = (estimate[0] is None) or (estimate[0] > disk_budget_bytes) or \
+            (estimate[1] >= scan_interval)
+        if scan:
+            estimate[1] = 0
+    if scan:
+        total_bytes = _evict_disk(proj_path)
+        with _lock:
+            _disk_bytes[proj_path][0] = total_bytes
+
+
+def _evict_disk(proj_path):
+    # delete the least recently used files past the budget, returning the size left
+    entries = []
+    with os.scandir(proj_path + cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum([size for _, size, _ in entries])
+    if total_bytes <= disk_budget_bytes:
+        return total_bytes
+    for _, size, path in sorted(entries):
+        if total_bytes <= disk_low_water*disk_budget_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # another worker may have evicted it already
+            pass
+        total_bytes -= size
+    return total_bytes
+
+
+def get_figure(name, inputs, build_fn, proj_path=""):
+    """
+    Return the figure (as a dict) which build_fn(*inputs) builds for the
+    current data, building it only if neither cache tier has it.
+    """
+    key = figure_key(name, inputs, data_cache.read_generation(proj_path))
+    with _lock:
+        if (proj_path, key) in _lru:
+            _lru.move_to_end((proj_path, key))
+            metrics.cache_result("figure", "memory_hit")
+            return _lru[(proj_path, key)]
+
+    # the stage figure_cache_io times reading, encoding and writing the
+    # shared tier; Dash encodes the response itself, outside the callback
+    path = proj_path + cache_dir + key + ".json"
+    with metrics.stage("figure_cache_io"):
+        fig_json = _read_disk(path)
+        if fig_json is not None:
+            fig = figure_encoding.decode(fig_json)
+    if fig_json is None:
+        # the built figure is served as is, only its encoded copy is written
+        metrics.cache_result("figure", "miss")
+        built_fig = build_fn(*inputs)
+        with metrics.stage("figure_cache_io"):
+            fig = figure_encoding.figure_dict(built_fig)
+            _write_disk(path, figure_encoding.encode_dict(fig), proj_path)
+    else:
+        metrics.cache_result("figure", "disk_hit")
+
+    with _lock:
+        _lru[(proj_path, key)] = fig
+        while len(_lru) > memory_size:
+            _lru.popitem(last=False)
+    return fig
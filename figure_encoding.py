@@ -0,0 +1,136 @@
+"""
+Serialization of the figures built by the graph callbacks.
+
+Figures used to be serialized with plotly's own encoder (Figure.to_json()),
+which writes every float with full precision, every date as a full ISO
+timestamp and runs each figure through the json module three times.  The
+dense marker traces were SVG Scatter traces, one DOM node per point.
+
+With compact set, figures take a faster and smaller path:
+
+- the dense marker traces, and the lines drawn on top of them, are WebGL
+  Scattergl traces (see scatter_trace()),
+- float arrays are rounded to float_decimals decimals (0.036 seconds for the
+  times of day in hours), which is far below what a plot can show,
+- date arrays are written as "YYYY-MM-DD" wherever a date has no time of day,
+- the figure dict is encoded with orjson when it is installed, which
+  serializes NumPy arrays natively.
+
+The Dash version this app runs on (1.8) predates plotly.js' binary typed
+array support, so arrays are still sent as JSON lists, just shorter ones.
+Set compact to False to go back to plotly's encoder and SVG traces, e.g. to
+compare both with benchmarks/figure_payload.py.
+"""
+# import base packages
+import datetime, json
+
+# import installed packages
+import numpy as np
+import pandas as pd
+from plotly import graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    # the json module is slower, but produces the same figures
+    orjson = None
+
+# input variables
+compact = True # if True, use the compact serialization path described above
+float_decimals = 5 # number of decimals kept of float arrays in compact mode
+
+
+def scatter_trace(**kwargs):
+    # a scatter trace drawn with WebGL in compact mode.  WebGL traces are drawn
+    # above every SVG trace of a subplot, so the fills behind them stay SVG
+    if compact:
+        return go.Scattergl(**kwargs)
+    return go.Scatter(**kwargs)
+
+
+def _compact_dates(values):
+    # ISO strings of naive datetimes, without the time of midnight dates
+    iso = np.datetime_as_string(values.astype("datetime64[s]"), unit="auto")
+    return np.where(np.isnat(values), None, iso).tolist()
+
+
+def _compact_array(values):
+    if values.dtype.kind == "f":
+        values = np.round(values, float_decimals)
+        if np.isnan(values).any():
+            # NaN isn't valid JSON, missing values are null like in plotly's encoder
+            return np.where(np.isnan(values), None, values).tolist()
+        return values
+    if values.dtype.kind == "M":
+        return _compact_dates(values)
+    if values.dtype.kind == "O":
+        # plotly keeps dates as object arrays of Timestamps
+        non_null = [val for val in values if val is not None]
+        if (len(non_null) > 0) and all(isinstance(val, datetime.datetime) and
+                                       (val.tzinfo is None) for val in non_null):
+            return _compact_dates(pd.DatetimeIndex(values).values)
+    return values
+
+
+def _compact_props(props):
+    # compact the arrays of a trace dict, including nested ones like marker
+    compact_props = {}
+    for key, val in props.items():
+        if isinstance(val, np.ndarray):
+            val = _compact_array(val)
+        elif isinstance(val, dict):
+            val = _compact_props(val)
+        compact_props[key] = val
+    return compact_props
+
+
+def _default(obj):
+    # types neither encoder handles natively
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is pd.NaT:
+        return None
+    raise TypeError("Type is not JSON serializable: %s" % type(obj).__name__)
+
+
+def figure_dict(fig):
+    """
+    Return the figure dict of the plotly figure fig which encode() writes,
+    with the arrays compacted if compact is set.  Dash serializes it as is.
+    """
+    fig_dict = fig.to_plotly_json()
+    if compact:
+        fig_dict["data"] = [_compact_props(trace) for trace in fig_dict["data"]]
+    return fig_dict
+
+
+def encode_dict(fig_dict):
+    # the JSON string of a figure dict returned by figure_dict()
+    if not compact:
+        return json.dumps(fig_dict, cls=PlotlyJSONEncoder)
+    if orjson is not None:
+        return orjson.dumps(fig_dict, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(fig_dict, default=_default, separators=(",", ":"))
+
+
+def encode(fig):
+    """
+    Return the JSON string of the plotly figure fig, using the compact path
+    described in the module docstring if compact is set.
+    """
+    if not compact:
+        return fig.to_json()
+    return encode_dict(figure_dict(fig))
+
+
+def decode(fig_json):
+    # the figure dict of a JSON string written by encode()
+    if orjson is not None:
+        return orjson.loads(fig_json)
+    return json.loads(fig_json)
@@ -0,0 +1,161 @@
+"""
+Cache of the LOWESS fits drawn on the overview tab.
+
+The smoothed duration, fell asleep and woke up lines are fully determined by
+the day-of-week toggles, the work/off-night toggles and the date range.  At
+sync time (right after update_garmin_sleep.step3 writes new data) the fits
+for all 512 toggle combinations over the slider's default, full date range
+are computed and saved next to the data artifacts.  Requests matching one of
+those are served straight from the file, while any other slider range is
+fitted on demand and kept in a small in-process LRU.
+
+Cached fits are tied to the size and modification time of the sleep
+description and event pickles they were computed from, and to the smoothing
+engine which computed them, so they are ignored as soon as a sync writes new
+data or the engine is changed.  The precomputed fits are the largest thing a
+worker holds, so they are read from the file once and published as a
+shared_segment, which all workers attach to.
+"""
+# import base packages
+import hashlib, pickle, os, threading
+from collections import OrderedDict
+
+# import installed packages
+import numpy as np
+
+# import local modules
+import column_store, data_cache, metrics, shared_segment, sleep_filters, smoother
+
+fit_cache_fn = "data/lowess_fit_cache.pkl" # name of pickle file holding the precomputed fits
+lru_size = 256 # max number of on-demand fits kept per process
+overview_frac = 0.04 # LOWESS span used on the overview tab
+fit_lines = ["dur", "asleep", "wake"] # the smoothed lines of each fit, see overview_fits()
+
+_lock = threading.Lock()
+_lru = OrderedDict()
+_precomputed = OrderedDict() # proj_path: {"version": ..., "fits": ...}, see data_cache.project_slots
+
+
+def data_stamp(proj_path=""):
+    # identifies the data and smoothing engine the fits were computed from
+    return (tuple(column_store.source_stamp(proj_path + data_cache.descr_fn)),
+            tuple(column_store.source_stamp(proj_path + data_cache.event_fn)),
+            smoother.engine)
+
+
+def _fit(y, x_days):
+    # lowess can't fit a selection without any known values
+    if np.isfinite(np.asarray(y, dtype=float)).sum() == 0:
+        return np.empty((0, 2))
+    return smoother.smooth(y, x_days, overview_frac)
+
+
+def overview_fits(mask_df, events_df):
+    # returns the [days since first night, fitted value] arrays for each smoothed line
+    mask_days = (mask_df.Prev_Day - np.nanmin(mask_df.Prev_Day)).dt.days
+    fit_dur = _fit(mask_df.Total_Dur.dt.seconds/(60.*60), mask_days)
+    fit_asleep = _fit(events_df.Asleep_ToD, mask_days)
+    fit_wake = _fit(events_df.Wake_ToD, mask_days)
+    return {"dur": fit_dur, "asleep": fit_asleep, "wake": fit_wake}
+
+
+def build_fit_cache(sleep_descr_df, sleep_event_df, proj_path=""):
+    # the default slider position spans rows [0, len - 1)
+    full_range = [0, len(sleep_descr_df) - 1]
+    filter_index = sleep_filters.FilterIndex(sleep_descr_df, sleep_event_df)
+    fits = {}
+    for dow_filter, tod_filter in sleep_filters.all_toggle_filters():
+        mask_df, events_df = sleep_filters.filter_events(
+            sleep_descr_df, sleep_event_df, filter_index, full_range, dow_filter, tod_filter)
+        key = sleep_filters.filter_key(full_range, dow_filter, tod_filter, len(sleep_descr_df))
+        if len(mask_df) == 0:
+            fits[key] = None
+        else:
+            fits[key] = overview_fits(mask_df, events_df)
+
+    # write to a temporary file and then swap it in, so readers never see a partial file
+    tmp_fn = proj_path + fit_cache_fn + ".tmp%d" % os.getpid()
+    with open(tmp_fn, "wb") as fp:
+        pickle.dump({"stamp": data_stamp(proj_path), "fits": fits}, fp)
+    os.replace(tmp_fn, proj_path + fit_cache_fn)
+    return len(fits)
+
+
+def _read_precomputed(stamp, proj_path):
+    # the fits of the fit cache file in the form of a shared_segment: the
+    # arrays of each line concatenated, and the bounds of each fit within them
+    try:
+        with open(proj_path + fit_cache_fn, "rb") as fp:
+            cache = pickle.load(fp)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        cache = {"stamp": None, "fits": {}}
+
+    # a cache built from other data is as good as no cache
+    fits = cache["fits"] if cache["stamp"] == stamp else {}
+    line_arrays = {line: [] for line in fit_lines}
+    offsets = {line: 0 for line in fit_lines}
+    bounds_ls = []
+    for key, fit in fits.items():
+        if fit is None:
+            bounds_ls.append([key, None])
+            continue
+        bounds = []
+        for line in fit_lines:
+            line_arrays[line].append(fit[line])
+            bounds.append([offsets[line], offsets[line] + len(fit[line])])
+            offsets[line] += len(fit[line])
+        bounds_ls.append([key, bounds])
+    arrays = {line: np.concatenate(line_arrays[line]) if len(line_arrays[line]) > 0
+              else np.empty((0, 2)) for line in fit_lines}
+    return {}, arrays, bounds_ls
+
+
+def _load_precomputed(stamp, proj_path):
+    # every worker attaches to the one copy of the fits (see shared_segment)
+    fit_stamp = column_store.source_stamp(proj_path + fit_cache_fn) \
+        if os.path.isfile(proj_path + fit_cache_fn) else None
+    version = hashlib.sha1(repr((stamp, fit_stamp)).encode("utf-8")).hexdigest()[:12]
+    precomputed = _precomputed.get(proj_path)
+    if (precomputed is None) or (precomputed["version"] != version):
+        segment = shared_segment.attach_or_publish(
+            "fits", proj_path, version, lambda: _read_precomputed(stamp, proj_path))
+        fits = {}
+        for key, bounds in segment["meta"]:
+            key = tuple(tuple(part) for part in key)
+            if bounds is None:
+                fits[key] = None
+            else:
+                fits[key] = {line: segment["arrays"][line][start:stop]
+                             for line, (start, stop) in zip(fit_lines, bounds)}
+        precomputed = {"version": version, "fits": fits}
+        _precomputed[proj_path] = precomputed
+    _precomputed.move_to_end(proj_path)
+    while len(_precomputed) > data_cache.project_slots:
+        _precomputed.popitem(last=False)
+    return precomputed["fits"]
+
+
+def get_overview_fits(mask_df, events_df, key, proj_path=""):
+    """
+    Return the overview fits for the filter state described by key (see
+    sleep_filters.filter_key), where mask_df and events_df are that state's
+    filtered frames (see sleep_filters.filter_events).
+    """
+    stamp = data_stamp(proj_path)
+    with _lock:
+        precomputed = _load_precomputed(stamp, proj_path)
+        if precomputed.get(key) is not None:
+            metrics.cache_result("fit", "precomputed_hit")
+            return precomputed[key]
+        if (proj_path, stamp, key) in _lru:
+            _lru.move_to_end((proj_path, stamp, key))
+            metrics.cache_result("fit", "memory_hit")
+            return _lru[(proj_path, stamp, key)]
+
+    metrics.cache_result("fit", "miss")
+    fits = overview_fits(mask_df, events_df)
+    with _lock:
+        _lru[(proj_path, stamp, key)] = fits
+        while len(_lru) > lru_size:
+            _lru.popitem(last=False)
+    return fits
@@ -0,0 +1,47 @@
+"""
+Level of detail of long background series.
+
+The sunrise/sunset background of the overview tab has one point per day of
+the whole history, although only the visible date range is drawn and a plot
+is only about a thousand pixels wide.  Before such a series is sent to the
+browser it is clipped to the visible range and then decimated by min/max
+bucketing: the rows are split into max_buckets buckets and only the first,
+last, lowest and highest point of each bucket is kept, so the drawn outline
+(including jumps like daylight saving time changes) looks the same while the
+payload stays bounded however long the history grows.  Zooming in re-renders
+the figure for the new range, which brings back the detail.
+"""
+# import installed packages
+import numpy as np
+
+max_buckets = 500 # number of min/max buckets, i.e. at most 4 points per bucket are kept
+
+
+def visible_rows(x, x_range):
+    """
+    Return the (start, stop) rows of the sorted array x within x_range, plus
+    one row on either side so that lines run to the edges of the plot.
+    """
+    start = np.searchsorted(x, x_range[0], side="left")
+    stop = np.searchsorted(x, x_range[1], side="right")
+    return max(start - 1, 0), min(stop + 1, len(x))
+
+
+def minmax_rows(y_arrays, n_buckets=max_buckets):
+    """
+    Return the sorted row positions which keep the first, last, lowest and
+    highest value of each bucket of every array in y_arrays (all of the same
+    length), so the decimated series share the same x values.
+    """
+    n_rows = len(y_arrays[0])
+    if n_rows <= 2*n_buckets:
+        return np.arange(n_rows)
+
+    edges = np.linspace(0, n_rows, n_buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    keep = [edges[:-1], edges[1:] - 1]
+    for y in y_arrays:
+        # sorting by bucket then value puts each bucket's min first and max last
+        order = np.lexsort((y, bucket))
+        keep += [order[edges[:-1]], order[edges[1:] - 1]]
+    return np.unique(np.concatenate(keep))
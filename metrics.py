@@ -0,0 +1,339 @@
+"""
+Latency metrics of the graph callbacks and the sync steps.
+
+Each graph callback is timed as a whole and in stages (data load, filter,
+smoothing, figure build, figure_cache_io), each sync step (step0 to step4) is
+timed as a whole, and the caches (data_cache, fit_cache, figure_cache) count
+their hits and misses.  Timings are recorded in histograms with the fixed
+buckets below, and everything is served at the /metrics route of the Flask
+server in the Prometheus text format (see render()).
+
+The callbacks are served by several gunicorn workers and the sync steps run
+in a process of their own (see sync_jobs), so every process keeps its own
+metrics and writes them to a small JSON file in metrics_dir (see flush()).
+A process writes its file every flush_interval seconds while it has new
+metrics, from a background thread, and when it exits, so callbacks never
+wait for the disk.  Files are named after the pid and a random token, since
+pids repeat after a container restart.
+
+render() sums the files of all processes, so whichever worker serves the
+route reports the metrics of all of them.  It first merges the files of
+exited processes into merged_fn, and removes them, so the number of files
+stays that of the running processes while the totals only ever grow, as
+Prometheus expects of counters and histograms.  Merging needs fcntl, on
+Windows the files of exited processes are kept instead.
+
+A stage records under the callback which is running in its thread (see
+callback()), so the stages of a function shared by several callbacks, such as
+build_overview_figure(), are reported per callback.
+"""
+# import base packages
+import atexit, functools, json, os, threading, time, uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # running on Windows
+    fcntl = None
+
+enabled = True # if False, nothing is recorded or written
+metrics_dir = "data/metrics/" # dir holding the metrics file of each process
+merged_fn = "merged.json" # file in metrics_dir holding the summed metrics of exited processes
+flush_interval = 10 # seconds between writes of a process' metrics file
+prefix = "sleepwithdash_" # name prefix of every exported metric
+buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300] # upper bounds, seconds
+
+# (type, help text) of each metric
+definitions = {
+    "callback_seconds": ("histogram", "Duration of the graph callbacks."),
+    "callback_stage_seconds": ("histogram", "Duration of the stages of the graph callbacks."),
+    "sync_step_seconds": ("histogram", "Duration of the data sync steps."),
+    "cache_requests_total": ("counter", "Cache lookups by cache and result."),
+}
+
+_lock = threading.Lock()
+_histograms = {} # (name, labels): [bucket counts, sum, count]
+_counters = {} # (name, labels): value
+_local = threading.local()
+_process = {"pid": None, "fn": None, "dirty": False} # this process' metrics file, see _record()
+
+
+def _labels(labels):
+    # a hashable, ordered form of a label dict
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _record():
+    # called with _lock held before each change.  A forked worker starts its
+    # own file and flusher thread, without the metrics of its parent
+    if _process["pid"] != os.getpid():
+        _histograms.clear()
+        _counters.clear()
+        _process["pid"] = os.getpid()
+        _process["fn"] = "%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:12])
+        threading.Thread(target=_flush_loop, daemon=True).start()
+        atexit.register(flush)
+    _process["dirty"] = True
+
+
+def _flush_loop():
+    pid = os.getpid()
+    while _process["pid"] == pid:
+        time.sleep(flush_interval)
+        if _process["dirty"]:
+            flush()
+
+
+def observe(name, seconds, **labels):
+    # add a duration to a histogram
+    if not enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _record()
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0]*len(buckets), 0., 0]
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                hist[0][i] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+
+def count(name, value=1, **labels):
+    # add to a counter
+    if not enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _record()
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def cache_result(cache, result):
+    # count a cache lookup, e.g. cache_result("figure", "hit")
+    count("cache_requests_total", cache=cache, result=result)
+
+
+@contextmanager
+def timer(name, **labels):
+    # records the duration of the with block, also when it raises
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def stage(name):
+    # times a stage of the callback running in this thread, if any
+    callback_name = getattr(_local, "callback", None)
+    if callback_name is None:
+        yield
+        return
+    with timer("callback_stage_seconds", callback=callback_name, stage=name):
+        yield
+
+
+def callback(fn):
+    """
+    Decorate a graph callback so that it's timed and its stages are recorded
+    under its name.
+    """
+    @functools.wraps(fn)
+    def wrapped(*args):
+        outer = getattr(_local, "callback", None)
+        _local.callback = fn.__name__
+        try:
+            with timer("callback_seconds", callback=fn.__name__):
+                return fn(*args)
+        finally:
+            _local.callback = outer
+    return wrapped
+
+
+def _snapshot():
+    return {
+        "pid": os.getpid(),
+        "histograms": [[name, labels, hist[0], hist[1], hist[2]]
+                       for (name, labels), hist in _histograms.items()],
+        "counters": [[name, labels, value] for (name, labels), value in _counters.items()]
+    }
+
+
+def _write_json(path, content):
+    # write to a temporary file and then swap it in, so readers never see a partial file
+    tmp_fn = path + ".tmp%d-%d" % (os.getpid(), threading.get_ident())
+    with open(tmp_fn, "w") as fp:
+        json.dump(content, fp)
+    os.replace(tmp_fn, path)
+
+
+def flush(proj_path=""):
+    # write this process' metrics file, if it has recorded anything
+    if (not enabled) or (_process["pid"] != os.getpid()):
+        return
+    with _lock:
+        snapshot = _snapshot()
+        _process["dirty"] = False
+    try:
+        os.makedirs(proj_path + metrics_dir, exist_ok=True)
+        _write_json(proj_path + metrics_dir + _process["fn"], snapshot)
+    except OSError:
+        # metrics are never worth failing a callback or sync over
+        pass
+
+
+def _read_json(path):
+    try:
+        with open(path, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(totals, snapshot):
+    # add the metrics of a snapshot to totals, which has the form of a snapshot
+    histograms = {(name, tuple(tuple(label) for label in labels)): [bucket_counts, total, n]
+                  for name, labels, bucket_counts, total, n in totals["histograms"]}
+    counters = {(name, tuple(tuple(label) for label in labels)): value
+                for name, labels, value in totals["counters"]}
+    for name, labels, bucket_counts, total, n in snapshot["histograms"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        hist = histograms.setdefault(key, [[0]*len(buckets), 0., 0])
+        if len(bucket_counts) != len(buckets):
+            # written with other buckets, only the sum and count still apply
+            bucket_counts = [0]*len(buckets)
+        hist[0] = [a + b for a, b in zip(hist[0], bucket_counts)]
+        hist[1] += total
+        hist[2] += n
+    for name, labels, value in snapshot["counters"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+    return {
+        "histograms": [[name, labels, hist[0], hist[1], hist[2]] for (name, labels), hist in histograms.items()],
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "merged_fns": totals.get("merged_fns", [])
+    }
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. running as another OS user
+        return True
+    return True
+
+
+def _process_fns(proj_path):
+    try:
+        return [entry.name for entry in os.scandir(proj_path + metrics_dir)
+                if entry.name.endswith(".json") and (entry.name != merged_fn)]
+    except OSError:
+        return []
+
+
+def _merge_exited(proj_path):
+    # fold the files of exited processes into merged_fn, returning its
+    # content.  merged_fn lists the files it holds, so a file is never
+    # counted twice, also when removing it fails
+    merged = _read_json(proj_path + metrics_dir + merged_fn) or \
+        {"histograms": [], "counters": [], "merged_fns": []}
+    if fcntl is None:
+        return merged
+    fns = _process_fns(proj_path)
+    exited = []
+    for fn in fns:
+        if fn in merged["merged_fns"]:
+            continue
+        snapshot = _read_json(proj_path + metrics_dir + fn)
+        if (snapshot is not None) and not _is_running(snapshot["pid"]):
+            merged = _add(merged, snapshot)
+            exited.append(fn)
+    if len(exited) == 0:
+        return merged
+    merged["merged_fns"] = [fn for fn in merged["merged_fns"] if fn in fns] + exited
+    _write_json(proj_path + metrics_dir + merged_fn, merged)
+    for fn in exited:
+        try:
+            os.remove(proj_path + metrics_dir + fn)
+        except OSError:
+            pass
+    return merged
+
+
+@contextmanager
+def _merge_lock(proj_path):
+    # serializes merging with reading, so no reader misses the files being merged
+    if fcntl is None:
+        yield
+        return
+    with open(proj_path + metrics_dir + "merge.lock", "a+") as fp:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _read_all(proj_path):
+    # the metrics of every process, summed
+    with _merge_lock(proj_path):
+        merged = _merge_exited(proj_path)
+        totals = _add({"histograms": [], "counters": []}, merged)
+        for fn in _process_fns(proj_path):
+            if fn in merged["merged_fns"]:
+                continue
+            snapshot = _read_json(proj_path + metrics_dir + fn)
+            if snapshot is not None:
+                totals = _add(totals, snapshot)
+    histograms = {(name, tuple(tuple(label) for label in labels)): (bucket_counts, total, n)
+                  for name, labels, bucket_counts, total, n in totals["histograms"]}
+    counters = {(name, tuple(tuple(label) for label in labels)): value
+                for name, labels, value in totals["counters"]}
+    return histograms, counters
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = [(key, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+               for key, value in pairs]
+    return "{" + ",".join(['%s="%s"' % pair for pair in escaped]) + "}"
+
+
+def render(proj_path=""):
+    """
+    Return the metrics of all processes in the Prometheus text exposition
+    format (version 0.0.4).
+    """
+    flush(proj_path)
+    try:
+        os.makedirs(proj_path + metrics_dir, exist_ok=True)
+        histograms, counters = _read_all(proj_path)
+    except OSError:
+        histograms, counters = {}, {}
+    lines = []
+    for name, (metric_type, help_text) in definitions.items():
+        lines.append("# HELP %s%s %s" % (prefix, name, help_text))
+        lines.append("# TYPE %s%s %s" % (prefix, name, metric_type))
+        if metric_type == "histogram":
+            for (hist_name, labels), (bucket_counts, total, n) in sorted(histograms.items()):
+                if hist_name != name:
+                    continue
+                # bucket counts are already cumulative, see observe()
+                for bound, bucket_count in zip(buckets, bucket_counts):
+                    lines.append("%s%s_bucket%s %d" % (prefix, name, _format_labels(labels, [("le", repr(float(bound)))]),
+                                                      bucket_count))
+                lines.append("%s%s_bucket%s %d" % (prefix, name, _format_labels(labels, [("le", "+Inf")]), n))
+                lines.append("%s%s_sum%s %r" % (prefix, name, _format_labels(labels), float(total)))
+                lines.append("%s%s_count%s %d" % (prefix, name, _format_labels(labels), n))
+        else:
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append("%s%s%s %r" % (prefix, name, _format_labels(labels), float(value)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+"""
+Year-agnostic dates for the annual tab.
+
+The annual tab plots every year against one another, so each date is mapped
+onto the same day and month of dummy_year.  The dummy year is a leap year,
+so February 29 keeps its own day instead of colliding with March 1.
+
+These season days used to be rebuilt on every request (a new DataFrame per
+column, parsed again with pd.to_datetime), together with the sunrise/sunset
+average of each season day.  Instead, the sleep description data carries a
+Mon_Day column which is added at ingest (see sleep_schema.compact_descr), and
+the seasonal sunrise/sunset aggregate is written as its own artifact next to
+the sunrise/sunset archive whenever that archive changes:
+
+    Date                        datetime64[ns] season day in dummy_year
+    Sunrise_ToD, Sunset_ToD     float64 mean time of day in hours
+    Sunrise, Sunset             datetime64[ns] season day plus the mean time
+    N_Days                      int32 number of archived dates averaged
+
+Days which aren't archived in any year, typically February 29 of a history
+without a leap day, are interpolated from their neighbours and have an
+N_Days of 0.
+"""
+# import base packages
+from os.path import isfile
+
+# import installed packages
+import numpy as np
+import pandas as pd
+
+# import local modules
+import column_store
+
+dummy_year = 2000 # leap year onto which the annual tab maps every date
+sun_agg_fn = "data/sun_agg_df.pkl" # seasonal sunrise/sunset aggregate
+sun_agg_cols = ["Date", "Sunrise_ToD", "Sunset_ToD", "Sunrise", "Sunset", "N_Days"]
+
+_dummy_start = np.datetime64("%d-01-01" % dummy_year, "D")
+
+
+def season_days(dates):
+    """
+    Return the dates of the Series dates mapped onto dummy_year, as a
+    datetime64[ns] array.  February 29 maps onto February 29.
+    """
+    dates = pd.DatetimeIndex(dates)
+    # day of year within a leap year: non-leap years skip February 29
+    day_of_year = dates.dayofyear.values + ((~dates.is_leap_year) & (dates.month > 2))
+    days = _dummy_start + (day_of_year - 1).astype("timedelta64[D]")
+    return np.where(pd.isnull(dates), np.datetime64("NaT"), days).astype("datetime64[ns]")
+
+
+def build_sun_agg(sun_df):
+    # average the sunrise and sunset times of each season day over all years
+    tod_cols = ["Sunrise_ToD", "Sunset_ToD"]
+    days_df = pd.DataFrame({"Date": season_days(sun_df["Date"])})
+    for col in tod_cols:
+        days_df[col] = sun_df[col].values.astype(np.float64)
+    grouped = days_df.groupby("Date", sort=True)
+    sun_agg_df = grouped[tod_cols].mean()
+    sun_agg_df["N_Days"] = grouped.size().astype(np.int32)
+
+    # fill in the season days between the first and last archived ones
+    if len(sun_agg_df) > 0:
+        all_days = pd.date_range(sun_agg_df.index[0], sun_agg_df.index[-1], freq="D")
+        sun_agg_df = sun_agg_df.reindex(all_days)
+        sun_agg_df[tod_cols] = sun_agg_df[tod_cols].interpolate()
+        sun_agg_df["N_Days"] = sun_agg_df["N_Days"].fillna(0).astype(np.int32)
+
+    sun_agg_df = sun_agg_df.rename_axis("Date").reset_index()
+    sun_agg_df["Sunrise"] = sun_agg_df["Date"] + pd.to_timedelta(sun_agg_df["Sunrise_ToD"], unit="hour")
+    sun_agg_df["Sunset"] = sun_agg_df["Date"] + pd.to_timedelta(sun_agg_df["Sunset_ToD"] + 24, unit="hour")
+    return sun_agg_df[sun_agg_cols]
+
+
+def save_sun_agg(sun_df, proj_path=""):
+    # rebuild the aggregate of the sunrise/sunset archive sun_df and write it
+    sun_agg_df = build_sun_agg(sun_df)
+    column_store.save(sun_agg_df, sun_agg_fn, proj_path)
+    return sun_agg_df
+
+
+def load_sun_agg(sun_df, proj_path=""):
+    """
+    Return the archived aggregate of sun_df, or build it in memory when it
+    hasn't been written yet or was written for a different number of dates.
+    """
+    if isfile(proj_path + sun_agg_fn):
+        sun_agg_df = column_store.load(sun_agg_fn, proj_path)
+        if sun_agg_df["N_Days"].sum() == len(sun_df):
+            return sun_agg_df
+    return build_sun_agg(sun_df)
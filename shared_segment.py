@@ -0,0 +1,211 @@
+"""
+Read-only segments of arrays shared by all gunicorn worker processes.
+
+column_store lets the workers share the pages of the archived frames, but
+each worker still held private copies of whatever it derived from them on
+load: the sunrise/sunset frame with its deltas applied, the filter index,
+the seasonal aggregate and, by far the largest, the precomputed overview fits
+(see fit_cache), which every worker unpickled on its own (over 100 MB for 50
+years of nights).
+
+Instead, the first worker to load a version of that data publishes it as a
+segment: one raw NumPy file per array plus a JSON manifest, written into a
+dir on a tmpfs (segment_root, /dev/shm where it exists).  Every worker,
+including the one which published it, then attaches to the segment by
+memory-mapping its files read-only, so they all share the same physical
+pages and resident memory stays flat as workers are added.  The app runs on
+Python 3.7, which has no multiprocessing.shared_memory, and on Linux that
+module is backed by files in /dev/shm too.  Without a tmpfs, segments are
+written under the project dir instead and shared through the page cache.
+
+A segment is named after its project dir, its name (e.g. "frames") and the
+version of the data it holds, such as a data generation.  It's written to a
+temporary dir which is then renamed into place, so a segment is either
+complete or absent, and a worker which loses the race to publish a version
+attaches to the winner's segment.  Publishing a new version removes the
+older versions of the same name, and workers still attached to them keep
+their mappings until they attach to the new version.
+
+Segments outlive the processes which published them, and there is one set of
+them per project dir, i.e. per user (see user_store), so the segments of all
+project dirs under a root share a budget of budget_bytes.  Whenever a publish
+takes the total past it, the least recently attached segments are removed
+(other than the one just published), along with temporary dirs which
+crashed publishers left behind.  A removed segment only stays in memory
+while workers still map it, at most data_cache.project_slots project dirs
+per worker, and is published again by the next worker which needs it.
+Segments on a tmpfs are gone after a reboot, or a dyno restart.
+"""
+# import base packages
+import hashlib, json, os, shutil, time, uuid
+
+# import installed packages
+import numpy as np
+
+# import local modules
+import column_store
+
+enabled = True # if False, every worker keeps private copies of the derived data instead
+segment_root = "/dev/shm/" if os.path.isdir("/dev/shm") else None # tmpfs dir holding the segments
+local_segment_dir = "data/segments/" # dir of the segments in the project dir, without a tmpfs
+segment_prefix = "sleepwithdash-" # name prefix of every segment dir
+manifest_fn = "manifest.json" # name of the manifest within each segment dir
+budget_bytes = 1024*1024*1024 # max total size of the segments under a root, see evict()
+stale_tmp_seconds = 600 # age after which a temporary dir is taken to be left by a crashed publisher
+
+
+def _segment_base(name, proj_path):
+    # segments of different project dirs (see user_store) under one segment_root are kept apart
+    root = segment_root if segment_root is not None else proj_path + local_segment_dir
+    tag = hashlib.sha1(os.path.abspath(proj_path).encode("utf-8")).hexdigest()[:12]
+    return root, "%s%s-%s-" % (segment_prefix, tag, name)
+
+
+def segment_dir(name, proj_path, version):
+    root, base = _segment_base(name, proj_path)
+    return root + base + str(version) + "/"
+
+
+def _remove_others(name, proj_path, version):
+    # drop the other versions of a segment, and temporary dirs left by crashed publishers
+    root, base = _segment_base(name, proj_path)
+    try:
+        entries = [entry.name for entry in os.scandir(root) if entry.name.startswith(base)]
+    except OSError:
+        return
+    for entry in entries:
+        # other processes may still be writing their copy of this version
+        if (entry != base + str(version)) and not entry.startswith(base + str(version) + "."):
+            # Windows refuses to delete files which are still mapped
+            shutil.rmtree(root + entry, ignore_errors=True)
+
+
+def publish(name, proj_path, version, frames=None, arrays=None, meta=None):
+    """
+    Publish the frames and arrays (dicts of them, by name) and the JSON
+    serializable meta of a version as the segment name of proj_path.  Does
+    nothing if another process has published that version already.
+    """
+    out_dir = segment_dir(name, proj_path, version)
+    if os.path.isdir(out_dir):
+        return
+    tmp_dir = out_dir[:-1] + ".tmp%d-%s/" % (os.getpid(), uuid.uuid4().hex[:12])
+    os.makedirs(tmp_dir)
+
+    manifest = {"frames": {}, "arrays": {}, "meta": meta}
+    for frame_name, df in (frames or {}).items():
+        manifest["frames"][frame_name] = column_store.write_columns(df, tmp_dir, frame_name)
+    for array_name, values in (arrays or {}).items():
+        manifest["arrays"][array_name] = array_name + ".npy"
+        np.save(tmp_dir + array_name + ".npy", np.ascontiguousarray(values))
+    with open(tmp_dir + manifest_fn, "w") as fp:
+        json.dump(manifest, fp)
+
+    try:
+        os.rename(tmp_dir[:-1], out_dir[:-1])
+    except OSError:
+        # another process published this version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    _remove_others(name, proj_path, version)
+    evict(_segment_base(name, proj_path)[0], keep=out_dir)
+
+
+def _dir_bytes(path):
+    total = 0
+    for dir_path, _, fns in os.walk(path):
+        for fn in fns:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, fn))
+            except OSError:
+                pass
+    return total
+
+
+def evict(root, keep=None):
+    """
+    Remove the least recently attached segments under root until they fit in
+    budget_bytes, never removing the segment dir keep, and remove stale
+    temporary dirs.
+    """
+    entries = []
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.name.startswith(segment_prefix) and entry.is_dir():
+                    entries.append(entry.name)
+    except OSError:
+        return
+    segments = []
+    total_bytes = 0
+    for entry in entries:
+        path = root + entry
+        if ".tmp" in entry:
+            try:
+                if time.time() - os.stat(path).st_mtime > stale_tmp_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        try:
+            # attach() touches the manifest, so its mtime is the last attach
+            last_used = os.stat(path + "/" + manifest_fn).st_mtime
+        except OSError:
+            continue
+        size = _dir_bytes(path)
+        segments.append((last_used, size, path))
+        total_bytes += size
+    for _, size, path in sorted(segments):
+        if total_bytes <= budget_bytes:
+            break
+        if (keep is not None) and (path == keep.rstrip("/")):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+
+
+def attach(name, proj_path, version):
+    """
+    Return a dict of the "frames", "arrays" and "meta" of a published
+    segment, as read-only views of the shared files, or None if that version
+    hasn't been published.
+    """
+    in_dir = segment_dir(name, proj_path, version)
+    try:
+        with open(in_dir + manifest_fn, "r") as fp:
+            manifest = json.load(fp)
+        frames = {frame_name: column_store.read_columns(frame_manifest, in_dir)
+                  for frame_name, frame_manifest in manifest["frames"].items()}
+        arrays = {array_name: np.load(in_dir + fn, mmap_mode="r")
+                  for array_name, fn in manifest["arrays"].items()}
+    except (OSError, ValueError, KeyError):
+        # not published, or removed by a newer version while being read
+        return None
+    try:
+        os.utime(in_dir + manifest_fn) # mark as recently used for eviction
+    except OSError:
+        pass
+    return {"frames": frames, "arrays": arrays, "meta": manifest["meta"]}
+
+
+def attach_or_publish(name, proj_path, version, build_fn):
+    """
+    Return the attached segment of a version, publishing it first from the
+    (frames, arrays, meta) which build_fn() returns if it isn't published
+    yet.  Without segments (see enabled), or if the segment can't be
+    written, the built data itself is returned in the same form.
+    """
+    if enabled:
+        segment = attach(name, proj_path, version)
+        if segment is not None:
+            return segment
+    frames, arrays, meta = build_fn()
+    if enabled:
+        try:
+            publish(name, proj_path, version, frames, arrays, meta)
+            segment = attach(name, proj_path, version)
+            if segment is not None:
+                return segment
+        except OSError:
+            # e.g. a full tmpfs, which only costs the memory savings
+            pass
+    return {"frames": frames, "arrays": arrays, "meta": meta}
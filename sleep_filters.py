@@ -0,0 +1,141 @@
+"""
+Filters shared by the graph callbacks and the precomputed fit cache.
+
+The overview and annual tabs filter sleep sessions by a date range (slider
+positions are row numbers of the sleep description data), by day of week and
+by work/off night.  Keeping that logic here guarantees that cached results
+are computed from exactly the same rows a callback would select.
+
+Rather than matching the Day and Is_Workday columns against the filter lists
+and then joining the events on their session IDs, a FilterIndex encodes each
+session's day of week and work/off night as bits of one integer, so a filter
+state is a single bitwise test over all sessions.  It also maps each session
+row to the row position of its events.
+"""
+# import base packages
+from itertools import product
+
+# import installed packages
+import numpy as np
+import pandas as pd
+
+dow_vals = ['Monday', 'Tuesday', 'Wednesday', 'Thursday',
+            'Friday', 'Saturday', 'Sunday']
+tod_vals = [True, False] # work nights, off nights
+
+# bit layout of the per-session filter flags: bits 0-6 are the days of the
+# week (Monday = 0), bit 7 marks work nights and bit 8 marks off nights
+work_night_bit = 1 << 7
+off_night_bit = 1 << 8
+
+
+def filter_data(sleep_descr_df, sleep_event_df, date_range, dow_filter, tod_filter):
+    # filter date range using the row index
+    if date_range is None:
+        # date range slider hasn't initialized yet, so ignore it
+        mask_df = sleep_descr_df
+    else:
+        mask_df = sleep_descr_df.iloc[date_range[0]:date_range[1],:]
+
+    # filter types of day by getting sleep session IDs which meet filter criteria
+    mask_df = mask_df[(mask_df["Day"].isin(dow_filter)) &
+                        (mask_df["Is_Workday"].isin(tod_filter))]
+
+    # generate filtered dataframe
+    data_df = sleep_event_df[sleep_event_df["Sleep_Session_ID"].isin(mask_df["Sleep_Session_ID"])]
+    return mask_df, data_df
+
+
+def filter_events(sleep_descr_df, sleep_event_df, filter_index, date_range,
+                  dow_filter, tod_filter):
+    # selects the same rows as filter_data through filter_index (built from these frames)
+    rows, event_rows = filter_index.select(date_range, dow_filter, tod_filter)
+    return sleep_descr_df.iloc[rows], sleep_event_df.iloc[event_rows]
+
+
+def filter_key(date_range, dow_filter, tod_filter, n_rows):
+    # hashable description of a filter state, with the date range normalized
+    # to the [start, stop) rows which FilterIndex.select() actually slices, so
+    # e.g. None and [0, n_rows] share a key (the slider's [0, n_rows - 1]
+    # leaves the last night out, so it doesn't)
+    if date_range is None:
+        row_range = (0, n_rows)
+    else:
+        start, stop, _ = slice(date_range[0], date_range[1]).indices(n_rows)
+        row_range = (start, max(start, stop))
+    return (tuple(dow_filter), tuple(tod_filter), row_range)
+
+
+def all_toggle_filters():
+    # every combination of the 7 day-of-week and 2 work/off-night toggles (512 in total)
+    for dow_mask in product([True, False], repeat=len(dow_vals)):
+        for tod_mask in product([True, False], repeat=len(tod_vals)):
+            dow_filter = [val for val, keep in zip(dow_vals, dow_mask) if keep]
+            tod_filter = [val for val, keep in zip(tod_vals, tod_mask) if keep]
+            yield dow_filter, tod_filter
+
+
+def session_flags(sleep_descr_df):
+    # one int of filter flag bits per sleep session
+    dow_bits = np.left_shift(1, sleep_descr_df["Prev_Day"].dt.weekday.values)
+    tod_bits = np.where(sleep_descr_df["Is_Workday"].values, work_night_bit, off_night_bit)
+    return (dow_bits | tod_bits).astype(np.int64)
+
+
+def filter_bits(dow_filter, tod_filter):
+    # the flag bits a session needs to share with the day and with the night toggles
+    dow_bits = 0
+    for day in dow_filter:
+        dow_bits |= 1 << dow_vals.index(day)
+    tod_bits = (work_night_bit if True in tod_filter else 0) | \
+               (off_night_bit if False in tod_filter else 0)
+    return dow_bits, tod_bits
+
+
+class FilterIndex:
+    """
+    Filter flags and event rows of every sleep session, built once per data
+    generation (see data_cache.get_filter_index).  select() returns row
+    positions into the frames the index was built from.
+    """
+
+    def __init__(self, sleep_descr_df, sleep_event_df):
+        self.flags = session_flags(sleep_descr_df)
+        session_ids = sleep_descr_df["Sleep_Session_ID"].values
+        event_ids = sleep_event_df["Sleep_Session_ID"].values
+
+        # the wide event rows are normally aligned with the sessions (see
+        # sleep_schema), otherwise -1 marks a session without an event row
+        self.aligned = np.array_equal(session_ids, event_ids)
+        if self.aligned:
+            self.event_pos = np.arange(len(session_ids))
+        else:
+            pos = pd.Series(np.arange(len(event_ids)), index=event_ids)
+            pos = pos[~pos.index.duplicated()]
+            self.event_pos = pos.reindex(session_ids).fillna(-1).values.astype(np.int64)
+
+    @classmethod
+    def from_arrays(cls, flags, event_pos):
+        # the index of the flags and event_pos arrays of an index built
+        # before, e.g. read-only views of a shared segment (see shared_segment)
+        index = cls.__new__(cls)
+        index.flags = flags
+        index.event_pos = event_pos
+        index.aligned = np.array_equal(event_pos, np.arange(len(event_pos)))
+        return index
+
+    def select(self, date_range, dow_filter, tod_filter):
+        """
+        Return the row positions of the selected sessions and of their
+        events, in ascending order.
+        """
+        rows = np.arange(len(self.flags))
+        if date_range is not None:
+            rows = rows[date_range[0]:date_range[1]]
+        flags = self.flags[rows]
+        dow_bits, tod_bits = filter_bits(dow_filter, tod_filter)
+        rows = rows[((flags & dow_bits) != 0) & ((flags & tod_bits) != 0)]
+        if self.aligned:
+            return rows, rows
+        event_rows = self.event_pos[rows]
+        return rows, np.sort(event_rows[event_rows >= 0])
@@ -0,0 +1,113 @@
+"""
+Compact schema of the derived sleep frames.
+
+The sleep event data used to be a long table with two rows per sleep session
+("Fell Asleep" and "Woke Up"), a string Event column and a DateTimeStr column
+of preformatted hover text, which made it the largest artifact in data/.
+Now it is stored wide, with one row per session aligned with the rows of the
+sleep description data:
+
+    Sleep_Session_ID            int32
+    Asleep_Time, Wake_Time      datetime64[ns, local tz] (int64 nanoseconds)
+    Asleep_ToD, Wake_ToD        float64 time of day in hours
+
+Hover text is no longer stored, the graphs send the times and let Plotly
+format them with hovertemplate date formatting (see hover_times()).  The
+sleep description data is downcast as well (see descr_dtypes), and carries
+the Mon_Day column of each night mapped onto the annual tab's dummy year (see
+seasonal.season_days()).
+
+Event data archived in the long layout is converted on load, see
+compact_events().
+"""
+# import installed packages
+import numpy as np
+import pandas as pd
+
+# import local modules
+import seasonal
+
+# dtypes of the sleep description columns which are stored narrower than pandas' defaults
+descr_dtypes = {"Sleep_Session_ID": np.int32, "Year": np.int16}
+event_cols = ["Sleep_Session_ID", "Asleep_Time", "Asleep_ToD", "Wake_Time", "Wake_ToD"]
+# the times of day stay float64: the LOWESS fits of sparse filter selections
+# are sensitive enough that float32 rounding visibly moves the smoothed lines
+event_dtypes = {"Sleep_Session_ID": np.int32, "Asleep_ToD": np.float64, "Wake_ToD": np.float64}
+
+# hovertemplate format of the sleep event times, matching strftime('%B %d, %Y, %r')
+event_time_format = "%B %d, %Y, %I:%M:%S %p"
+
+
+def _downcast(df, dtypes):
+    # only the columns which differ are converted, so an already compact frame
+    # (e.g. memory-mapped by column_store) is returned as is
+    changed = {col: dtype for col, dtype in dtypes.items()
+               if (col in df.columns) and (df[col].dtype != dtype)}
+    return df.astype(changed) if len(changed) > 0 else df
+
+
+def compact_descr(sleep_descr_df):
+    # descriptions archived before the Mon_Day column existed get it added.
+    # It's always the last column, like update_garmin_sleep.session_features
+    # adds it, also in descriptions written with it elsewhere
+    if "Mon_Day" not in sleep_descr_df.columns:
+        sleep_descr_df = sleep_descr_df.assign(Mon_Day=seasonal.season_days(sleep_descr_df["Prev_Day"]))
+    elif sleep_descr_df.columns[-1] != "Mon_Day":
+        sleep_descr_df = sleep_descr_df[[col for col in sleep_descr_df.columns if col != "Mon_Day"] + ["Mon_Day"]]
+    return _downcast(sleep_descr_df, descr_dtypes)
+
+
+def wide_events(all_df):
+    # the events of sessions with Sleep_Session_ID, Bed_Time/ToD and Wake_Time/ToD columns
+    all_df = all_df.reset_index(drop=True)
+    event_df = pd.DataFrame({
+        "Sleep_Session_ID": all_df["Sleep_Session_ID"],
+        "Asleep_Time": all_df["Bed_Time"],
+        "Asleep_ToD": all_df["Bed_ToD"],
+        "Wake_Time": all_df["Wake_Time"],
+        "Wake_ToD": all_df["Wake_ToD"]
+    }, columns=event_cols)
+    return _downcast(event_df, event_dtypes)
+
+
+def compact_events(sleep_descr_df, sleep_event_df):
+    """
+    Return the wide event frame of sleep_event_df, aligned with the rows of
+    sleep_descr_df.  Frames which are already wide are only downcast.
+    """
+    if "Event" not in sleep_event_df.columns:
+        return _downcast(sleep_event_df, event_dtypes)
+
+    # long layout: one row per session and event
+    session_ids = sleep_descr_df["Sleep_Session_ID"].values
+    event_df = pd.DataFrame({"Sleep_Session_ID": session_ids}, columns=event_cols)
+    for event, prefix in [("Fell Asleep", "Asleep"), ("Woke Up", "Wake")]:
+        rows_df = sleep_event_df[sleep_event_df["Event"] == event]. \
+            drop_duplicates("Sleep_Session_ID").set_index("Sleep_Session_ID")
+        event_df[prefix + "_Time"] = rows_df["DateTime"].reindex(session_ids).reset_index(drop=True)
+        event_df[prefix + "_ToD"] = rows_df["ToD"].reindex(session_ids).values
+    return _downcast(event_df, event_dtypes)
+
+
+def hover_times(times):
+    """
+    Return local wall clock times as ISO strings, to be shown with a
+    hovertemplate like "%{text|" + event_time_format + "}".
+    """
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_localize(None)
+    iso = np.datetime_as_string(times.values, unit="s")
+    return np.where(pd.isnull(times.values), None, iso)
+
+
+def memory_report(before_df, after_df):
+    """
+    Return the bytes held by each column of before_df and after_df (e.g. an
+    artifact in its old and compact schema), with a total row.
+    """
+    report_df = pd.DataFrame({
+        "before": before_df.memory_usage(index=False, deep=True),
+        "after": after_df.memory_usage(index=False, deep=True)
+    })
+    report_df.loc["total"] = report_df.sum()
+    return report_df
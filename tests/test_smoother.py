@@ -0,0 +1,57 @@
+"""
+Equivalence tests of the numpy smoothing engine with the statsmodels
+reference engine (see smoother), on daily series with and without missing
+nights, and on series the numpy engine passes on to statsmodels.
+"""
+# import installed packages
+import numpy as np
+import pytest
+
+# import local modules
+import smoother
+
+pytest.importorskip("statsmodels")
+
+
+def series(x):
+    # times of day in hours with a seasonal swing, and some missing values
+    rng = np.random.default_rng(len(x))
+    y = 7 + np.sin(2*np.pi*x/365) + rng.normal(0, 0.5, len(x))
+    y[rng.random(len(x)) < 0.02] = np.nan
+    return y
+
+
+def regular_x():
+    # every night of six years
+    return np.arange(1, 6*365 + 1, dtype=float)
+
+
+def irregular_x():
+    # every night of six years, but missing nights, week-long gaps and a
+    # sparse stretch of every 3rd night
+    rng = np.random.default_rng(1)
+    x = np.arange(1, 6*365 + 1, dtype=float)
+    keep = (rng.random(len(x)) > 0.1) & ~((x > 400) & (x < 407)) & ~((x > 1000) & (x < 1012))
+    keep &= ~((x > 1500) & (x < 1700) & (x % 3 != 0))
+    return x[keep]
+
+
+@pytest.mark.parametrize("make_x", [regular_x, irregular_x])
+@pytest.mark.parametrize("frac", [0.04, 0.2])
+def test_numpy_matches_statsmodels(make_x, frac):
+    x = make_x()
+    y = series(x)
+    keep = ~np.isnan(y)
+    ref = smoother.lowess_statsmodels(y[keep], x[keep], frac)
+    fit = smoother.lowess_numpy(y, x, frac)
+    assert fit.shape == ref.shape
+    np.testing.assert_array_equal(fit[:, 0], ref[:, 0])
+    np.testing.assert_allclose(fit[:, 1], ref[:, 1], rtol=0, atol=1e-9)
+
+
+def test_non_integer_x_falls_back_to_statsmodels():
+    x = np.sort(np.random.default_rng(2).uniform(0, 365, 300))
+    y = series(x)
+    y[np.isnan(y)] = 7
+    np.testing.assert_array_equal(smoother.lowess_numpy(y, x, 0.2),
+                                  smoother.lowess_statsmodels(y, x, 0.2))
@@ -22,19 +22,21 @@ The data update process hs been broken into steps so that progress can be passed
 to the Dash app.
 """
 # import base packages
-import datetime, json, os, re, sys
+import datetime, json, os, re, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
-from os.path import isfile
+from urllib.parse import urlparse
 
 # import installed packages
-import pytz, requests, chardet, brotli
+# (the browser, HTTP and decoding packages are imported by the steps which use
+# them, so the steps which only process archived data start quickly)
+import pytz
 import numpy as np
 import pandas as pd
 from pandas.tseries.holiday import USFederalHolidayCalendar as calendar
-from seleniumwire import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.support.ui import WebDriverWait
+
+# import local modules
+import column_store, data_cache, date_archive, fit_cache, seasonal, sleep_schema, solar
 
 # input variables
 if os.name == "nt":
@@ -57,18 +59,77 @@ garmin_results_csv_fn = "data/garmin_sleep_df.csv"  # name of csv file to archiv
 all_descr_results_fn = "data/all_sleep_descr_df.pkl" # name of pickle file combining all Garmin & Microsift sleep session description data
 all_event_results_fn = "data/all_sleep_event_df.pkl" # name of pickle file combining all Garmin & Microsoft event data
 sun_pkl_fn = "data/sun_df.pkl" # name of pickel file to archive sunrise/sunset data
+step3_state_fn = "data/step3_state.json" # name of json file describing the inputs of the last step3
+ms_activity_fns = ["data/Activity_Summary_20150101_20151231.csv",
+                   "data/Activity_Summary_20160101_20161231.csv",
+                   "data/Activity_Summary_20170101_20171231.csv"] # microsoft smartwatch sleep data
 local_tz = "US/Eastern" # pytz local timezone for sunrise/sunset time conversion
 sun_lat = 39.76838 # latitude where sunrise/sunset times are derived from
 sun_lon = -86.15804 # longitude where sunrise/sunset times are derived from
+sun_source = "noaa" # "noaa" computes sunrise/sunset offline, "api" requests each date from sunrise-sunset.org
+sun_validation_dates = 0 # if > 0, step4 spot checks this many computed dates against sunrise-sunset.org
+sun_validation_minutes = 2 # largest difference (minutes) of the spot check which isn't reported as a mismatch
 run_browser_headless = False  # will hide Firefox during execution if True
 browser_action_timeout = 60  # max time (seconds) for browser wait operations
 start_date = '2017-03-01'  # first date to pull sleep data
 end_date = str(datetime.date.today() - datetime.timedelta(days=1))  # last date to pull sleep data
-user_name = "email address"  # Garmin username
-password = "password"  # Garmin password
+user_name = None  # Garmin username, set by sync_jobs from the user's account (see user_store)
+password = None  # Garmin password, set along with user_name
 signin_url = "https://connect.garmin.com/signin/"  # Garmin sign-in webpage
 sleep_url_base = "https://connect.garmin.com/modern/sleep/"  # Garmin sleep base URL (sans date)
 sleep_url_json_req = "https://connect.garmin.com/modern/proxy/wellness-service/wellness/dailySleepsByDate"
+sun_url_json_req = "https://api.sunrise-sunset.org/json"  # sunrise-sunset.org API URL, used if sun_source is "api"
+download_workers = 4  # max number of Garmin windows downloaded at once
+download_rate_limit = 2.  # max number of requests started per second, per host
+download_retries = 3  # max number of retries of a failed request
+download_backoff = 1.  # wait (seconds) before the first retry, doubled for each further retry
+
+
+# keep-alive session shared by all download threads, and the earliest time
+# the next request may be sent to each host
+_session = None
+_session_lock = threading.Lock()
+_next_request_time = {}
+
+
+def get_session():
+    global _session
+    import requests
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=download_workers)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def wait_for_rate_limit(url):
+    # space out the start of requests to the same host
+    host = urlparse(url).netloc
+    with _session_lock:
+        now = time.monotonic()
+        start_time = max(now, _next_request_time.get(host, now))
+        _next_request_time[host] = start_time + 1/download_rate_limit
+    time.sleep(start_time - now)
+
+
+def get_with_retries(url, **kwargs):
+    # retry connection errors, rate limiting and server errors with exponential backoff
+    import requests
+    for attempt in range(download_retries + 1):
+        wait_for_rate_limit(url)
+        try:
+            response = get_session().get(url, **kwargs)
+            if (response.status_code != 429) & (response.status_code < 500):
+                return response
+        except requests.exceptions.ConnectionError:
+            if attempt == download_retries:
+                raise
+        if attempt < download_retries:
+            time.sleep(download_backoff*2**attempt)
+    return response
 
 
 def download(start_date, end_date, headers, session_id):
@@ -78,7 +139,7 @@ def download(start_date, end_date, headers, session_id):
         ('_', session_id),
     )
 
-    response = requests.get(sleep_url_json_req, headers=headers, params=params)
+    response = get_with_retries(sleep_url_json_req, headers=headers, params=params)
     if response.status_code != 200:
         print("RESPONSE ERROR RECEIVED:")
         print('Status code: %d' % response.status_code)
@@ -89,6 +150,7 @@ def download(start_date, end_date, headers, session_id):
 
 
 def download_to_json(start_date, end_date, headers, session_id):
+    import brotli, chardet
     response = download(start_date, end_date, headers, session_id)
 
     # most responses are in ascii (no encoding)
@@ -98,65 +160,79 @@ def download_to_json(start_date, end_date, headers, session_id):
     if chardet.detect(response.content)["encoding"] == 'ascii':
         return json.loads(response.content)
     else:
-        return brotli.decompress(response.content)
-    
+        return json.loads(brotli.decompress(response.content))
 
-def converter(data, return_df=True):
-    # define functions which pass through None value because
-    # datetime functions don't accept value None
-    def sleep_timestamp(val):
-        if val is None:
-            return None
-        else:
-            return datetime.datetime.fromtimestamp(val / 1000, pytz.utc)
-    
 
-    def sleep_timedelta(val):
-        if val is None:
-            return None
-        else:
-            return datetime.timedelta(seconds=val)
+def download_windows(periods_ls, headers, session_id):
+    # download the json of each (start, end) period concurrently,
+    # returning them in the order of periods_ls
+    def download_period(period):
+        print("Getting data for period: [%s, %s]" % period)
+        return download_to_json(period[0], period[1], headers, session_id)
 
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        return list(executor.map(download_period, periods_ls))
+
+
+# Garmin json field behind each converter() column
+converter_fields = [
+    ("Bed_Time", "sleepStartTimestampGMT"),
+    ("Wake_Time", "sleepEndTimestampGMT"),
+    ("Awake_Dur", "awakeSleepSeconds"),
+    ("Light_Dur", "lightSleepSeconds"),
+    ("Deep_Dur", "deepSleepSeconds"),
+    ("Total_Dur", "sleepTimeSeconds"),
+    ("Nap_Dur", "napTimeSeconds")
+]
+
+
+def converter(data, return_df=True):
+    # extract each field of every night into its own array in one pass,
+    # None values become NaN and then NaT
+    fields = {col: np.array([d.get(key) for d in data], dtype=float)
+              for col, key in converter_fields}
+    calendar_dates = [d['calendarDate'] for d in data]
+    window_confirmed = [d.get('sleepWindowConfirmed') for d in data]
+
+    # convert whole columns at once, timestamps are in ms and durations in seconds
+    nights = pd.DataFrame({
+        "Prev_Day": pd.to_datetime(calendar_dates, format="%Y-%m-%d") - pd.Timedelta(days=1),
+        "Bed_Time": pd.to_datetime(fields["Bed_Time"], unit="ms", utc=True),
+        "Wake_Time": pd.to_datetime(fields["Wake_Time"], unit="ms", utc=True),
+        "Awake_Dur": pd.to_timedelta(fields["Awake_Dur"], unit="s"),
+        "Light_Dur": pd.to_timedelta(fields["Light_Dur"], unit="s"),
+        "Deep_Dur": pd.to_timedelta(fields["Deep_Dur"], unit="s"),
+        "Total_Dur": pd.to_timedelta(fields["Total_Dur"], unit="s"),
+        "Nap_Dur": pd.to_timedelta(fields["Nap_Dur"], unit="s"),
+        "Window_Conf": pd.Series(window_confirmed, dtype=object)
+    })
 
-    # initialize variables
     if return_df:
-        nights = pd.DataFrame(columns=["Prev_Day", "Bed_Time", "Wake_Time",
-                                       "Awake_Dur", "Light_Dur", "Deep_Dur", 
-                                       "Total_Dur", "Nap_Dur", "Window_Conf"])
-        i = 0
+        return nights
     else:
-        nights = []
-    
-    for d in data:
-        bed_time = sleep_timestamp(d['sleepStartTimestampGMT'])
-        wake_time = sleep_timestamp(d['sleepEndTimestampGMT'])
-        previous_day = datetime.date(*[int(datepart) for datepart in d['calendarDate'].split('-')]) - datetime.timedelta(days=1)
-        deep_duration = sleep_timedelta(d['deepSleepSeconds'])
-        light_duration = sleep_timedelta(d['lightSleepSeconds'])
-        total_duration = sleep_timedelta(d['sleepTimeSeconds'])
-        awake_duration = sleep_timedelta(d['awakeSleepSeconds'])
-        nap_duration = sleep_timedelta(d['napTimeSeconds'])
-        window_confirmed = d['sleepWindowConfirmed']
-
-        if return_df:
-            nights.loc[i] = [previous_day, bed_time, wake_time, awake_duration, 
-                             light_duration, deep_duration, total_duration, 
-                             nap_duration, window_confirmed]
-            i += 1
-        else:
-            night = Night(bed_time, wake_time, previous_day, deep_duration, 
-                          light_duration, total_duration, awake_duration)
-            nights.append(night, sort=True)
-    
-    return nights
+        # one dict per night
+        return nights.to_dict("records")
 
 
 # this function returns a list of all dates in [date1, date2]
 def daterange(date1, date2):
-    date_ls = [date1]
-    for n in range(int((date2 - date1).days)):
-        date_ls.append(date_ls[-1] + datetime.timedelta(days=1))
-    return date_ls
+    # dates keep the type of date1, i.e. datetime.date or pandas Timestamp
+    days = pd.date_range(date1, date2, freq="D")
+    if isinstance(date1, datetime.datetime):
+        return list(days)
+    return list(days.date)
+
+
+# this function returns the rows to be added to df for the given days which
+# are missing from its Prev_Day column, as nights without any sleep data
+def missing_days_df(df, days, as_dates=False):
+    days = pd.DatetimeIndex(days)
+    days = days[~days.isin(pd.to_datetime(df["Prev_Day"]))]
+
+    # an empty copy of df reindexed to the new rows keeps each column's dtype
+    fill_df = df.iloc[:0].reset_index(drop=True).reindex(range(len(days)))
+    fill_df["Prev_Day"] = days.date if as_dates else days
+    return fill_df
 
 
 # steps to updating sleep data:
@@ -173,21 +249,10 @@ def step0():
         datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
     )
 
-    # Look for previous results
-    if isfile(proj_path + garmin_results_pkl_fn):
-        nights_df = pd.read_pickle(proj_path + garmin_results_pkl_fn)
-    else:
-        nights_df = pd.DataFrame()
-
-    # if previous results were found, reduce requested dates to those not yet obtained
-    if len(nights_df) > 0:
+    # reduce requested dates to those not yet obtained
+    nights_archive = date_archive.DateArchive(garmin_results_pkl_fn, "Prev_Day", proj_path)
+    new_req_dates_ls = nights_archive.missing(req_dates_ls)
 
-        # get list of requested dates not yet obtained 
-        archive_dates_ls = list(nights_df["Prev_Day"])
-        new_req_dates_ls = np.setdiff1d(req_dates_ls, archive_dates_ls)
-    else:
-        new_req_dates_ls = req_dates_ls
-    
     #print("Archive max: ", max(archive_dates_ls))
     #print("Request max: ", max(req_dates_ls))
     if len(new_req_dates_ls) == 0:
@@ -195,10 +260,15 @@ def step0():
 
     else:
         msg = "Current data was checked and " + str(len(new_req_dates_ls)) + " night(s) are needed"
-    return [msg, nights_df, new_req_dates_ls]
+    return [msg, nights_archive, new_req_dates_ls]
 
 
 def step1():
+    from seleniumwire import webdriver
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as ec
+    from selenium.webdriver.support.ui import WebDriverWait
+
     opts = webdriver.ChromeOptions()
     opts.add_argument('--disable-gpu')
     opts.add_argument('--no-sandbox')
@@ -278,7 +348,7 @@ def step2(request, new_req_dates_ls):
     # Garmin will throw error if request time span exceeds 32 days
     # therefore, request 32 days at a time
     max_period_delta = datetime.timedelta(days=31)
-    data = []  # list of jsons, one per time period
+    periods_ls = []  # list of (start, end) dates, one per time period
     get_dates_ls = new_req_dates_ls
     while len(get_dates_ls) > 0:
         period_start = min(get_dates_ls)
@@ -290,12 +360,14 @@ def step2(request, new_req_dates_ls):
         # note, this may request some dates which were already obtained
         # since a contiguous period is being requested rather than 32 new dates
         # duplicated dates will be dropped later
-        print("Getting data for period: [%s, %s]" % (period_start, period_end))
-        data.append(download_to_json(period_start, period_end, headers, session_id))
+        periods_ls.append((period_start, period_end))
 
         # trim dates list
         get_dates_ls = [d for d, s in zip(get_dates_ls, np.array(get_dates_ls) > period_end) if s]
 
+    # download all periods at once, getting a list of jsons, one per time period
+    data = download_windows(periods_ls, headers, session_id)
+
     # combine list of jsons into one large json
     data = list(chain.from_iterable(data))
 
@@ -307,55 +379,7 @@ def step2(request, new_req_dates_ls):
     return [msg, data]
 
 
-def step3(nights_df, data, new_req_dates_ls):
-    # clean the new garmin data
-    new_nights_df = converter(data)
-    new_nights_df["Prev_Day"] = pd.to_datetime(new_nights_df["Prev_Day"])
-    if pd.to_datetime(new_nights_df["Bed_Time"]).dt.tz is None:
-        new_nights_df["Bed_Time"] = pd.to_datetime(new_nights_df["Bed_Time"]). \
-            dt.tz_localize(local_tz)
-    else:
-        new_nights_df["Bed_Time"] = pd.to_datetime(new_nights_df["Bed_Time"]). \
-            dt.tz_convert(local_tz)
-    if pd.to_datetime(new_nights_df["Wake_Time"]).dt.tz is None:
-        new_nights_df["Wake_Time"] = pd.to_datetime(new_nights_df["Wake_Time"]). \
-            dt.tz_localize(local_tz)
-    else:
-        new_nights_df["Wake_Time"] = pd.to_datetime(new_nights_df["Wake_Time"]). \
-            dt.tz_convert(local_tz)
-    new_nights_df["Light_Dur"] = pd.to_timedelta(new_nights_df["Light_Dur"], "days")
-    new_nights_df["Deep_Dur"] = pd.to_timedelta(new_nights_df["Deep_Dur"], "days")
-    new_nights_df["Total_Dur"] = pd.to_timedelta(new_nights_df["Total_Dur"], "days")
-    new_nights_df["Nap_Dur"] = pd.to_timedelta(new_nights_df["Nap_Dur"], "days")
-
-    # fill df with missing dates so that subsequent updates won't keep
-    # requesting data which Garmin doesn't have
-    new_missing_dates_ls = np.setdiff1d(new_req_dates_ls, new_nights_df["Prev_Day"].dt.date)
-    new_missing_row = [pd.NaT, pd.NaT, pd.NaT, pd.NaT, pd.NaT, pd.NaT, pd.NaT, np.NAN]
-    for d in new_missing_dates_ls:
-        new_nights_df.loc[len(new_nights_df)] = [d] + new_missing_row
-
-    # drop any nights which were already in the archived pickle file,
-    # then merge it with archived data
-    if len(nights_df) > 0:
-        new_nights_df = new_nights_df[~new_nights_df["Prev_Day"].isin(nights_df["Prev_Day"])]
-        nights_df = nights_df.append(new_nights_df, sort=True).sort_values("Prev_Day", axis=0)
-    else:
-        nights_df = new_nights_df.sort_values("Prev_Day", axis=0)
-    
-    # trim most recent nights which have NaT durations because they were likely caused
-    # by the smartwatch not yet having synced with Garmin for those dates
-    unknown_nights_ls = []
-    i = 1
-    while pd.isnull(nights_df.Total_Dur.iloc[-i]) & (len(nights_df) >= i):
-        unknown_nights_ls.append(nights_df.Prev_Day.iloc[-i])
-        i += 1
-    nights_df = nights_df[~nights_df["Prev_Day"].isin(unknown_nights_ls)]
-
-    # save merged results
-    #nights_df.to_csv(proj_path + garmin_results_csv_fn)
-    nights_df.to_pickle(proj_path + garmin_results_pkl_fn)
-
+def garmin_dashboard_df(nights_df):
     # clean garmin data for dashboard
     garmin_df = nights_df.drop(["Nap_Dur", "Window_Conf"], axis=1)
 
@@ -363,23 +387,34 @@ def step3(nights_df, data, new_req_dates_ls):
     garmin_df["Bed_ToD"] = garmin_df["Bed_Time"].dt.hour + garmin_df["Bed_Time"].dt.minute/60
     garmin_df["Bed_ToD"] -= 24*(garmin_df["Bed_ToD"] > 12) # make PM bed times negative
     garmin_df["Wake_ToD"] = garmin_df["Wake_Time"].dt.hour + garmin_df["Wake_Time"].dt.minute/60
+    return garmin_df
+
 
+def microsoft_df():
     # read & wrangle old microsoft sleep data
-    ms2015_df = pd.read_csv(proj_path + "data/Activity_Summary_20150101_20151231.csv")
-    ms2016_df = pd.read_csv(proj_path + "data/Activity_Summary_20160101_20161231.csv")
-    ms2017_df = pd.read_csv(proj_path + "data/Activity_Summary_20170101_20171231.csv")
-    ms_df = ms2015_df.append(ms2016_df).append(ms2017_df, sort=True). \
-        query("Event_Type == 'Sleep'")
+    if all(os.path.isfile(proj_path + fn) for fn in ms_activity_fns):
+        ms2015_df = pd.read_csv(proj_path + ms_activity_fns[0])
+        ms2016_df = pd.read_csv(proj_path + ms_activity_fns[1])
+        ms2017_df = pd.read_csv(proj_path + ms_activity_fns[2])
+        ms_df = ms2015_df.append(ms2016_df).append(ms2017_df, sort=True). \
+            query("Event_Type == 'Sleep'")
+    else:
+        # only my own project dir has microsoft data, other users only have Garmin data
+        ms_df = pd.DataFrame({col: pd.Series(dtype=float) for col in [
+            "Date", "Start_Time", "Wake_Up_Time", "Seconds_Asleep_Light",
+            "Seconds_Asleep_Restful", "Seconds_Awake"]})
     ms2_df = pd.DataFrame()
 
     # create microsoft dataframe which mimics the garmin dataframe
     ms2_df["Prev_Day"] = pd.to_datetime(ms_df["Date"])
     ms2_df["Bed_Time"] = pd.to_datetime(ms_df["Start_Time"]). \
         dt.tz_localize("US/Eastern", ambiguous="NaT")
-    for i_row in range(len(ms2_df)-1): 
-        # fell asleep after midnght, adjust Prev_Day back 1 day
-        if ms2_df.iloc[i_row, 1].hour < 12:
-            ms2_df.iloc[i_row, 0] -= datetime.timedelta(days=1)
+    # fell asleep after midnght, adjust Prev_Day back 1 day
+    # (the last row has never been adjusted, which the archived frames reflect)
+    after_midnight = (ms2_df["Bed_Time"].dt.hour < 12).values
+    after_midnight[-1:] = False
+    ms2_df["Prev_Day"] = ms2_df["Prev_Day"].values - \
+        np.where(after_midnight, np.timedelta64(1, "D"), np.timedelta64(0, "D"))
     ms2_df["Wake_Time"] = pd.to_datetime(ms_df["Wake_Up_Time"]). \
         dt.tz_localize("US/Eastern", ambiguous="NaT")
     ms2_df["Light_Dur"] = pd.to_timedelta(ms_df["Seconds_Asleep_Light"], "seconds")
@@ -396,29 +431,22 @@ def step3(nights_df, data, new_req_dates_ls):
     unknown_dur_bool = pd.isnull(ms2_df["Total_Dur"])
     nap_bool = brief_sleep_bool & daytime_asleep_bool
     ms3_df = ms2_df.loc[~nap_bool & ~unknown_dur_bool, :]
+    return ms3_df
 
-    # combine garmin and microsoft data
-    all_df = garmin_df.append(ms3_df, sort=True)
-    all_df["Prev_Day"] = pd.to_datetime(all_df["Prev_Day"])
 
-    # fill in missing days between first and last days in combined dataset
-    complete_dates_ls = daterange(min(all_df["Prev_Day"]), max(all_df["Prev_Day"]))
-    missing_dates_ls = np.setdiff1d(complete_dates_ls, all_df["Prev_Day"].dt.date)
-    for date in missing_dates_ls:
-        all_df.loc[len(all_df)] = [pd.NaT, pd.NaT, np.NAN, pd.NaT, pd.NaT, date, \
-                                    pd.NaT, pd.NaT, np.NAN]
+def fill_missing_days(all_df, first_day, last_day):
+    # fill in missing days between first and last days (inclusive), which
+    # are added as nights without any sleep data
+    fill_df = missing_days_df(all_df, pd.date_range(first_day, last_day, freq="D"))
+    all_df = pd.concat([all_df, fill_df], ignore_index=True)
+    all_df["Prev_Day"] = pd.to_datetime(all_df["Prev_Day"])
     all_df = all_df.sort_values("Prev_Day").reset_index(drop=True)
+    return all_df
 
-    # split data into an event dataframe (with start and stop datetime info) 
-    # and sleep description dataframe, with durations, etc.  Each sleep
-    # session will be tracked with a new ID in case info needs to be joined again
-    all_df["Sleep_Session_ID"] = list(range(len(all_df)))
-    all_descr_df = all_df.loc[:, ["Sleep_Session_ID", "Prev_Day", "Awake_Dur",
-                                "Light_Dur", "Deep_Dur", "Total_Dur"]]
-    all_event_df = all_df.loc[:, ["Sleep_Session_ID", "Prev_Day", "Bed_Time",
-                                "Bed_ToD", "Wake_Time", "Wake_ToD"]]
 
-    # add features to descr_df: day of week, year,  is_holiday, is_workday
+def session_features(all_descr_df, first_day, last_day):
+    # add features to descr_df: day of week, year, day of the annual tab's
+    # dummy year, is_holiday, is_workday, where the holiday calendar spans [first_day, last_day]
     all_descr_df["Year"] = all_descr_df["Prev_Day"].dt.year
     all_descr_df["Day"] = all_descr_df["Prev_Day"].dt.weekday.astype(str)
     day_map = {
@@ -433,8 +461,7 @@ def step3(nights_df, data, new_req_dates_ls):
     all_descr_df["Day"] = all_descr_df["Day"].map(day_map).astype("category")
 
     # Get standard US holidays
-    holidays = calendar().holidays(start=min(all_descr_df["Prev_Day"]),
-                                end=max(all_descr_df["Prev_Day"]))
+    holidays = calendar().holidays(start=first_day, end=last_day)
 
     # add day after thanksgiving
     nov_holidays = holidays[holidays.month == 11]
@@ -445,7 +472,6 @@ def step3(nights_df, data, new_req_dates_ls):
     # remove presidents day (feb), columbus day (oct), veterans day (nov)
     holidays = holidays[(holidays.month != 2) & (holidays.month != 10)]
     holidays = holidays[~ ((holidays.month == 11) & (holidays.day < 20))]
-    holidays_prev_day = holidays - datetime.timedelta(days=1)
     all_descr_df["Is_Holiday"] = all_descr_df["Prev_Day"].isin(holidays)
     is_weekend_bool = all_descr_df["Day"].isin(["Friday", "Saturday"])
     all_descr_df.loc[is_weekend_bool, "Is_Holiday"] = False
@@ -460,8 +486,6 @@ def step3(nights_df, data, new_req_dates_ls):
     # adding current layoff
     end_dt_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
     start_dt_date = datetime.date(2019, 10, 28)
-    layoff_days = ((end_dt_date - start_dt_date) + datetime.timedelta(days=1)).days
-    layoff_ls = [start_dt_date + datetime.timedelta(days=x) for x in range(layoff_days)]
     layoff_series = pd.date_range(start_dt_date, end_dt_date)
     vacay = vacay.append(layoff_series)
 
@@ -470,92 +494,252 @@ def step3(nights_df, data, new_req_dates_ls):
                                     (all_descr_df["Prev_Day"].isin(vacay)))
     all_descr_df.loc[is_weekend_bool, "Is_Workday"] = False
 
-    # reshape event df so each event is a separate row
-    all_event_dt_df = pd.melt(all_df, id_vars=["Sleep_Session_ID", "Prev_Day"], 
-                            value_vars=["Bed_Time", "Wake_Time"],
-                            value_name="DateTime", var_name="Event")
-    all_event_dt_df = all_event_dt_df.replace("Bed_Time", "Fell Asleep"). \
-                    replace("Wake_Time", "Woke Up")
-    all_event_tod_df = pd.melt(all_df, id_vars=["Sleep_Session_ID", "Prev_Day"], 
-                            value_vars=["Bed_ToD", "Wake_ToD"], 
-                            value_name="ToD", var_name="Event")
-    all_event_tod_df = all_event_tod_df.replace("Bed_ToD", "Fell Asleep"). \
-                    replace("Wake_ToD", "Woke Up")
-    all_event_df = pd.merge(all_event_dt_df, all_event_tod_df). \
-        sort_values(["Sleep_Session_ID", "Event"]).reset_index(drop=True)
-    all_event_df["DateTimeStr"] = all_event_df["DateTime"]. \
-        dt.strftime('%B %d, %Y, %r')
-
-    # write cleaned dataframes to project dir
-    all_descr_df.to_pickle(proj_path + all_descr_results_fn)
-    all_event_df.to_pickle(proj_path + all_event_results_fn)
+    # the annual tab's dummy year dates, last like sleep_schema.compact_descr
+    # adds them to descriptions archived without them
+    all_descr_df["Mon_Day"] = seasonal.season_days(all_descr_df["Prev_Day"])
+    return all_descr_df
+
+
+def split_sessions(all_df, first_session_id=0):
+    # split data into an event dataframe (with the fell asleep and woke up times,
+    # see sleep_schema) and sleep description dataframe, with durations, etc.  Each
+    # sleep session will be tracked with a new ID in case info needs to be joined again
+    all_df["Sleep_Session_ID"] = list(range(first_session_id, first_session_id + len(all_df)))
+    all_descr_df = all_df.loc[:, ["Sleep_Session_ID", "Prev_Day", "Awake_Dur",
+                                "Light_Dur", "Deep_Dur", "Total_Dur"]]
+    all_event_df = sleep_schema.wide_events(all_df)
+    return all_descr_df, all_event_df
+
+
+def rebuild_frames(garmin_df):
+    # combine garmin and microsoft data
+    all_df = garmin_df.append(microsoft_df(), sort=True)
+    all_df["Prev_Day"] = pd.to_datetime(all_df["Prev_Day"])
+    first_day = min(all_df["Prev_Day"])
+    all_df = fill_missing_days(all_df, first_day, max(all_df["Prev_Day"]))
+    complete_dates_ls = daterange(first_day, max(all_df["Prev_Day"]))
+
+    all_descr_df, all_event_df = split_sessions(all_df)
+    all_descr_df = session_features(all_descr_df, first_day, max(all_descr_df["Prev_Day"]))
+    return sleep_schema.compact_descr(all_descr_df), all_event_df, complete_dates_ls
+
+
+def step3_inputs_state(nights_df, last_day):
+    # describes the historical inputs of the derived frames: the microsoft
+    # csv files and the garmin nights up to the last derived day
+    return {
+        "ms_stamps": [column_store.source_stamp(proj_path + fn) if os.path.isfile(proj_path + fn)
+                      else None for fn in ms_activity_fns],
+        "n_garmin_nights": int((pd.to_datetime(nights_df["Prev_Day"]) <= last_day).sum()),
+        "last_day": str(last_day.date())
+    }
+
+
+def can_update_incrementally(nights_df):
+    # the derived frames can be extended if they were written by the last
+    # step3 and none of their historical inputs have changed since
+    try:
+        with open(proj_path + step3_state_fn, "r") as fp:
+            state = json.load(fp)
+        frame_stamps = [column_store.source_stamp(proj_path + all_descr_results_fn),
+                        column_store.source_stamp(proj_path + all_event_results_fn)]
+    except (OSError, ValueError):
+        return False
+    if frame_stamps != state["frame_stamps"]:
+        return False
+    last_day = pd.Timestamp(state["inputs"]["last_day"])
+    return state["inputs"] == step3_inputs_state(nights_df, last_day)
+
+
+def step3(nights_archive, data, new_req_dates_ls):
+    # clean the new garmin data
+    new_nights_df = converter(data)
+    new_nights_df["Prev_Day"] = pd.to_datetime(new_nights_df["Prev_Day"])
+    if pd.to_datetime(new_nights_df["Bed_Time"]).dt.tz is None:
+        new_nights_df["Bed_Time"] = pd.to_datetime(new_nights_df["Bed_Time"]). \
+            dt.tz_localize(local_tz)
+    else:
+        new_nights_df["Bed_Time"] = pd.to_datetime(new_nights_df["Bed_Time"]). \
+            dt.tz_convert(local_tz)
+    if pd.to_datetime(new_nights_df["Wake_Time"]).dt.tz is None:
+        new_nights_df["Wake_Time"] = pd.to_datetime(new_nights_df["Wake_Time"]). \
+            dt.tz_localize(local_tz)
+    else:
+        new_nights_df["Wake_Time"] = pd.to_datetime(new_nights_df["Wake_Time"]). \
+            dt.tz_convert(local_tz)
+    new_nights_df["Light_Dur"] = pd.to_timedelta(new_nights_df["Light_Dur"], "days")
+    new_nights_df["Deep_Dur"] = pd.to_timedelta(new_nights_df["Deep_Dur"], "days")
+    new_nights_df["Total_Dur"] = pd.to_timedelta(new_nights_df["Total_Dur"], "days")
+    new_nights_df["Nap_Dur"] = pd.to_timedelta(new_nights_df["Nap_Dur"], "days")
+
+    # fill df with missing dates so that subsequent updates won't keep
+    # requesting data which Garmin doesn't have
+    fill_df = missing_days_df(new_nights_df, pd.to_datetime(list(new_req_dates_ls)), as_dates=True)
+    new_nights_df = pd.concat([new_nights_df, fill_df], ignore_index=True)
+
+    # drop any nights which were already archived
+    new_nights_df = new_nights_df[~nights_archive.contains(new_nights_df["Prev_Day"])]
+    new_nights_df = new_nights_df.sort_values("Prev_Day", axis=0).sort_index(axis=1)
+
+    # trim most recent nights which have NaT durations because they were likely caused
+    # by the smartwatch not yet having synced with Garmin for those dates
+    last_date = nights_archive.last_date()
+    if last_date is None:
+        is_recent = np.ones(len(new_nights_df), dtype=bool)
+    else:
+        is_recent = (pd.to_datetime(new_nights_df["Prev_Day"]) > last_date).values
+    is_known = ~(pd.isnull(new_nights_df["Total_Dur"]) & is_recent).values
+    new_nights_df = new_nights_df[np.maximum.accumulate(is_known[::-1])[::-1]]
+
+    # append the new nights to the archive
+    nights_archive.upsert(new_nights_df)
+    nights_archive.save()
+    nights_df = nights_archive.df
+
+    garmin_df = garmin_dashboard_df(nights_df)
+    garmin_df["Prev_Day"] = pd.to_datetime(garmin_df["Prev_Day"])
+
+    # the derived frames only need the new nights if the history is unchanged
+    if can_update_incrementally(nights_df):
+        old_descr_df = sleep_schema.compact_descr(column_store.load(all_descr_results_fn, proj_path))
+        old_event_df = sleep_schema.compact_events(
+            old_descr_df, column_store.load(all_event_results_fn, proj_path))
+        first_day = min(old_descr_df["Prev_Day"])
+        last_day = max(old_descr_df["Prev_Day"])
+
+        # only transform the nights after the last derived day, which are
+        # appended to the derived frames with the following session IDs
+        new_df = garmin_df[garmin_df["Prev_Day"] > last_day].sort_index(axis=1)
+        if len(new_df) > 0:
+            new_df = fill_missing_days(new_df, last_day + datetime.timedelta(days=1),
+                                       max(new_df["Prev_Day"]))
+            new_descr_df, new_event_df = split_sessions(
+                new_df, old_descr_df["Sleep_Session_ID"].max() + 1)
+            new_descr_df = session_features(new_descr_df, first_day, max(new_df["Prev_Day"]))
+            all_descr_df = pd.concat([old_descr_df, new_descr_df], ignore_index=True)
+            all_descr_df["Day"] = all_descr_df["Day"].astype(str).astype("category")
+            all_descr_df = sleep_schema.compact_descr(all_descr_df)
+            all_event_df = sleep_schema.compact_events(
+                all_descr_df, pd.concat([old_event_df, new_event_df], ignore_index=True))
+        else:
+            all_descr_df, all_event_df = old_descr_df, old_event_df
+        complete_dates_ls = daterange(first_day, max(all_descr_df["Prev_Day"]))
+        changed = len(new_df) > 0
+    else:
+        all_descr_df, all_event_df, complete_dates_ls = rebuild_frames(garmin_df)
+        changed = True
+
+    if changed:
+        # write cleaned dataframes to project dir, with memory-mappable column copies
+        column_store.save(all_descr_df, all_descr_results_fn, proj_path)
+        column_store.save(all_event_df, all_event_results_fn, proj_path)
+
+        # precompute the overview's smoothed lines for every filter toggle combination
+        fit_cache.build_fit_cache(all_descr_df, all_event_df, proj_path)
+
+        # let the dashboard processes know that their cached frames are stale
+        data_cache.bump_generation(proj_path)
+
+    # remember what the derived frames were built from, for the next incremental update
+    last_day = max(all_descr_df["Prev_Day"])
+    state = {
+        "frame_stamps": [column_store.source_stamp(proj_path + all_descr_results_fn),
+                         column_store.source_stamp(proj_path + all_event_results_fn)],
+        "inputs": step3_inputs_state(nights_df, last_day)
+    }
+    with open(proj_path + step3_state_fn, "w") as fp:
+        json.dump(state, fp)
 
     msg = "Data has been transformed and merged with previous dataset"
     return [msg, all_descr_df, all_event_df, complete_dates_ls]
 
+
+def download_sun_times(dates_ls):
+    # get sunrise and sunset times for each date, one request per date
+    sun_df = pd.DataFrame(columns=["Date", "Sunrise", "Sunrise_ToD",
+                                   "Sunset", "Sunset_ToD"])
+    for i, w_date in enumerate(dates_ls):
+
+        # requestting sunrise & sunset times from https://sunrise-sunset.org/api
+        weather_params = {
+            "lat": sun_lat,
+            "lng": sun_lon,
+            "date": w_date.strftime(format="%Y-%m-%d"),
+            "formatted": 1
+        }
+        response = get_with_retries(sun_url_json_req, params=weather_params)
+        if response.status_code != 200:
+            print("RESPONSE ERROR RECEIVED:")
+            print('Status code: %d' % response.status_code)
+            response_dict = json.loads(response.content.decode('UTF-8'))
+            print('Content: %s' % response_dict["status"])
+            raise Exception
+        else:
+            sun_json = json.loads(response.text)
+
+            # extract times of day in UTC TZ from from response
+            sunrise = datetime.datetime.strptime(sun_json["results"]["sunrise"], "%I:%M:%S %p") #YMD are omitted from json
+            sunrise = sunrise.replace(year=w_date.year, month=w_date.month, day=w_date.day) #update with actual YMD
+            sunset = datetime.datetime.strptime(sun_json["results"]["sunset"], "%I:%M:%S %p")
+            sunset = sunset.replace(year=w_date.year, month=w_date.month, day=w_date.day)
+
+            # localize time to EDT
+            UTC_tz = pytz.timezone("UTC")
+            EDT_tz = pytz.timezone(local_tz)
+            sunrise = UTC_tz.localize(sunrise).astimezone(EDT_tz)
+            sunset = UTC_tz.localize(sunset).astimezone(EDT_tz)
+
+            # calculate time of day in hours from (-12, 12]
+            sunrise_tod = sunrise.hour + sunrise.minute/60
+            sunrise_tod -= 24*(sunrise_tod > 12)  # make PM times negative
+            sunset_tod = sunset.hour + sunset.minute/60
+            sunset_tod -= 24*(sunset_tod > 12)  # make PM times negative
+
+            # add row to df
+            sun_df.loc[len(sun_df)] = [w_date, sunrise, sunrise_tod, sunset, sunset_tod]
+    return sun_df
+
+
+def validate_sun_times(sun_df, n_dates=10):
+    """
+    Spot check computed sunrise/sunset times against sunrise-sunset.org for
+    n_dates evenly spaced dates of sun_df.  Returns the largest difference in
+    the time of day of either event, in minutes.
+    """
+    check_df = sun_df.iloc[np.unique(np.linspace(0, len(sun_df) - 1, n_dates).astype(int))]
+    api_df = download_sun_times(list(check_df["Date"]))
+    diff_ls = []
+    for col in ["Sunrise_ToD", "Sunset_ToD"]:
+        diff_ls.append(np.max(np.abs(check_df[col].values - api_df[col].values.astype(float))))
+    return 60*max(diff_ls)
+
+
 def step4(complete_dates_ls):
 
-    # get archived sunrise/sunset dataframe
-    if isfile(proj_path + sun_pkl_fn):
-        sun_df = pd.read_pickle(proj_path + sun_pkl_fn)
-    else:
-        sun_df = pd.DataFrame(columns=["Date", "Sunrise", "Sunrise_ToD",
-                                    "Sunset", "Sunset_ToD"])
-    # build new list of dates which omits dates already obtained
-    new_sun_dates_ls = []
-    if len(sun_df) > 0:
-        for n in complete_dates_ls:
-            if not sun_df.Date.isin([n]).any(axis=None):
-                new_sun_dates_ls.append(n)
-    else:
-        new_sun_dates_ls = complete_dates_ls
-    
-    if len(new_sun_dates_ls) > 0:
+    # get archived sunrise/sunset dataframe, and the dates it doesn't have yet
+    sun_archive = date_archive.DateArchive(sun_pkl_fn, "Date", proj_path, columns=[
+        "Date", "Sunrise", "Sunrise_ToD", "Sunset", "Sunset_ToD"])
+    new_sun_dates_ls = sun_archive.missing(pd.to_datetime(pd.Series(complete_dates_ls)))
 
-        # get sunrise and sunset times for each date
-        for i, w_date in enumerate(new_sun_dates_ls):
-
-            # requestting sunrise & sunset times from https://sunrise-sunset.org/api
-            weather_params = {
-                "lat": sun_lat,
-                "lng": sun_lon,
-                "date": w_date.strftime(format="%Y-%m-%d"),
-                "formatted": 1
-            }
-            response = requests.get("https://api.sunrise-sunset.org/json",
-                                    params=weather_params)
-            if response.status_code != 200:
-                print("RESPONSE ERROR RECEIVED:")
-                print('Status code: %d' % response.status_code)
-                response_dict = json.loads(response.content.decode('UTF-8'))
-                print('Content: %s' % response_dict["status"])
-                raise Exception
-            else:
-                sun_json = json.loads(response.text)
-
-                # extract times of day in UTC TZ from from response
-                sunrise = datetime.datetime.strptime(sun_json["results"]["sunrise"], "%I:%M:%S %p") #YMD are omitted from json
-                sunrise = sunrise.replace(year=w_date.year, month=w_date.month, day=w_date.day) #update with actual YMD
-                sunset = datetime.datetime.strptime(sun_json["results"]["sunset"], "%I:%M:%S %p")
-                sunset = sunset.replace(year=w_date.year, month=w_date.month, day=w_date.day)
-
-                # localize time to EDT
-                UTC_tz = pytz.timezone("UTC")
-                EDT_tz = pytz.timezone(local_tz)
-                sunrise = UTC_tz.localize(sunrise).astimezone(EDT_tz)
-                sunset = UTC_tz.localize(sunset).astimezone(EDT_tz)
-
-                # calculate time of day in hours from (-12, 12]
-                sunrise_tod = sunrise.hour + sunrise.minute/60
-                sunrise_tod -= 24*(sunrise_tod > 12)  # make PM times negative
-                sunset_tod = sunset.hour + sunset.minute/60
-                sunset_tod -= 24*(sunset_tod > 12)  # make PM times negative
-
-                # add row to df
-                sun_df.loc[len(sun_df)] = [w_date, sunrise, sunrise_tod, sunset, sunset_tod]
-
-    # this df takes along to make, so avoid rebuilding it
-    sun_df.to_pickle(proj_path + sun_pkl_fn)
-
-    msg = "New sunrise and sunset data has been downloaded"
-    return [msg, sun_df]
\ No newline at end of file
+    if len(new_sun_dates_ls) > 0:
+        if sun_source == "api":
+            new_sun_df = download_sun_times(new_sun_dates_ls)
+        else:
+            new_sun_df = solar.sun_times(new_sun_dates_ls, sun_lat, sun_lon, local_tz)
+            if sun_validation_dates > 0:
+                # the API reports whole minutes, so small differences are expected
+                diff_minutes = validate_sun_times(new_sun_df, sun_validation_dates)
+                if diff_minutes > sun_validation_minutes:
+                    print("WARNING: computed sunrise/sunset times differ from sunrise-sunset.org "
+                          "by up to %.1f minutes" % diff_minutes)
+        sun_archive.upsert(new_sun_df)
+
+        # this df takes along to make, so avoid rebuilding it
+        sun_archive.save()
+
+        # the annual tab's seasonal average of every date
+        seasonal.save_sun_agg(sun_archive.df, proj_path)
+        data_cache.bump_generation(proj_path)
+
+    msg = "New sunrise and sunset data has been added"
+    return [msg, sun_archive.df]
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""
+Per-user layout of the project data.
+
+Every data artifact (sleep frames, sunrise/sunset archive, caches, the sync
+job record and its lease) lives under a project dir, the proj_path argument
+which the data modules take.  Each user has a project dir of their own:
+
+    <proj_path>                         the owner's data, as before
+    <proj_path>users/<user_id>/data/    every other user's data
+
+so the data of different users never mixes, their syncs run side by side
+(see sync_jobs, whose job record and lease are per project dir) and any
+gunicorn worker serves any user.  Everything a sync or a callback needs
+between requests is kept in these files or in the browser session, never
+in a worker's memory, so consecutive requests of a session may be served by
+different workers.
+
+Users are added by the maintainer (python user_store.py add <user_id>), which
+creates their project dir with a login file holding a salted password hash.
+A user signs in with the app's /login route (see sign_in()), which stores
+their user id in the signed Flask session, so it can't be set or altered by
+the client.  The id of a session is only accepted while the user still has a
+project dir, and requests without a signed in user are the owner's.
+
+A user's Garmin account is read from account_fn in their project dir by the
+sync job (see read_account()), and a user without one can't sync.  The
+account file is only readable by the app's own OS user (see write_account()),
+the password in it is in plain text since the sync has to type it in.
+"""
+# import base packages
+import getpass, json, os, re, sys
+
+# import installed packages
+import flask
+from werkzeug.security import check_password_hash, generate_password_hash
+
+session_key = "sleep_user" # key of the Flask session holding the signed in user id
+users_dir = "users/" # dir holding the project dir of each user besides the owner
+login_fn = "data/user_login.json" # a user's "password_hash" for signing in to the app
+account_fn = "data/garmin_account.json" # a user's Garmin "user_name" and "password"
+
+_user_id_re = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def valid_user_id(user_id):
+    # user ids become dir names, so only plain names are accepted
+    return isinstance(user_id, str) and (_user_id_re.fullmatch(user_id) is not None)
+
+
+def user_path(user_id, proj_path=""):
+    """
+    Return the project dir of user_id, where None is the owner whose project
+    dir is proj_path itself.
+    """
+    if user_id is None:
+        return proj_path
+    if not valid_user_id(user_id):
+        raise ValueError("Invalid user id: %r" % user_id)
+    return proj_path + users_dir + user_id + "/"
+
+
+def _write_private(path, content):
+    # write a JSON file which only the app's OS user can read, swapping it in
+    # so readers never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_fn = path + ".tmp%d" % os.getpid()
+    fd = os.open(tmp_fn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fp:
+        json.dump(content, fp)
+    os.replace(tmp_fn, path)
+
+
+def _read_login(user_id, proj_path):
+    try:
+        with open(user_path(user_id, proj_path) + login_fn, "r") as fp:
+            return json.load(fp)["password_hash"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def is_user(user_id, proj_path=""):
+    # whether user_id names a user with a project dir, e.g. one not removed
+    # since signing in
+    return valid_user_id(user_id) and os.path.isdir(user_path(user_id, proj_path))
+
+
+def add_user(user_id, password, proj_path=""):
+    """
+    Create the project dir of user_id, who signs in with password, or set a
+    new password if the user exists already.
+    """
+    _write_private(user_path(user_id, proj_path) + login_fn,
+                   {"password_hash": generate_password_hash(password)})
+
+
+def sign_in(user_id, password, proj_path=""):
+    # signs the current session in as user_id, returns whether the password was right
+    password_hash = _read_login(user_id, proj_path) if valid_user_id(user_id) else None
+    if (password_hash is None) or (not check_password_hash(password_hash, password)):
+        return False
+    flask.session.clear()
+    flask.session[session_key] = user_id
+    return True
+
+
+def sign_out():
+    flask.session.pop(session_key, None)
+
+
+def request_user(proj_path=""):
+    # the signed in user id of the current request, None for the owner or
+    # outside of requests.  The signed session vouches for the id, which is
+    # resolved once per request
+    if not flask.has_request_context():
+        return None
+    if "sleep_user" not in flask.g:
+        user_id = flask.session.get(session_key)
+        flask.g.sleep_user = user_id if is_user(user_id, proj_path) else None
+    return flask.g.sleep_user
+
+
+def request_path(proj_path=""):
+    # the project dir of the current request's user
+    return user_path(request_user(proj_path), proj_path)
+
+
+def list_users(proj_path=""):
+    # the ids of every user with a project dir, besides the owner
+    try:
+        return sorted(entry.name for entry in os.scandir(proj_path + users_dir)
+                      if entry.is_dir() and valid_user_id(entry.name))
+    except OSError:
+        return []
+
+
+def write_account(user_proj_path, user_name, password):
+    # store a user's Garmin account, readable only by the app's OS user
+    _write_private(user_proj_path + account_fn, {"user_name": user_name, "password": password})
+
+
+def read_account(user_proj_path):
+    # a user's Garmin account, or None if they haven't set one up
+    try:
+        with open(user_proj_path + account_fn, "r") as fp:
+            account = json.load(fp)
+        return {"user_name": account["user_name"], "password": account["password"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+if __name__ == "__main__":
+    # python user_store.py add <user_id>      adds a user, or sets their password
+    # python user_store.py account [user_id]  sets the Garmin account of a user, or of the owner
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    user_id = sys.argv[2] if len(sys.argv) > 2 else None
+    if (command == "add") and valid_user_id(user_id):
+        add_user(user_id, getpass.getpass("Password of %s: " % user_id))
+    elif command == "account":
+        if (user_id is not None) and not is_user(user_id):
+            sys.exit("Unknown user: %s" % user_id)
+        write_account(user_path(user_id), input("Garmin user name: "), getpass.getpass("Garmin password: "))
+    else:
+        sys.exit("Usage: python user_store.py add <user_id> | account [user_id]")